@@ -0,0 +1,123 @@
+import json
+import math
+
+from scoring import CATEGORIES
+
+# Rating levels, as the prioritization rubric defines them
+RATINGS = ("Very High", "High", "Medium", "Low", "Very Low")
+
+# Response schema for structured-output mode (response_mime_type "application/json").
+# The API constrains the model's output to it; parse_analysis still validates, since a
+# response can be cut off at max_output_tokens.
+RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "ratings": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "category": {"type": "string", "format": "enum", "enum": list(CATEGORIES)},
+                    "rating": {"type": "string", "format": "enum", "enum": list(RATINGS)},
+                    "percent": {"type": "integer"},
+                    "justification": {"type": "string"},
+                },
+                "required": ["category", "rating", "percent", "justification"],
+            },
+        },
+        "conclusion": {"type": "string"},
+        "suggestions": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["ratings", "conclusion", "suggestions"],
+}
+
+
+class AnalysisFormatError(Exception):
+    """
+    Raised when a structured analysis does not match RESPONSE_SCHEMA. Not a
+    ValueError, which the SDK raises for blocked responses.
+    """
+
+
+class AnalysisTruncatedError(AnalysisFormatError):
+    """Raised when the model reached max_output_tokens before finishing an analysis, in either format."""
+
+
+def _text(value, what):
+    if not isinstance(value, str) or not value.strip():
+        raise AnalysisFormatError(f"{what} must be a non-empty string.")
+    return value.strip()
+
+
+def parse_analysis(raw_text):
+    """
+    Parses and validates a structured analysis. Returns {"ratings": [...], one
+    {"category", "rating", "percent", "justification"} per category in CATEGORIES
+    order, "conclusion": str, "suggestions": [str]}. Raises AnalysisFormatError.
+    """
+    try:
+        data = json.loads(raw_text)
+    except ValueError as e:
+        raise AnalysisFormatError(f"Analysis is not valid JSON: {e}") from None
+    if not isinstance(data, dict) or not isinstance(data.get("ratings"), list):
+        raise AnalysisFormatError("Analysis must be an object with a 'ratings' list.")
+
+    ratings = {}
+    for item in data["ratings"]:
+        if not isinstance(item, dict):
+            raise AnalysisFormatError("Each rating must be an object.")
+        category = item.get("category")
+        if category not in CATEGORIES:
+            raise AnalysisFormatError(f"Unknown category {category!r}.")
+        if category in ratings:
+            raise AnalysisFormatError(f"Category '{category}' is rated more than once.")
+        if item.get("rating") not in RATINGS:
+            raise AnalysisFormatError(f"Rating for '{category}' must be one of {', '.join(RATINGS)}.")
+        percent = item.get("percent")
+        if (isinstance(percent, bool) or not isinstance(percent, (int, float)) or not math.isfinite(percent)
+                or not 0 <= percent <= 100):
+            raise AnalysisFormatError(f"Percent for '{category}' must be a number from 0 to 100.")
+        ratings[category] = {
+            "category": category,
+            "rating": item["rating"],
+            "percent": int(round(percent)),
+            "justification": _text(item.get("justification"), f"Justification for '{category}'"),
+        }
+    missing = [category for category in CATEGORIES if category not in ratings]
+    if missing:
+        raise AnalysisFormatError(f"Missing ratings for: {', '.join(missing)}.")
+
+    suggestions = data.get("suggestions")
+    if not isinstance(suggestions, list):
+        raise AnalysisFormatError("'suggestions' must be a list of strings.")
+    return {
+        "ratings": [ratings[category] for category in CATEGORIES],
+        "conclusion": _text(data.get("conclusion"), "'conclusion'"),
+        "suggestions": [_text(s, "Each suggestion") for s in suggestions],
+    }
+
+
+def rating_vector(analysis):
+    """The Rating % of each category, in CATEGORIES order, ready for ScoringEngine.score_vector."""
+    return [float(item["percent"]) for item in analysis["ratings"]]
+
+
+def _cell(text):
+    # Keep each value inside its table cell
+    return " ".join(text.split()).replace("|", "\\|")
+
+
+def render_markdown(analysis):
+    """
+    Renders a parsed analysis as the Markdown the free-text prompt asks for (rating
+    table with heat-map spans, Conclusion, Enhancement Suggestions), so the UI,
+    chat context, reports and re-scoring read both formats the same way.
+    """
+    lines = ["| Category | Rating | Rating % | Justification |", "|---|---|---|---|"]
+    for item in analysis["ratings"]:
+        css_class = "rating-" + item["rating"].lower().replace(" ", "-")
+        lines.append(f"| **{item['category']}** | <span class=\"{css_class}\">{item['rating']}</span> | "
+                     f"{item['percent']}% | {_cell(item['justification'])} |")
+    lines += ["", "## Conclusion", analysis["conclusion"], "", "## Enhancement Suggestions"]
+    lines += [f"- {_cell(suggestion)}" for suggestion in analysis["suggestions"]]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from utils import thread_connection
+
+
+def make_analysis_key(field_values, model_name, prompt_version):
+    """
+    Builds the content address of an analysis: a SHA-256 over the model name,
+    the prompt version and the prompt-relevant field values of a row. Any two
+    rows that would produce the same prompt share the same key.
+    """
+    material = json.dumps([model_name, prompt_version, [str(v) for v in field_values]],
+                          ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+class AnalysisStore:
+    """
+    Disk-backed (SQLite) store of finished analyses, shared by all sessions and
+    worker processes.
+
+    Entries expire `ttl_seconds` after they were written, and the store is kept
+    under `max_bytes` of payload by evicting the least recently read entries.
+    Each entry records the session that wrote it, so a session can clear its own
+    analyses without removing ones other sessions produced.
+    """
+
+    # Reads refresh an entry's last access at most this often, to keep reads write-free
+    TOUCH_INTERVAL_SECONDS = 60
+
+    def __init__(self, db_path, ttl_seconds, max_bytes):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS analyses (
+                    key TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    ratings TEXT,
+                    owner TEXT
+                )
+            """)
+            # Stores created before rating vectors or owners were kept lack the columns
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(analyses)")}
+            if 'ratings' not in columns:
+                conn.execute("ALTER TABLE analyses ADD COLUMN ratings TEXT")
+            if 'owner' not in columns:
+                conn.execute("ALTER TABLE analyses ADD COLUMN owner TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_analyses_created_at ON analyses(created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_analyses_last_access ON analyses(last_access)")
+            # Running payload total, kept by triggers so the size limit needs no SUM scan.
+            # Seeded from the table the first time (stores that predate it).
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS store_size (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    bytes INTEGER NOT NULL
+                )
+            """)
+            conn.execute("INSERT OR IGNORE INTO store_size (id, bytes) SELECT 0, COALESCE(SUM(size), 0) FROM analyses")
+            conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS analyses_size_insert AFTER INSERT ON analyses
+                BEGIN UPDATE store_size SET bytes = bytes + new.size WHERE id = 0; END
+            """)
+            conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS analyses_size_delete AFTER DELETE ON analyses
+                BEGIN UPDATE store_size SET bytes = bytes - old.size WHERE id = 0; END
+            """)
+            conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS analyses_size_update AFTER UPDATE OF size ON analyses
+                BEGIN UPDATE store_size SET bytes = bytes + new.size - old.size WHERE id = 0; END
+            """)
+
+    def _connect(self):
+        return thread_connection(self._local, self.db_path)
+
+    def get(self, key):
+        """Returns the stored payload dict for `key`, or None if absent or expired."""
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT payload, created_at, last_access FROM analyses WHERE key = ?",
+                               (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now - self.ttl_seconds:
+                conn.execute("DELETE FROM analyses WHERE key = ?", (key,))
+                return None
+            if now - row[2] >= self.TOUCH_INTERVAL_SECONDS:
+                conn.execute("UPDATE analyses SET last_access = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def put(self, key, payload, ratings=None, ttl_seconds=None, owner=None):
+        """
+        Stores `payload` (a JSON-serializable dict) under `key`, optionally with
+        its rating vector for later re-scoring, then enforces TTL and size limits.
+        `ttl_seconds` gives the entry a shorter life than the store's TTL; `owner`
+        is the id of the session that produced it.
+        """
+        now = time.time()
+        # Entries expire by created_at, so a shorter life is recorded as an earlier creation
+        created_at = now
+        if ttl_seconds is not None and ttl_seconds < self.ttl_seconds:
+            created_at = now - (self.ttl_seconds - ttl_seconds)
+        data = json.dumps(payload, ensure_ascii=False)
+        with self._connect() as conn:
+            # An upsert rather than INSERT OR REPLACE, whose implicit delete skips the size trigger
+            conn.execute(
+                "INSERT INTO analyses (key, payload, size, created_at, last_access, ratings, owner) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET payload = excluded.payload, size = excluded.size, created_at = excluded.created_at, "
+                "last_access = excluded.last_access, ratings = excluded.ratings, owner = excluded.owner",
+                (key, data, len(data.encode('utf-8')), created_at, now, json.dumps(ratings) if ratings is not None else None, owner)
+            )
+            self._evict(conn, now)
+
+    def get_ratings(self, keys, parse_ratings):
+        """
+        Returns {key: rating vector} for the given keys that have an unexpired
+        analysis. Entries stored without a vector are parsed once with
+        `parse_ratings(analysis_text)` and the vector is saved for next time.
+        Does not count as a read for LRU purposes.
+        """
+        keys = list(dict.fromkeys(keys))
+        cutoff = time.time() - self.ttl_seconds
+        found = {}
+        backfill = []
+        with self._connect() as conn:
+            # Stay well under SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                query = f"SELECT key, ratings, payload FROM analyses WHERE created_at >= ? AND key IN ({placeholders})"
+                for key, ratings, payload in conn.execute(query, [cutoff, *chunk]):
+                    if ratings is None:
+                        vector = parse_ratings(json.loads(payload).get('analysis', ''))
+                        backfill.append((json.dumps(vector), key))
+                    else:
+                        vector = json.loads(ratings)
+                    found[key] = vector
+            if backfill:
+                conn.executemany("UPDATE analyses SET ratings = ? WHERE key = ?", backfill)
+        return found
+
+    def delete(self, keys, owner):
+        """
+        Deletes those of the given keys that `owner` produced and returns how many
+        entries were removed. Analyses other sessions produced are kept.
+        """
+        with self._connect() as conn:
+            # rowcount, unlike total_changes, leaves out the size trigger's updates
+            return conn.executemany("DELETE FROM analyses WHERE key = ? AND owner = ?",
+                                    ((k, owner) for k in keys)).rowcount
+
+    def stats(self):
+        with self._connect() as conn:
+            count = conn.execute("SELECT COUNT(*) FROM analyses").fetchone()[0]
+            total = conn.execute("SELECT bytes FROM store_size WHERE id = 0").fetchone()[0]
+        return {"entries": count, "bytes": total, "max_bytes": self.max_bytes, "ttl_seconds": self.ttl_seconds}
+
+    def _evict(self, conn, now):
+        conn.execute("DELETE FROM analyses WHERE created_at < ?", (now - self.ttl_seconds,))
+        total = conn.execute("SELECT bytes FROM store_size WHERE id = 0").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Walk entries from least to most recently read until enough bytes are freed
+        excess = total - self.max_bytes
+        doomed = []
+        for key, size in conn.execute("SELECT key, size FROM analyses ORDER BY last_access"):
+            doomed.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        conn.executemany("DELETE FROM analyses WHERE key = ?", doomed)
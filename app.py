@@ -1,38 +1,158 @@
 import logging
-from flask import Flask, request, jsonify, render_template, session, abort
+from flask import Blueprint, Flask, Response, request, jsonify, render_template, session, abort, stream_with_context, g
 import os
-import shutil
 import psutil
-import threading
 import time
 from datetime import timedelta, datetime
-from gmail_service import send_email
 from flask_cors import CORS
-import pandas as pd
-import google.generativeai as genai
-from google.generativeai.types import GenerationConfig
-from google.generativeai.generative_models import GenerativeModel
-from google.generativeai.client import configure
 import traceback
 from config import Config
 import functools
-import uuid
+import itertools
+import math
 import html # Import the html module for sanitization
-import re
+import json
+import uuid
+import binascii
+import gmail_service
+from df_cache import DataFrameCache
+import upload_store
+from batch_runner import BatchQueueFullError, BatchRunner
+from analysis_store import AnalysisStore, make_analysis_key
+from jobs import JobQueue, QueueFullError
+from singleflight import SingleFlight
+from chat_cache import ChatAnswerCache, make_chat_key
+from email_queue import EmailQueue, make_backend
+from upload_manager import UploadManager, UploadQuotaError
+from scheduler import Scheduler
+from model_router import ModelRouter
+from rate_limiter import RateLimiter, RateLimitedError
+from resilience import CircuitOpenError, ResilientCaller, upstream_failure_reason
+import scoring
+import analysis_schema
+from analysis_schema import AnalysisFormatError, AnalysisTruncatedError
+from scoring import ScoringEngine
+from prompt_templates import load_prompt
+import metrics
+import token_budget
+from report_renderer import render_report
 
 # Configure logging
-logging.basicConfig(filename='app.log', level=logging.ERROR,
+logging.basicConfig(filename=Config.LOG_FILE, level=logging.ERROR,
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
-# Configure the Google Generative AI SDK using our centralized config
-configure(api_key=Config.GOOGLE_API_KEY)
-
-app = Flask(__name__)
-app.config.from_object(Config)
-app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=1)
-CORS(app)
-
-model_instance = None  # Singleton for the AI model
+# Routes are registered on a blueprint; create_app() builds the Flask app around it
+bp = Blueprint('main', __name__)
+
+# Sessions, and the uploads they own, expire after this much inactivity
+SESSION_LIFETIME = timedelta(hours=1)
+
+# Parsed DataFrames for legacy CSV uploads, shared by all sessions so each file is parsed once
+df_cache = DataFrameCache(max_bytes=Config.DF_CACHE_MAX_BYTES)
+
+# Weighted Overall Priority scoring with the approved weights; fails fast on a bad configuration
+scoring_engine = ScoringEngine(Config.PRIORITY_WEIGHTS)
+
+# Finished analyses shared by all users, keyed by the content of the prompt
+analysis_store = AnalysisStore(
+    Config.ANALYSIS_STORE_PATH,
+    ttl_seconds=Config.ANALYSIS_STORE_TTL_HOURS * 3600,
+    max_bytes=Config.ANALYSIS_STORE_MAX_BYTES
+)
+
+# Answers to repeated chatbot questions about the same analysis
+chat_cache = ChatAnswerCache(
+    max_entries=Config.CHAT_CACHE_MAX_ENTRIES,
+    ttl_seconds=Config.CHAT_CACHE_TTL_SECONDS
+)
+
+# Concurrent requests for the same analysis key share one model call
+analysis_flights = SingleFlight()
+
+# Deadlines, retries, hedging and a circuit breaker per model for every model call
+llm_caller = ResilientCaller(
+    max_workers=Config.LLM_CALL_WORKERS,
+    retry_attempts=Config.LLM_RETRY_ATTEMPTS,
+    retry_base_seconds=Config.LLM_RETRY_BASE_SECONDS,
+    retry_max_seconds=Config.LLM_RETRY_MAX_SECONDS,
+    hedge_percentile=Config.LLM_HEDGE_PERCENTILE,
+    hedge_min_samples=Config.LLM_HEDGE_MIN_SAMPLES,
+    hedge_max_ratio=Config.LLM_HEDGE_MAX_RATIO,
+    breaker_failure_threshold=Config.LLM_BREAKER_FAILURE_THRESHOLD,
+    breaker_reset_seconds=Config.LLM_BREAKER_RESET_SECONDS
+)
+
+# Requests and tokens per minute per model, shared by all worker processes; interactive
+# calls are served before batch ones
+rate_limiter = RateLimiter(
+    Config.RATE_LIMIT_PATH,
+    requests_per_minute=Config.LLM_REQUESTS_PER_MINUTE,
+    tokens_per_minute=Config.LLM_TOKENS_PER_MINUTE,
+    interactive_reserve=Config.LLM_RATE_LIMIT_INTERACTIVE_RESERVE
+)
+
+# Uploaded files live outside the web root; the manifest tracks their owner, size and expiry
+UPLOAD_FOLDER = Config.UPLOAD_FOLDER
+upload_manager = UploadManager(
+    Config.UPLOAD_MANIFEST_PATH,
+    UPLOAD_FOLDER,
+    idle_ttl_seconds=SESSION_LIFETIME.total_seconds(),
+    session_quota_bytes=Config.UPLOAD_SESSION_QUOTA_BYTES,
+    global_quota_bytes=Config.UPLOAD_GLOBAL_QUOTA_BYTES,
+    on_delete=df_cache.invalidate
+)
+
+# Bounded worker pool for /prioritize_all, shared by all batches. Failed rows report the
+# same client-safe messages as /prioritize (see model_error_response).
+batch_runner = BatchRunner(
+    Config.BATCH_STORE_PATH,
+    max_workers=Config.BATCH_MAX_WORKERS,
+    max_pending_rows=Config.BATCH_MAX_PENDING_ROWS,
+    retention_seconds=Config.BATCH_RETENTION_SECONDS,
+    error_message=lambda e: model_error_response(e, "An internal server error occurred during prioritization.")[0]["error"]
+)
+
+# Background workers for the asynchronous /jobs API
+job_queue = JobQueue(
+    Config.JOB_STORE_PATH,
+    num_workers=Config.JOB_WORKERS,
+    max_queued=Config.JOB_QUEUE_MAX,
+    retention_seconds=Config.JOB_RETENTION_SECONDS
+)
+
+# Outbox for /send-report; a background thread delivers and retries
+email_queue = EmailQueue(
+    Config.EMAIL_QUEUE_PATH,
+    backend=make_backend(Config.EMAIL_BACKEND, smtp_host=Config.SMTP_HOST, smtp_port=Config.SMTP_PORT,
+                         sender=Config.EMAIL_SENDER),
+    max_attempts=Config.EMAIL_MAX_ATTEMPTS,
+    retry_base_seconds=Config.EMAIL_RETRY_BASE_SECONDS,
+    retry_max_seconds=Config.EMAIL_RETRY_MAX_SECONDS
+)
+
+# Shared-cache counters kept by their owners, read at scrape time
+metrics.REGISTRY.callback('aiprio_dataframe_cache_hits_total', 'Parsed-DataFrame cache hits.', 'counter', lambda: df_cache.hits)
+metrics.REGISTRY.callback('aiprio_dataframe_cache_misses_total', 'Parsed-DataFrame cache misses.', 'counter', lambda: df_cache.misses)
+metrics.REGISTRY.callback('aiprio_dataframe_cache_bytes', 'Memory held by cached DataFrames.', 'gauge', lambda: df_cache.stats()['bytes'])
+metrics.REGISTRY.callback('aiprio_upload_bytes', 'Bytes held by upload files in the manifest.', 'gauge', lambda: upload_manager.usage()['bytes'])
+metrics.REGISTRY.callback('aiprio_email_queue_depth', 'Emails waiting to be sent, including ones awaiting a retry.', 'gauge', email_queue.depth)
+metrics.REGISTRY.callback('aiprio_analysis_flights_in_flight', 'Distinct analyses currently being generated.', 'gauge', analysis_flights.in_flight)
+metrics.REGISTRY.callback('aiprio_llm_circuits_open', 'Models whose circuit breaker is currently open.', 'gauge', llm_caller.open_circuits)
+metrics.REGISTRY.callback('aiprio_llm_queue_waiting', 'Model calls in this process waiting for rate-limit budget.', 'gauge', rate_limiter.waiting)
+
+@bp.before_app_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@bp.after_app_request
+def record_request_latency(response):
+    start = g.get('request_start')
+    if start is not None:
+        # Label by route template (not the raw path) to keep label cardinality bounded
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.REQUEST_LATENCY.observe(time.perf_counter() - start, route=route,
+                                        method=request.method, status=response.status_code)
+    return response
 
 # --- Basic Authentication Placeholder ---
 # IMPORTANT: This is a placeholder for demonstration purposes only.
@@ -49,18 +169,40 @@ def api_key_required(f):
             abort(401, description="Unauthorized: Missing or invalid API Key")
     return decorated_function
 
-@app.route('/')
+@bp.route('/')
 def home():
     """Render the main page (index.html)."""
     # Explicitly pass the module-level API_KEY to the template
     return render_template('index.html', API_KEY_FROM_BACKEND=API_KEY)
 
-@app.route('/about')
+@bp.route('/about')
 def about():
     """Render the About page."""
     return render_template('about.html')
 
-@app.route('/upload', methods=['POST'])
+# Required columns in uploaded CSVs, to enrich prioritization evaluation.
+# This list now reflects the columns expected after the user's modification
+REQUIRED_COLUMNS = [
+    'Title of Your Project',
+    'Directorate Submitting the Request',
+    'Briefly explain the current procedure or process you are proposing for RPA or AI',
+    'What is the main problem or bottleneck you are experiencing with this current process?',
+    'In brief, explain your RPA or AI idea to address the problem:',
+    'What type of automation are you proposing?',
+    'Beyond time savings, what other benefits do you anticipate from this automation?',
+    'Does this process directly impact product safety, approvals, or regulatory compliance timelines?',
+    'How will you measure the success or effectiveness of this automation? List key performance indicators (KPIs):',
+    'Is the data required for this automation readily available and accessible in a digital format?',
+    'How does this proposed automation align with the strategic goals and objectives of your Directorate and the SFDA?',
+    # 'How complex do you anticipate the integration with existing electronic systems will be?', # This column is intentionally removed from requirements
+    'Approximately how many total working hours are spent on this procedure each month?',
+    'How many employees currently work on this procedure?',
+    'How many different electronic systems are typically used during this procedure?',
+    'How many times is this procedure performed on average each month?',
+    'What is the estimated reduction in total working hours per month you expect to achieve after implementing RPA or AI?'
+]
+
+@bp.route('/upload', methods=['POST'])
 @api_key_required # Apply authentication to the upload route
 def upload_csv():
     """
@@ -81,314 +223,238 @@ def upload_csv():
             logging.error(f"Attempted upload of non-CSV file or file with no filename: {file.filename}")
             return jsonify({"error": "Only CSV files are allowed."}), 400
 
-        # Read CSV (assumes comma-delimited)
-        df = pd.read_csv(file.stream)
-        # Clean headers by stripping extra spaces
-        df.columns = df.columns.str.strip()
-
-        # Define required columns to enrich prioritization evaluation.
-        # This list now reflects the columns expected after the user's modification
-        required_columns = [
-            'Title of Your Project',
-            'Directorate Submitting the Request',
-            'Briefly explain the current procedure or process you are proposing for RPA or AI',
-            'What is the main problem or bottleneck you are experiencing with this current process?',
-            'In brief, explain your RPA or AI idea to address the problem:',
-            'What type of automation are you proposing?',
-            'Beyond time savings, what other benefits do you anticipate from this automation?',
-            'Does this process directly impact product safety, approvals, or regulatory compliance timelines?',
-            'How will you measure the success or effectiveness of this automation? List key performance indicators (KPIs):',
-            'Is the data required for this automation readily available and accessible in a digital format?',
-            'How does this proposed automation align with the strategic goals and objectives of your Directorate and the SFDA?',
-            # 'How complex do you anticipate the integration with existing electronic systems will be?', # This column is intentionally removed from requirements
-            'Approximately how many total working hours are spent on this procedure each month?',
-            'How many employees currently work on this procedure?',
-            'How many different electronic systems are typically used during this procedure?',
-            'How many times is this procedure performed on average each month?',
-            'What is the estimated reduction in total working hours per month you expect to achieve after implementing RPA or AI?'
-        ]
-
-
-        # Verify required columns exist in CSV
-        missing_cols = [col for col in required_columns if col not in df.columns]
-        if missing_cols:
-            print(f"Upload failed. Missing columns: {missing_cols}")
-            return jsonify({"error": f"Missing required columns in CSV: {', '.join(missing_cols)}"}), 400
-
-        # Ensure the dedicated uploads directory exists outside the web root
-        # This path is relative to the app.py file
-        upload_folder = os.path.join(app.root_path, 'uploaded_files')
-        os.makedirs(upload_folder, exist_ok=True)
-
-        # Generate a unique filename for the CSV
-        unique_filename = f"uploaded_data_{uuid.uuid4()}.csv"
-        temp_file_path = os.path.join(upload_folder, unique_filename)
-
-        # Save the DataFrame to the temporary file
-        df.to_csv(temp_file_path, index=False)
-
-        # Store only the file path in the session
+        # Parse the CSV (assumes comma-delimited) in chunks straight to a memory-mappable
+        # Arrow file in the uploads directory outside the web root. The header is checked
+        # against REQUIRED_COLUMNS on the first chunk, so bad files fail fast.
+        try:
+            with metrics.STAGE_LATENCY.time(stage='upload_ingest'):
+                temp_file_path, titles = upload_store.ingest_csv(
+                    file.stream, REQUIRED_COLUMNS, UPLOAD_FOLDER, title_column='Title of Your Project'
+                )
+        except upload_store.MissingColumnsError as e:
+            print(f"Upload failed. Missing columns: {e.missing_columns}")
+            return jsonify({"error": f"Missing required columns in CSV: {', '.join(e.missing_columns)}"}), 400
+
+        # The ingest read the stream to the end, so its position is the file size
+        metrics.UPLOAD_SIZE_BYTES.observe(file.stream.tell())
+        metrics.UPLOAD_ROWS.observe(len(titles))
+
+        # Record the file against this session (evicting older uploads over quota); the
+        # session's previous upload is replaced, so it is deleted right away
+        upload_session_id = session.setdefault('upload_session_id', uuid.uuid4().hex)
+        try:
+            upload_manager.register(temp_file_path, upload_session_id)
+        except UploadQuotaError as e:
+            return jsonify({"error": f"The uploaded file is too large ({e.size // (1024 * 1024)} MB stored; "
+                                     f"the limit is {e.quota // (1024 * 1024)} MB)."}), 413
+        upload_manager.release_session(upload_session_id, keep=temp_file_path)
+
+        # Store only the file path in the session. The session is permanent so it expires
+        # after PERMANENT_SESSION_LIFETIME of inactivity, together with its upload.
+        session.permanent = True
         session['df_file_path'] = temp_file_path
-        # Initialize or clear analysis cache for the new session
-        session['analysis_cache'] = {}
 
         # Build list of projects (to populate dropdown)
-        requests_list = [
-            {"index": idx, "title": row.get('Title of Your Project', f'Row {idx+1} - No Title')}
-            for idx, (_, row) in enumerate(df.iterrows())
-        ]
+        requests_list = [{"index": idx, "title": title} for idx, title in enumerate(titles)]
 
         return jsonify({"requests": requests_list})
 
-    except pd.errors.EmptyDataError:
+    except upload_store.EmptyUploadError:
         return jsonify({"error": "CSV file is empty."}), 400
     except Exception as e:
         logging.error("Error processing CSV file in /upload route", exc_info=True)
         return jsonify({"error": "An internal server error occurred during CSV processing."}), 500
 
-@app.route('/preview_request/<int:row_index>', methods=['GET'])
+def current_upload_path():
+    """
+    Returns the current session's upload file path, or None. Each use extends the
+    upload's expiry in the manifest, in step with the session cookie.
+    """
+    df_file_path = session.get('df_file_path')
+    if df_file_path is not None:
+        upload_manager.touch(df_file_path)
+    return df_file_path
+
+@bp.route('/preview_request/<int:row_index>', methods=['GET'])
 def preview_request(row_index):
     """
     Returns the raw details (all columns) for a single row (selected request)
     with missing values (NaN) replaced by None for valid JSON output.
     """
-    df_file_path = session.get('df_file_path')
+    df_file_path = current_upload_path()
     if df_file_path is None:
         return jsonify({"error": "No CSV uploaded or processed yet in this session."}), 400
 
     try:
-        df = pd.read_csv(df_file_path)
+        with metrics.STAGE_LATENCY.time(stage='row_read'):
+            num_rows = upload_store.count_rows(df_file_path, df_cache)
+            if num_rows == 0:
+                return jsonify({"error": "Uploaded data is empty or corrupted."}), 400
+            # Only the requested row is read; missing values come back as None (null in JSON)
+            row_data = upload_store.read_row(df_file_path, row_index, df_cache)
+    except IndexError:
+        return jsonify({"error": "Row index out of range."}), 400
     except FileNotFoundError:
         return jsonify({"error": "Uploaded CSV file not found on server. Please re-upload."}), 404
     except Exception as e:
         logging.error("Error reading CSV from file in /preview_request route", exc_info=True)
         return jsonify({"error": "An internal server error occurred while reading the CSV file."}), 500
 
-    if df.empty:
-        return jsonify({"error": "Uploaded data is empty or corrupted."}), 400
-
-    if row_index < 0 or row_index >= len(df):
-        return jsonify({"error": "Row index out of range."}), 400
-
-    # Retrieve the row as a Series
-    row_series = df.iloc[row_index]
-    # Replace NaN with None (so it serializes to null in JSON)
-    row_data = row_series.where(row_series.notna(), None).to_dict()
     return jsonify(row_data)
 
-# Performance monitoring decorator
+# Performance monitoring decorator: records execution time in the function latency histogram (/metrics)
 def timing_decorator(func):
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        start_time = time.time()
-        result = func(*args, **kwargs)
-        end_time = time.time()
-        execution_time = end_time - start_time
-        print(f"Function {func.__name__} took {execution_time:.2f} seconds to execute")
-        return result
+        with metrics.FUNCTION_LATENCY.time(function=func.__name__):
+            return func(*args, **kwargs)
     return wrapper
 
-# Get or create the AI model instance (singleton pattern)
-def get_model():
-    global model_instance
-    if model_instance is None:
-        print("Initializing new AI model instance")
-        model_instance = GenerativeModel(
-            Config.GENAI_MODEL_NAME,
-            generation_config=GenerationConfig(
-                temperature=0.9,
-                top_p=0.01,
-                top_k=2,
-                max_output_tokens=Config.MAX_OUTPUT_TOKENS
-            ),
-            safety_settings=[
-                {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-                {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-                {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-                {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"}
-            ]
-        )
-    return model_instance
+@functools.lru_cache(maxsize=None)
+def configure_genai():
+    """Configures the Google Generative AI SDK using our centralized config, once."""
+    from google.generativeai.client import configure
+    configure(api_key=Config.GOOGLE_API_KEY)
 
-def parse_and_calculate_score(markdown_text):
+def build_model(profile_name, model_name):
     """
-    Parses the AI's markdown response to extract ratings and calculate a weighted score.
-    """
-    WEIGHTS = {
-        "Strategic Alignment": 0.10,
-        "Potential Impact": 0.05,
-        "Complexity & Implementation Difficulty": 0.0,
-        "Urgency & Necessity": 0.025,
-        "Risk & Challenges": 0.025,
-        "Hours Spent each month": 0.35,
-        "Number of Employees": 0.40,
-        "Number of Systems": 0.025,
-        "Stakeholders Impacted": 0.025
-    }
-    
-    total_score = 0.0
-    
-    # New, more robust regex to handle markdown table structure, including bolded category names.
-    # It specifically looks for the category name inside asterisks and extracts the percentage from the third column.
-    pattern = re.compile(
-        r"\|\s*\*\*(?P<category>[\w\s&]+?)\*\*\s*\|"  # 1. Category: Captures text between `| **` and `** |`
-        r".*?\|"                                     # 2. Rating: Non-greedy match for the second column
-        r"\s*(?P<percentage>\d+)%\s*\|",              # 3. Rating %: Captures the digits before a '%' in the third column
-        re.MULTILINE
+    Creates a GenerativeModel for a model profile (Config.MODEL_PROFILES) with the
+    profile's generation settings and the app's safety settings.
+    The SDK is imported and configured here, on first use, since it is by far the
+    slowest import in the app and pages like / and /about never need it.
+    """
+    from google.generativeai.types import GenerationConfig
+    from google.generativeai.generative_models import GenerativeModel
+
+    configure_genai()
+    profile = Config.MODEL_PROFILES[profile_name]
+    structured = {}
+    if profile.get('output_format') == 'json':
+        # The API constrains the answer to the schema; the JSON variant of the prompt explains the fields
+        structured = {"response_mime_type": "application/json", "response_schema": analysis_schema.RESPONSE_SCHEMA}
+    return GenerativeModel(
+        model_name,
+        generation_config=GenerationConfig(
+            temperature=profile['temperature'],
+            top_p=profile['top_p'],
+            top_k=profile['top_k'],
+            max_output_tokens=profile['max_output_tokens'],
+            **structured
+        ),
+        safety_settings=[
+            {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+            {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+            {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+            {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"}
+        ],
+        # The prioritization rubric is attached once as the system instruction, so each call
+        # only sends the request details
+        system_instruction=system_instruction(profile_name)
     )
 
-    matches = pattern.finditer(markdown_text)
-    
-    for match in matches:
-        category = match.group("category").strip()
-        percentage = int(match.group("percentage"))
-        
-        if category in WEIGHTS:
-            weighted_value = (percentage / 100.0) * WEIGHTS[category]
-            total_score += weighted_value
-
-    # Return the final score as a percentage, rounded to two decimal places
-    final_score = round(total_score * 100, 2)
-    return final_score
-
-@app.route('/prioritize/<int:row_index>', methods=['GET'])
-@api_key_required # Apply authentication to the prioritize route
-@timing_decorator
-def prioritize_single(row_index):
-    """
-    Generates an AI-based analysis for the selected row.
-    Uses Google Generative AI to produce a Markdown table (with embedded heat map markup) and a conclusion.
-    Implements caching to avoid redundant AI calls for the same row.
-    """
-    df_file_path = session.get('df_file_path')
-    analysis_cache = session.get('analysis_cache', {})
+@functools.lru_cache(maxsize=None)
+def system_instruction(profile_name):
+    """The system instruction text of a model profile, or None if it has none."""
+    profile = Config.MODEL_PROFILES[profile_name]
+    system_prompt = profile.get('system_prompt')
+    if not system_prompt:
+        return None
+    if profile.get('output_format') == 'json':
+        system_prompt = f"{system_prompt}_json"
+    return load_prompt(system_prompt, Config.PROMPT_VERSION)
 
-    if df_file_path is None:
-        return jsonify({"error": "No CSV uploaded or processed yet in this session."}), 400
+def input_token_estimate(prompt, kind):
+    """Estimated input tokens of a call: the prompt plus the system instruction sent with it."""
+    return token_budget.estimate_tokens(prompt) + token_budget.estimate_tokens(system_instruction(kind))
 
-    try:
-        df = pd.read_csv(df_file_path)
-    except FileNotFoundError:
-        return jsonify({"error": "Uploaded CSV file not found on server. Please re-upload."}), 404
-    except Exception as e:
-        return jsonify({"error": f"Error reading CSV from file: {e}"}), 500
+# One model instance per profile and model name, built on first use, with failover to
+# each profile's fallback model
+model_router = ModelRouter(Config.MODEL_PROFILES, build=build_model, caller=llm_caller, limiter=rate_limiter)
 
-    if df.empty:
-        return jsonify({"error": "Uploaded data is empty or corrupted."}), 400
+# Prioritization answers are either JSON (validated, scored and rendered here) or Markdown (parsed)
+STRUCTURED_ANALYSIS = Config.MODEL_PROFILES['prioritize'].get('output_format') == 'json'
 
-    if row_index < 0 or row_index >= len(df):
-        return jsonify({"error": "Row index out of range."}), 400
+def parse_and_calculate_score(markdown_text):
+    """
+    Parses the AI's markdown response to extract ratings and calculate a weighted score
+    using the approved weights in Config.PRIORITY_WEIGHTS.
+    """
+    with metrics.STAGE_LATENCY.time(stage='score_parse'):
+        return scoring_engine.score(markdown_text)
 
-    # Check if we already have this analysis cached
-    if row_index in analysis_cache:
-        print(f"Using cached analysis for row {row_index}")
-        return jsonify(analysis_cache[row_index])
+def get_row_value(row, key, default="N/A"):
+    """
+    Safely retrieves a column's value from an upload row.
+    Missing columns and empty cells both fall back to the default.
+    """
+    value = row.get(key)
+    if value is not None:
+        return value
+    return default
+
+# Columns interpolated into the prioritization prompt. Together with the model name and
+# Config.PROMPT_VERSION they determine the analysis, so they form its cache key.
+PROMPT_FIELDS = (
+    'Title of Your Project',
+    'Directorate Submitting the Request',
+    'Briefly explain the current procedure or process you are proposing for RPA or AI',
+    'What is the main problem or bottleneck you are experiencing with this current process?',
+    'In brief, explain your RPA or AI idea to address the problem:',
+    'What type of automation are you proposing?',
+    'What is the estimated reduction in total working hours per month you expect to achieve after implementing RPA or AI?',
+    'Beyond time savings, what other benefits do you anticipate from this automation?',
+    'How will you measure the success or effectiveness of this automation? List key performance indicators (KPIs):',
+    'Is the data required for this automation readily available and accessible in a digital format?',
+    'How does this proposed automation align with the strategic goals and objectives of your Directorate and the SFDA?',
+    'Approximately how many total working hours are spent on this procedure each month?',
+    'How many employees currently work on this procedure?',
+    'How many different electronic systems are typically used during this procedure?',
+    'How many times is this procedure performed on average each month?',
+)
+
+def prepare_prompt_fields(row):
+    """
+    Returns ({field: text}, truncated_fields) for PROMPT_FIELDS as they go into the
+    prompt: whitespace normalized and cut to the field's token budget, so a document
+    pasted into one answer cannot blow up the latency and cost of the call.
+    """
+    fields = {}
+    truncated_fields = []
+    for field in PROMPT_FIELDS:
+        budget = Config.PROMPT_FIELD_TOKEN_BUDGETS.get(field, Config.PROMPT_FIELD_DEFAULT_TOKEN_BUDGET)
+        fields[field], truncated = token_budget.fit_field(get_row_value(row, field), budget)
+        if truncated:
+            truncated_fields.append(field)
+    return fields, truncated_fields
+
+def analysis_key_for_row(row):
+    """
+    Returns the content-addressed analysis store key for an upload row.
+    The key covers the prepared field values, i.e. exactly what the model sees.
+    """
+    fields, _ = prepare_prompt_fields(row)
+    # JSON-mode analyses come from a different prompt, so they are stored under their own keys
+    prompt_version = f"{Config.PROMPT_VERSION}-json" if STRUCTURED_ANALYSIS else Config.PROMPT_VERSION
+    return make_analysis_key(
+        (fields[field] for field in PROMPT_FIELDS),
+        Config.MODEL_PROFILES['prioritize']['model'],
+        prompt_version
+    )
 
-    try:
-        # Use .loc for better performance with a single row
-        row = df.loc[row_index]
-
-        # Helper function to safely retrieve a column's value.
-        def get_safe(key, default="N/A"):
-            # Check if the key exists in the row before accessing it
-            if key in row and pd.notna(row.loc[key]):
-                 return row.loc[key]
-            return default
-
-        # Reconstructed prompt with the "Enhancement Suggestions" section restored
-        prompt = f"""You are an SFDA Pharmacist Business Analyst created by Mohammed Fouda your job is evaluating an AI automation request.
-As a pharmacist within the Saudi Food and Drug Authority (SFDA), consider the impact on regulatory compliance, patient safety, and pharmaceutical quality.
-
-Please produce your analysis as follows:
-
-1. A single **Markdown table** with columns: **Category**, **Rating**, **Rating %**, and **Justification**.
-    For the **Rating** column, please use one of the following values: "Very High", "High", "Medium", "Low", or "Very Low".
-    For the **Rating %** column, use the following values objuctively based on the rating:
-    - For 'Very High', select a specific percentage between 90% and 100% (e.g., 95%).
-    - For 'High', select a specific percentage between 75% and 89% (e.g., 85%).
-    - For 'Medium', select a specific percentage between 50% and 74% (e.g., 65%).
-    - For 'Low', select a specific percentage between 25% and 49% (e.g., 35%).
-    - For 'Very Low', select a specific percentage between 0% and 24% (e.g., 15%).
-    Crucially, wrap each rating text in an HTML span element with a class corresponding to the rating level in lowercase with hyphens.
-    For example, if the rating is High, output: <span class="rating-high">High</span>.
-    Each row should represent one of the following categories:
-
-    **1. Strategic Alignment**
-    Provide at least 4 sentences discussing how well the request aligns with SFDA's Fourth Strategic Plan (2023-2027). Consider the following three strategic themes:
-       - **Products Safety:** Ensuring the safety and quality of regulated products by developing regulatory systems, improving communication and awareness, and establishing controls for new technology and biotech products.
-       - **Local and International Partnerships:** Enhancing product availability, boosting international leadership, supporting research and innovation, and enabling investor engagement.
-       - **Operational Excellence:** Improving internal operations by diversifying income resources, developing human capital, and increasing the use of advanced digital technology.
-    Based on the number of these strategic themes the request addresses:
-       - If it aligns with 1 theme, assign a rating of **Medium** (e.g., "Medium (60%)").
-       - If it aligns with 2 themes, assign a rating of **High** (e.g., "High (85%)").
-       - If it aligns with all 3 themes, assign a rating of **Very High** (e.g., "Very High (95%)").
-
-
-    **2. Potential Impact**
-    Provide at least 4 sentences on expected benefits (efficiency, compliance, public health), including quantitative estimates if available.
-
-    **3. Complexity & Implementation Difficulty**
-    Provide at least 4 sentences on anticipated challenges such as integration issues and data availability.
-
-    **4. Urgency & Necessity**
-    Provide at least 3 sentences explaining any time sensitivity.
-
-    **5. Risk & Challenges**
-    Provide at least 3 sentences discussing potential risks or barriers.
-
-    **6. Hours Spent each month**
-     - Use numeric anchors if given (approximate if text):
- • 1–10 => Very Low
- • 11–20 => Low
- • 21–30 => Medium
- • 31–40 => High
- • 41+ => Very High
-     Provide 3+ sentences on workload implications, ROI, etc. couse the AI or RPA will reduce the number of hours needed to do the task.
-
-    **7. Number of Employees**
-- Use numeric anchors (approximate if text):
- • 1–2 => Very Low
- • 3–5 => Low
- • 6–10 => Medium
- • 11–15 => High
- • 16+ => Very High
-     Provide 3+ sentences referencing workforce impact or resource availability for example if many employees are involved then it is a high impact. couse the the AI or RPA will reduce the number of employees needed to do the task.
-
-    **8. Number of Systems**
-- Fewer systems = simpler (approximate if text):
- • 0 => Very High (extremely simple)
- • 1 => High
- • 2 => Medium
- • 3 => Low
- • 4+ => Very Low (complex)
-     Provide 3+ sentences discussing integration complexity. cous the more complex the system the more time it will take to integrate the AI or RPA with the system.
-
-    **9. Stakeholders Impacted**
-- Use numeric anchors (approximate if text):
- • 1 => Very Low
- • 2–3 => Low
- • 4–5 => Medium
- • 6–7 => High
- • 8+ => Very High
-Provide 3+ sentences explaining who is involved, potential collaboration, or cross-department benefits. for example more department get benfit from th AI or RPA the greater the the impact of reducing workload .
-
-**PART 2: Conclusion**
-Immediately after the table, include a 4–5 sentence concluding paragraph under the exact Markdown heading `## Conclusion`.
-This paragraph must summarize key takeaways from the analysis and recommend next steps (e.g., pilot testing, further data validation, stakeholder consultation).
-
-**PART 3: Enhancement Suggestions**
-CRITICAL AND MANDATORY: Immediately after the Conclusion, you MUST add a new section with the exact Markdown heading `## Enhancement Suggestions`.
-Under this heading, provide 1 to 3 concise, actionable suggestions to improve or expand upon the "RPA or AI idea" described in the "Request Details".
-These suggestions should be practical and aim to add more value or address potential gaps. Consider aspects such as:
-    - Leveraging additional data sources not mentioned.
-    - Exploring complementary AI techniques (e.g., Natural Language Processing, Machine Learning for prediction, Computer Vision if applicable).
-    - Ways to mitigate identified risks or challenges.
-    - Ideas for improving user experience or the integration of the proposed solution.
-    - Expanding the scope of the automation to cover related tasks.
-Each suggestion should be clearly explained in 1-2 sentences.
-
-----
-**Request Details:**
+def build_prioritization_prompt(row):
+    """
+    Builds the per-row part of the prioritization prompt for an upload row (a dict of
+    column -> value). The rubric itself is the model's system instruction (see build_model).
+    Field values are normalized and budgeted by prepare_prompt_fields.
+    """
+    fields, truncated_fields = prepare_prompt_fields(row)
+    if truncated_fields:
+        metrics.PROMPT_FIELDS_TRUNCATED.inc(len(truncated_fields))
+
+    def get_safe(key):
+        return fields[key]
+
+    return f"""**Request Details:**
 Title: {get_safe('Title of Your Project')}
 Directorate: {get_safe('Directorate Submitting the Request')}
 Procedure Description: {get_safe('Briefly explain the current procedure or process you are proposing for RPA or AI')}
@@ -406,50 +472,361 @@ System Count: {get_safe('How many different electronic systems are typically use
 Procedure Frequency: {get_safe('How many times is this procedure performed on average each month?')}
 """
 
-        # Use the singleton model instance instead of creating a new one each time
-        model = get_model()
+def add_overall_priority(analysis_text, calculated_score=None):
+    """
+    Calculates the weighted score for an analysis (unless it is given) and injects
+    it as an "Overall Priority" table row just before the "## Conclusion" heading.
+    Returns the updated analysis text and the score.
+    """
+    if calculated_score is None:
+        calculated_score = parse_and_calculate_score(analysis_text)
+
+    # Format the new table row for the overall score
+    overall_priority_row = f"\n| **Overall Priority** | | **{calculated_score}%** | A weighted score calculated based on all factors. |"
+
+    # Inject the new row before the "## Conclusion" heading
+    conclusion_heading = "## Conclusion"
+    if conclusion_heading in analysis_text:
+        parts = analysis_text.split(conclusion_heading, 1)
+        table_part = parts[0].rstrip()
+        conclusion_part = parts[1]
+        # Ensure proper spacing for Markdown rendering
+        return table_part + overall_priority_row + "\n\n" + conclusion_heading + conclusion_part, calculated_score
+    # Fallback in case the conclusion heading is missing
+    return analysis_text + overall_priority_row, calculated_score
+
+def score_analysis(raw_text):
+    """
+    Reads the ratings from a prioritization response and scores them. Returns
+    (analysis Markdown with the Overall Priority row, score, rating vector).
+    JSON responses are validated and rendered to Markdown here, and raise
+    AnalysisFormatError if they do not match the schema. Markdown responses are
+    parsed; categories missing from the table count as 0.
+    """
+    if STRUCTURED_ANALYSIS:
+        try:
+            with metrics.STAGE_LATENCY.time(stage='score_parse'):
+                analysis = analysis_schema.parse_analysis(raw_text)
+        except AnalysisFormatError:
+            metrics.ANALYSIS_FORMAT_ERRORS.inc(format='json')
+            raise
+        ratings = analysis_schema.rating_vector(analysis)
+        markdown_text = analysis_schema.render_markdown(analysis)
+    else:
+        with metrics.STAGE_LATENCY.time(stage='score_parse'):
+            found = scoring.parse_rating_percentages(raw_text)
+        if len(found) < len(scoring.CATEGORIES):
+            metrics.ANALYSIS_FORMAT_ERRORS.inc(format='markdown')
+        ratings = [found.get(category, 0.0) for category in scoring.CATEGORIES]
+        markdown_text = raw_text
+    calculated_score = scoring_engine.score_vector(ratings)
+    analysis_text, _ = add_overall_priority(markdown_text, calculated_score)
+    return analysis_text, calculated_score, ratings
+
+def store_analysis(row, key, raw_text, model_name, owner=None):
+    """
+    Scores a finished model response, saves it to the shared analysis store
+    under `key` and returns the result payload with its "analysis_id" (without
+    the row index). `model_name` records which model wrote it, since a fallback
+    model may have stood in for the primary; such analyses are kept for
+    Config.ANALYSIS_STORE_FALLBACK_TTL_MINUTES only, as the key names the primary.
+    `owner` is the upload session id, which /analysis/clear may delete it for.
+    """
+    analysis_text, calculated_score, ratings = score_analysis(raw_text.strip())
+    result_data = {
+        "title": get_row_value(row, 'Title of Your Project'),
+        "directorate": get_row_value(row, 'Directorate Submitting the Request'),
+        "analysis": analysis_text,
+        "score": calculated_score,
+        "model": model_name
+    }
+    # Keep the rating vector alongside the analysis so it can be re-scored without re-parsing
+    ttl_seconds = None
+    if model_name != Config.MODEL_PROFILES['prioritize']['model']:
+        ttl_seconds = Config.ANALYSIS_STORE_FALLBACK_TTL_MINUTES * 60
+    analysis_store.put(key, result_data, ratings=ratings, ttl_seconds=ttl_seconds, owner=owner)
+    return dict(result_data, analysis_id=key)
+
+def generation_overrides(prompt, kind, full_output=False):
+    """
+    Per-call generation settings: max_output_tokens sized to this request from
+    Config.OUTPUT_TOKEN_LIMITS rather than the profile-wide max_output_tokens, or
+    the whole ceiling with `full_output` (for retrying a response that hit the limit).
+    """
+    limits = Config.OUTPUT_TOKEN_LIMITS[kind]
+    ceiling = min(limits["ceiling"], Config.MODEL_PROFILES[kind]['max_output_tokens'])
+    if full_output:
+        return {"max_output_tokens": ceiling}
+    max_output_tokens = token_budget.output_token_limit(
+        input_token_estimate(prompt, kind), limits["base"], limits["per_input_token"], ceiling
+    )
+    return {"max_output_tokens": max_output_tokens}
 
-        # Generate content with the model
-        response = model.generate_content(prompt)
+def estimated_call_tokens(prompt, kind, full_output=False):
+    """Tokens charged against the rate limit before a call: the input plus the most the model may write."""
+    return input_token_estimate(prompt, kind) + generation_overrides(prompt, kind, full_output)["max_output_tokens"]
 
+def token_usage(kind, response, prompt, output_text):
+    """
+    Returns (input tokens, output tokens) of a call, from the response's
+    usage_metadata when the API reports it and local estimates otherwise.
+    `response` is None for a failed call, which is counted as its input only.
+    """
+    usage = getattr(response, 'usage_metadata', None)
+    input_tokens = getattr(usage, 'prompt_token_count', None) or input_token_estimate(prompt, kind)
+    output_tokens = getattr(usage, 'candidates_token_count', None) or token_budget.estimate_tokens(output_text)
+    return input_tokens, output_tokens
+
+def record_token_usage(kind, response, prompt, output_text, model_name, full_output=False):
+    """
+    Records the input and output tokens of a finished call, and settles the
+    estimate charged to the rate limit.
+    """
+    input_tokens, output_tokens = token_usage(kind, response, prompt, output_text)
+    metrics.LLM_TOKENS.observe(input_tokens, kind=kind, direction='input')
+    metrics.LLM_TOKENS.observe(output_tokens, kind=kind, direction='output')
+    rate_limiter.settle(model_name, estimated_call_tokens(prompt, kind, full_output), input_tokens + output_tokens)
+
+def hit_output_limit(response):
+    """True when the model stopped because it reached max_output_tokens, i.e. the text is cut off."""
+    candidates = getattr(response, 'candidates', None)
+    if not candidates:
+        return False
+    reason = getattr(candidates[0], 'finish_reason', None)
+    return getattr(reason, 'name', None) == 'MAX_TOKENS'
+
+def response_text(response):
+    """Returns response.text, or "" when the response was blocked or empty."""
+    try:
+        return response.text
+    except ValueError:
+        return ""
+
+def generate_content(prompt, kind, priority='interactive', full_output=False, **kwargs):
+    """
+    Calls generate_content on the model profile `kind` ("prioritize" or "chat"),
+    falling back to the profile's fallback model if needed, and tracks in-flight
+    calls, latency, outcome and token usage. `priority` ("interactive" or "batch")
+    orders the call under the shared rate limit; `full_output` lifts max_output_tokens
+    to the profile's ceiling. Returns (response, model_name).
+    """
+    generation_config = generation_overrides(prompt, kind, full_output)
+    with metrics.LLM_IN_FLIGHT.track_inprogress(kind=kind), metrics.STAGE_LATENCY.time(stage='generate_content'):
         try:
-            analysis_text = response.text.strip()
-            # Calculate the weighted score from the AI's analysis
-            calculated_score = parse_and_calculate_score(analysis_text)
-            
-            # Format the new table row for the overall score
-            overall_priority_row = f"\n| **Overall Priority** | | **{calculated_score}%** | A weighted score calculated based on all factors. |"
-
-            # Inject the new row before the "## Conclusion" heading
-            conclusion_heading = "## Conclusion"
-            if conclusion_heading in analysis_text:
-                parts = analysis_text.split(conclusion_heading, 1)
-                table_part = parts[0].rstrip()
-                conclusion_part = parts[1]
-                # Ensure proper spacing for Markdown rendering
-                analysis_text = table_part + overall_priority_row + "\n\n" + conclusion_heading + conclusion_part
-            else:
-                # Fallback in case the conclusion heading is missing
-                analysis_text += overall_priority_row
-            
-        except ValueError:
-            print(f"Warning: Gemini response blocked or empty for row {row_index}. Prompt feedback: {response.prompt_feedback}")
-            analysis_text = f"Error: The response from the AI model was blocked or empty. Reason: {response.prompt_feedback}"
-
-        result_data = {
-            "index": row_index,
-            "title": get_safe('Title of Your Project'),
-            "directorate": get_safe('Directorate Submitting the Request'),
-            "analysis": analysis_text
+            response, model_name = model_router.call(kind, lambda model, timeout: model.generate_content(
+                prompt, generation_config=generation_config, request_options={"timeout": timeout},
+                **kwargs), tokens=estimated_call_tokens(prompt, kind, full_output), priority=priority,
+                spent_tokens=lambda response: sum(token_usage(
+                    kind, response, prompt, response_text(response) if response is not None else "")))
+        except Exception:
+            metrics.LLM_CALLS.inc(kind=kind, outcome='error')
+            raise
+    metrics.LLM_CALLS.inc(kind=kind, outcome='ok')
+    record_token_usage(kind, response, prompt, response_text(response), model_name, full_output)
+    return response, model_name
+
+def complete_truncated_analysis(prompt, row_index, priority='interactive'):
+    """
+    Called when a prioritization response stopped at its max_output_tokens. Runs the
+    call again once with the profile's whole output ceiling, unless that was already
+    the limit. Returns (response, model_name); raises AnalysisTruncatedError when the
+    analysis still does not fit, so a partial analysis is never scored or stored.
+    """
+    metrics.LLM_TRUNCATED.inc(kind='prioritize')
+    limit = generation_overrides(prompt, 'prioritize')["max_output_tokens"]
+    if limit < generation_overrides(prompt, 'prioritize', full_output=True)["max_output_tokens"]:
+        print(f"Warning: analysis for row {row_index} reached {limit} output tokens; retrying with the full limit")
+        response, model_name = generate_content(prompt, kind='prioritize', priority=priority, full_output=True)
+        if not hit_output_limit(response):
+            return response, model_name
+        metrics.LLM_TRUNCATED.inc(kind='prioritize')
+    raise AnalysisTruncatedError(f"Analysis for row {row_index} exceeded the output token limit.")
+
+def open_stream(prompt, kind):
+    """
+    Starts a streaming generate_content call on the model profile `kind`. The first
+    chunk is read here, within the call's deadline, so a primary model that fails
+    before sending anything is retried or replaced by the fallback. Streams are not
+    hedged. Returns (response, chunks, model_name).
+    """
+    def start(model, timeout):
+        response = model.generate_content(prompt, stream=True, generation_config=generation_overrides(prompt, kind),
+                                          request_options={"timeout": timeout})
+        chunks = iter(response)
+        first = next(chunks, None)
+        return response, itertools.chain(() if first is None else (first,), chunks)
+
+    # A stream that failed or was abandoned before it was read counts as its input only
+    (response, chunks), model_name = model_router.call(
+        kind, start, hedge=False, tokens=estimated_call_tokens(prompt, kind),
+        spent_tokens=lambda result: sum(token_usage(kind, None, prompt, "")))
+    return response, chunks, model_name
+
+def settle_stream(kind, stream, prompt, parts):
+    """
+    Records the token usage of a streaming call and settles its rate-limit charge
+    from the text received so far. Stream routes call it in their `finally`, so a
+    stream cut short by a model error or a client disconnect is settled too.
+    `stream` is (response, model_name) once the stream was opened, else None.
+    """
+    if stream is None:
+        return
+    response, model_name = stream
+    try:
+        record_token_usage(kind, response, prompt, "".join(parts), model_name)
+    except Exception:
+        logging.error(f"Could not record the token usage of a {kind} stream", exc_info=True)
+
+def load_analysis(key):
+    """
+    Returns the stored result payload for `key`, with its "analysis_id" (the key
+    itself, which clients pass back to /chat), or None if absent or expired.
+    """
+    payload = analysis_store.get(key)
+    return dict(payload, analysis_id=key) if payload is not None else None
+
+def lookup_analysis(key):
+    """Reads the analysis store and counts the lookup as a cache hit or miss."""
+    cached = load_analysis(key)
+    metrics.ANALYSIS_CACHE_REQUESTS.inc(result='hit' if cached is not None else 'miss')
+    return cached
+
+def blocked_response_message(response):
+    return f"Error: The response from the AI model was blocked or empty. Reason: {response.prompt_feedback}"
+
+def model_error_response(error, default_message):
+    """
+    Maps a failed model call to (body, status, headers): 503 with Retry-After while
+    the model's circuit is open, the rate limit is reached or the service is
+    unavailable, 504 when the call ran out of time, 502 when a structured analysis
+    did not match its schema, and 500 with `default_message` for anything else.
+    """
+    if isinstance(error, AnalysisTruncatedError):
+        return {"error": "The AI model could not finish the analysis within its output limit."}, 502, {}
+    if isinstance(error, AnalysisFormatError):
+        return {"error": "The AI model returned an analysis that could not be read. Please try again."}, 502, {}
+    reason = upstream_failure_reason(error)
+    if reason == 'timeout':
+        return {"error": "The AI service did not respond in time. Please try again."}, 504, {}
+    if isinstance(error, (CircuitOpenError, RateLimitedError)) or reason in ('quota', 'unavailable'):
+        retry_after = math.ceil(getattr(error, 'retry_after', Config.LLM_BREAKER_RESET_SECONDS)) or 1
+        return ({"error": "The AI service is temporarily unavailable. Please try again shortly.",
+                 "retry_after": retry_after}, 503, {"Retry-After": str(retry_after)})
+    return {"error": default_message}, 500, {}
+
+def analyze_row(row, row_index, priority='interactive', owner=None):
+    """
+    Runs the AI prioritization for one upload row and returns the result payload.
+    Results are served from, and saved to, the shared analysis store, so any user
+    whose row has identical content gets the stored analysis without a model call.
+    Concurrent requests for the same content wait on a single model call.
+    `priority` is "batch" for /prioritize_all, so interactive calls go first, and
+    `owner` is the upload session id recorded with a new analysis.
+    Does not touch the request or session, so it is safe to call from worker threads.
+    """
+    key = analysis_key_for_row(row)
+    cached = lookup_analysis(key)
+    if cached is not None:
+        print(f"Using cached analysis for row {row_index}")
+        return dict(cached, index=row_index)
+
+    result_data, shared = analysis_flights.do(key, lambda: generate_analysis(row, key, row_index, priority, owner))
+    if shared:
+        metrics.ANALYSIS_COALESCED.inc()
+    return dict(result_data, index=row_index)
+
+def generate_analysis(row, key, row_index, priority='interactive', owner=None):
+    """
+    Calls the model for one row and stores the analysis. Returns the result
+    payload without the row index, since coalesced callers may differ in it.
+    """
+    # Another request may have finished this analysis between our lookup and joining the flight
+    cached = load_analysis(key)
+    if cached is not None:
+        return cached
+
+    with metrics.STAGE_LATENCY.time(stage='prompt_build'):
+        prompt = build_prioritization_prompt(row)
+
+    # Generate content with the prioritization profile's model (cached, with fallback)
+    response, model_name = generate_content(prompt, kind='prioritize', priority=priority)
+    if hit_output_limit(response):
+        response, model_name = complete_truncated_analysis(prompt, row_index, priority)
+
+    try:
+        # Calculate the weighted score from the AI's analysis, add it to the table and store it.
+        # Only successful analyses are stored; blocked responses are retried next time.
+        return store_analysis(row, key, response.text, model_name, owner)
+    except ValueError:
+        print(f"Warning: Gemini response blocked or empty for row {row_index}. Prompt feedback: {response.prompt_feedback}")
+        return {
+            "title": get_row_value(row, 'Title of Your Project'),
+            "directorate": get_row_value(row, 'Directorate Submitting the Request'),
+            "analysis": blocked_response_message(response)
         }
 
-        # Store the most recent analysis in the app context (deprecated in multi-user approach)
-        # app.recent_analysis = analysis_text # Removed this line as it's not multi-user safe
+def load_upload_row(row_index):
+    """
+    Reads one row of the current session's upload.
+    Returns (row, None) on success or (None, error_response) for the route to return.
+    """
+    df_file_path = current_upload_path()
+    if df_file_path is None:
+        return None, (jsonify({"error": "No CSV uploaded or processed yet in this session."}), 400)
 
-        # Cache the result for future requests
-        analysis_cache[row_index] = result_data
-        session['analysis_cache'] = analysis_cache # Store updated cache back in session
+    try:
+        with metrics.STAGE_LATENCY.time(stage='row_read'):
+            num_rows = upload_store.count_rows(df_file_path, df_cache)
+            if num_rows == 0:
+                return None, (jsonify({"error": "Uploaded data is empty or corrupted."}), 400)
+            return upload_store.read_row(df_file_path, row_index, df_cache), None
+    except IndexError:
+        return None, (jsonify({"error": "Row index out of range."}), 400)
+    except FileNotFoundError:
+        return None, (jsonify({"error": "Uploaded CSV file not found on server. Please re-upload."}), 404)
+    except Exception as e:
+        return None, (jsonify({"error": f"Error reading CSV from file: {e}"}), 500)
+
+def sse_event(event, data):
+    """Formats one Server-Sent Event carrying a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def stream_model_text(response):
+    """
+    Yields the text of each chunk of a streaming generate_content response.
+    Chunks without text (e.g. the final finish-reason chunk) are skipped.
+    """
+    for chunk in response:
+        try:
+            text = chunk.text
+        except ValueError:
+            continue
+        if text:
+            yield text
+
+def sse_response(generator):
+    # X-Accel-Buffering stops nginx from holding back events until the stream ends
+    return Response(
+        stream_with_context(generator),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
+@bp.route('/prioritize/<int:row_index>', methods=['GET'])
+@api_key_required # Apply authentication to the prioritize route
+@timing_decorator
+def prioritize_single(row_index):
+    """
+    Generates an AI-based analysis for the selected row.
+    Uses Google Generative AI to produce a Markdown table (with embedded heat map markup) and a conclusion.
+    Identical requests are served from the shared analysis store without an AI call.
+    """
+    row, error_response = load_upload_row(row_index)
+    if error_response is not None:
+        return error_response
+
+    try:
+        result_data = analyze_row(row, row_index, owner=session.get('upload_session_id'))
         return jsonify(result_data)
 
     except KeyError as e:
@@ -458,7 +835,7 @@ Procedure Frequency: {get_safe('How many times is this procedure performed on av
         # If it was, this error means the CSV is missing some OTHER column.
         # If it wasn't, this error means the CSV is missing one of the columns still required.
         if str(e) == "'How complex do you anticipate the integration with existing electronic systems will be?'":
-             # This error should ideally not happen now that it's not in required_columns,
+             # This error should ideally not happen now that it's not in REQUIRED_COLUMNS,
              # but leaving this check just in case the prompt was modified elsewhere.
              error_message = f"An internal error occurred. The required column '{e}' was not found when generating the AI prompt."
         else:
@@ -467,32 +844,246 @@ Procedure Frequency: {get_safe('How many times is this procedure performed on av
         return jsonify({"error": error_message}), 400
     except Exception as e:
         logging.error(f"An unexpected error occurred in /prioritize/{row_index} route", exc_info=True)
-        return jsonify({"error": "An internal server error occurred during prioritization."}), 500
+        body, status, headers = model_error_response(e, "An internal server error occurred during prioritization.")
+        return jsonify(body), status, headers
 
+@bp.route('/prioritize/<int:row_index>/stream', methods=['GET'])
+@api_key_required
+def prioritize_single_stream(row_index):
+    """
+    Streaming variant of /prioritize/<row_index> using Server-Sent Events.
+    Emits `chunk` events ({"text": ...}) as the model generates, then one `done`
+    event with the full result (including the weighted "score"), or an `error` event.
+    In structured (JSON) mode partial JSON is not displayable, so only `done` is sent.
+    """
+    row, error_response = load_upload_row(row_index)
+    if error_response is not None:
+        return error_response
+
+    key = analysis_key_for_row(row)
+    cached = lookup_analysis(key)
+    owner = session.get('upload_session_id')
+
+    def generate():
+        if cached is not None:
+            print(f"Using cached analysis for row {row_index}")
+            yield sse_event('done', dict(cached, index=row_index))
+            return
+
+        call, leader = analysis_flights.begin(key)
+        if not leader:
+            # The same analysis is already being generated; wait for it instead of calling the model again
+            metrics.ANALYSIS_COALESCED.inc()
+            try:
+                yield sse_event('done', dict(call.wait(), index=row_index))
+            except Exception as e:
+                yield sse_event('error', model_error_response(e, "An internal server error occurred during prioritization.")[0])
+            return
 
-@app.route('/chat', methods=['POST'])
-@timing_decorator
-def chat():
+        result_data, error = None, None
+        stream, prompt, parts = None, None, []
+        try:
+            # Another request may have finished this analysis between our lookup and joining the flight
+            result_data = load_analysis(key)
+            if result_data is not None:
+                yield sse_event('done', dict(result_data, index=row_index))
+                return
+
+            with metrics.STAGE_LATENCY.time(stage='prompt_build'):
+                prompt = build_prioritization_prompt(row)
+            # The call stays in flight until the whole stream has been relayed
+            with metrics.LLM_IN_FLIGHT.track_inprogress(kind='prioritize'), metrics.STAGE_LATENCY.time(stage='generate_content'):
+                response, chunks, model_name = open_stream(prompt, 'prioritize')
+                stream = (response, model_name)
+                for text in stream_model_text(chunks):
+                    parts.append(text)
+                    if not STRUCTURED_ANALYSIS:
+                        yield sse_event('chunk', {"text": text})
+            metrics.LLM_CALLS.inc(kind='prioritize', outcome='ok')
+
+            if not parts:
+                print(f"Warning: Gemini response blocked or empty for row {row_index}. Prompt feedback: {response.prompt_feedback}")
+                # Coalesced waiters get the error too, not a result without a score
+                error = RuntimeError(blocked_response_message(response))
+                yield sse_event('error', {"error": str(error)})
+                return
+
+            raw_text = "".join(parts)
+            if hit_output_limit(response):
+                # The streamed text is cut off; the "done" event replaces it with the complete analysis
+                response, model_name = complete_truncated_analysis(prompt, row_index)
+                raw_text = response.text
+            result_data = store_analysis(row, key, raw_text, model_name, owner)
+            yield sse_event('done', dict(result_data, index=row_index))
+        except Exception as e:
+            error = e
+            metrics.LLM_CALLS.inc(kind='prioritize', outcome='error')
+            logging.error(f"An unexpected error occurred in /prioritize/{row_index}/stream route", exc_info=True)
+            yield sse_event('error', model_error_response(e, "An internal server error occurred during prioritization.")[0])
+        finally:
+            # Runs on success, failure and client disconnect, so waiters are never left hanging
+            # and the stream's rate-limit charge is always settled
+            settle_stream('prioritize', stream, prompt, parts)
+            if result_data is None and error is None:
+                error = RuntimeError("The streaming request was closed before the analysis finished.")
+            analysis_flights.finish(key, call, result=result_data, error=error)
+
+    return sse_response(generate())
+
+@bp.route('/prioritize_all', methods=['POST'])
+@api_key_required
+def prioritize_all():
     """
-    Endpoint for chatbot interaction. Accepts user queries and returns LLM-generated responses.
-    Expects a JSON payload with "query" and "analysis" (the latter passed from LocalStorage).
-    Uses the singleton model instance for better performance.
+    Starts a batch analysis of the uploaded rows and returns immediately with a batch id.
+    Optional JSON body: {"start": 0, "end": N} to limit the run to rows [start, end).
+    Rows are analysed concurrently by a bounded worker pool; poll
+    GET /prioritize_all/<batch_id> for progress and partial results.
     """
-    data = request.get_json()
-    # Sanitize user_query and frontend_analysis
-    user_query = html.escape(data.get('query', '').strip())
-    frontend_analysis = html.escape(data.get('analysis', '').strip())
+    df_file_path = current_upload_path()
+    if df_file_path is None:
+        return jsonify({"error": "No CSV uploaded or processed yet in this session."}), 400
 
-    if not user_query:
-        return jsonify({"error": "Query cannot be empty."}), 400
+    data = request.get_json(silent=True) or {}
+    try:
+        start = int(data.get('start', 0))
+        end = data.get('end')
+        end = int(end) if end is not None else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "start and end must be integers."}), 400
 
     try:
-        if frontend_analysis:
-            context = f"The analysis results are available. Here is the most recent analysis: {frontend_analysis}"
-        else:
-            context = "There are currently no analysis results to explain because no analysis was provided."
+        num_rows = upload_store.count_rows(df_file_path, df_cache)
+        end = num_rows if end is None else min(end, num_rows)
+        if start < 0 or start >= end:
+            return jsonify({"error": "Row range is empty or out of range."}), 400
+        if end - start > Config.BATCH_MAX_ROWS:
+            return jsonify({"error": f"A batch can cover at most {Config.BATCH_MAX_ROWS} rows. Use start/end to split the upload."}), 400
+        rows = upload_store.read_rows(df_file_path, start, end, df_cache)
+    except FileNotFoundError:
+        return jsonify({"error": "Uploaded CSV file not found on server. Please re-upload."}), 404
+    except Exception as e:
+        logging.error("Error reading CSV from file in /prioritize_all route", exc_info=True)
+        return jsonify({"error": "An internal server error occurred while reading the CSV file."}), 500
+
+    try:
+        batch_id = batch_runner.submit(rows, functools.partial(analyze_row, priority='batch', owner=session.get('upload_session_id')))
+    except BatchQueueFullError as e:
+        return jsonify({"error": str(e)}), 429
+    return jsonify({
+        "batch_id": batch_id,
+        "total": len(rows),
+        "status_url": f"/prioritize_all/{batch_id}"
+    }), 202
+
+@bp.route('/prioritize_all/<batch_id>', methods=['GET'])
+@api_key_required
+def prioritize_all_status(batch_id):
+    """
+    Returns progress for a batch started with POST /prioritize_all.
+    Pass ?after=<next> from the previous response to receive only newly finished rows.
+    """
+    after = request.args.get('after', 0, type=int)
+    status = batch_runner.get(batch_id, after=max(after, 0))
+    if status is None:
+        return jsonify({"error": "Unknown or expired batch id."}), 404
+    return jsonify(status)
 
-        prompt = f"""
+
+@bp.route('/rescore', methods=['POST'])
+@api_key_required
+def rescore_upload():
+    """
+    Re-scores every already-analysed row of the current upload under a new weight set,
+    without calling the model. Expects JSON {"weights": {"<category>": <fraction>, ...}}
+    with fractions summing to 1.0; categories left out get weight 0.
+    Returns the new score per analysed row and the indexes of rows not yet analysed.
+    """
+    df_file_path = current_upload_path()
+    if df_file_path is None:
+        return jsonify({"error": "No CSV uploaded or processed yet in this session."}), 400
+
+    data = request.get_json(silent=True) or {}
+    try:
+        engine = ScoringEngine(data.get('weights'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        num_rows = upload_store.count_rows(df_file_path, df_cache)
+        rows = upload_store.read_rows(df_file_path, 0, num_rows, df_cache)
+    except FileNotFoundError:
+        return jsonify({"error": "Uploaded CSV file not found on server. Please re-upload."}), 404
+    except Exception as e:
+        logging.error("Error reading CSV from file in /rescore route", exc_info=True)
+        return jsonify({"error": "An internal server error occurred while reading the CSV file."}), 500
+
+    keys = [analysis_key_for_row(row) for _, row in rows]
+    vectors = analysis_store.get_ratings(keys, scoring.parse_ratings)
+
+    analysed = [(row_index, row, key) for (row_index, row), key in zip(rows, keys) if key in vectors]
+    scores = engine.score_matrix([vectors[key] for _, _, key in analysed])
+
+    return jsonify({
+        "weights": engine.weights,
+        "scores": [
+            {"index": row_index, "title": get_row_value(row, 'Title of Your Project'), "score": float(score)}
+            for (row_index, row, _), score in zip(analysed, scores)
+        ],
+        "not_analysed": [row_index for (row_index, _), key in zip(rows, keys) if key not in vectors]
+    })
+
+def extract_section(markdown_text, heading):
+    """Returns the text under a "## <heading>" line, up to the next "## " heading, or ""."""
+    marker = f"## {heading}"
+    if marker not in markdown_text:
+        return ""
+    section = markdown_text.split(marker, 1)[1]
+    return section.split("\n## ", 1)[0].strip()
+
+def build_analysis_context(payload):
+    """
+    Summarizes a stored analysis for the chatbot: the project, the overall score,
+    the Rating % of each category and the conclusion. A fraction of the size of
+    the full table with its justifications and heat map markup.
+    """
+    analysis_text = payload.get("analysis", "")
+    ratings = scoring.parse_rating_percentages(analysis_text)
+    lines = [
+        f"Project: {payload.get('title', 'N/A')} (Directorate: {payload.get('directorate', 'N/A')})",
+        f"Overall Priority score: {payload.get('score', 'N/A')}%",
+        "Category ratings (Rating %):",
+    ]
+    lines.extend(f"- {category}: {percent:g}%" for category, percent in ratings.items())
+    conclusion = extract_section(analysis_text, "Conclusion")
+    if conclusion:
+        lines.append(f"Conclusion: {conclusion}")
+    return "\n".join(lines)
+
+def resolve_chat_analysis(data):
+    """
+    Returns (analysis_context, None) for a chat request body, or (None, error_response).
+    Clients send "analysis_id" (from a prioritization result) and the context is built
+    from the stored analysis. A raw "analysis" text is still accepted from older clients.
+    """
+    analysis_id = (data.get('analysis_id') or '').strip()
+    if analysis_id:
+        payload = analysis_store.get(analysis_id)
+        if payload is None:
+            return None, (jsonify({"error": "Analysis not found or expired. Please run the analysis again."}), 404)
+        return html.escape(build_analysis_context(payload)), None
+    # Sanitize the analysis text sent by the client
+    return html.escape((data.get('analysis') or '').strip()), None
+
+def build_chat_prompt(user_query, analysis_context):
+    """
+    Builds the chatbot prompt from an (already sanitized) user query and analysis context.
+    """
+    if analysis_context:
+        context = f"The analysis results are available. Here is the most recent analysis: {analysis_context}"
+    else:
+        context = "There are currently no analysis results to explain because no analysis was provided."
+
+    return f"""
         You are an AI assistant helping users understand analysis results. Here is the context:
         {context}
 
@@ -501,20 +1092,167 @@ def chat():
         Provide a clear and concise response to the user's query.
         """
 
-        # Use the singleton model instance instead of creating a new one each time
-        model = get_model()
+def lookup_chat_answer(key):
+    """Reads the chat answer cache and counts the lookup as a cache hit or miss."""
+    answer = chat_cache.get(key)
+    metrics.CHAT_CACHE_REQUESTS.inc(result='hit' if answer is not None else 'miss')
+    return answer
+
+def answer_chat(user_query, analysis_context):
+    """
+    Generates the chatbot's answer, or returns the cached answer to the same question
+    about the same analysis. Does not touch the request, so it can run in a background job.
+    """
+    key = make_chat_key(analysis_context, user_query, Config.MODEL_PROFILES['chat']['model'])
+    cached = lookup_chat_answer(key)
+    if cached is not None:
+        return cached
+
+    prompt = build_chat_prompt(user_query, analysis_context)
+
+    # Generate content with the chat profile's model (cached, with fallback)
+    response, _ = generate_content(prompt, kind='chat')
+
+    answer = response.text.strip()
+    if answer:
+        chat_cache.put(key, answer)
+    return answer
+
+@bp.route('/chat', methods=['POST'])
+@timing_decorator
+def chat():
+    """
+    Endpoint for chatbot interaction. Accepts user queries and returns LLM-generated responses.
+    Expects a JSON payload with "query" and "analysis_id" (from the prioritization result);
+    the model sees a compact summary of that stored analysis rather than the full text.
+    Uses the chat profile's cached model, with fallback.
+    """
+    data = request.get_json()
+    # Sanitize user_query
+    user_query = html.escape(data.get('query', '').strip())
+
+    if not user_query:
+        return jsonify({"error": "Query cannot be empty."}), 400
 
-        # Generate content with the model
-        response = model.generate_content(prompt)
+    analysis_context, error_response = resolve_chat_analysis(data)
+    if error_response is not None:
+        return error_response
 
-        chatbot_response = response.text.strip()
+    try:
+        chatbot_response = answer_chat(user_query, analysis_context)
         return jsonify({"response": chatbot_response})
 
     except Exception as e:
         logging.error("Error generating chatbot response in /chat route", exc_info=True)
-        return jsonify({"error": "An internal server error occurred during chat interaction."}), 500
+        body, status, headers = model_error_response(e, "An internal server error occurred during chat interaction.")
+        return jsonify(body), status, headers
+
+@bp.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    Streaming variant of /chat using Server-Sent Events.
+    Emits `chunk` events ({"text": ...}) as the answer is generated, then a
+    `done` event with the full {"response": ...}, or an `error` event.
+    """
+    data = request.get_json()
+    # Sanitize user_query
+    user_query = html.escape(data.get('query', '').strip())
+
+    if not user_query:
+        return jsonify({"error": "Query cannot be empty."}), 400
+
+    analysis_context, error_response = resolve_chat_analysis(data)
+    if error_response is not None:
+        return error_response
+
+    key = make_chat_key(analysis_context, user_query, Config.MODEL_PROFILES['chat']['model'])
+    cached = lookup_chat_answer(key)
+    prompt = build_chat_prompt(user_query, analysis_context)
+
+    def generate():
+        if cached is not None:
+            yield sse_event('done', {"response": cached})
+            return
+
+        stream, parts = None, []
+        try:
+            with metrics.LLM_IN_FLIGHT.track_inprogress(kind='chat'), metrics.STAGE_LATENCY.time(stage='generate_content'):
+                response, chunks, model_name = open_stream(prompt, 'chat')
+                stream = (response, model_name)
+                for text in stream_model_text(chunks):
+                    parts.append(text)
+                    yield sse_event('chunk', {"text": text})
+            metrics.LLM_CALLS.inc(kind='chat', outcome='ok')
+            answer = "".join(parts).strip()
+            if answer:
+                chat_cache.put(key, answer)
+            yield sse_event('done', {"response": answer})
+        except Exception as e:
+            metrics.LLM_CALLS.inc(kind='chat', outcome='error')
+            logging.error("Error generating chatbot response in /chat/stream route", exc_info=True)
+            yield sse_event('error', model_error_response(e, "An internal server error occurred during chat interaction.")[0])
+        finally:
+            # Also on a model error or client disconnect mid-stream
+            settle_stream('chat', stream, prompt, parts)
+
+    return sse_response(generate())
+
+@bp.route('/jobs', methods=['POST'])
+@api_key_required
+def create_job():
+    """
+    Enqueues a long-running analysis and returns its job id immediately (202).
+    Expects JSON with "type" and the task's arguments:
+    - {"type": "prioritize", "row_index": 3} analyses a row of this session's upload
+    - {"type": "chat", "query": "...", "analysis_id": "..."} answers a chatbot query
+    Poll GET /jobs/<job_id> for the status and result.
+    """
+    data = request.get_json(silent=True) or {}
+    job_type = data.get('type')
+
+    if job_type == 'prioritize':
+        try:
+            row_index = int(data.get('row_index'))
+        except (TypeError, ValueError):
+            return jsonify({"error": "row_index must be an integer."}), 400
+        # The row is read now, while the session is available; the job only needs the data
+        row, error_response = load_upload_row(row_index)
+        if error_response is not None:
+            return error_response
+        task = functools.partial(analyze_row, row, row_index, owner=session.get('upload_session_id'))
+    elif job_type == 'chat':
+        # Sanitize user_query
+        user_query = html.escape((data.get('query') or '').strip())
+        if not user_query:
+            return jsonify({"error": "Query cannot be empty."}), 400
+        analysis_context, error_response = resolve_chat_analysis(data)
+        if error_response is not None:
+            return error_response
+        task = lambda: {"response": answer_chat(user_query, analysis_context)}
+    else:
+        return jsonify({"error": "Job type must be 'prioritize' or 'chat'."}), 400
+
+    try:
+        job = job_queue.submit(job_type, task)
+    except QueueFullError as e:
+        return jsonify({"error": str(e)}), 503
 
-@app.route('/chat/clear', methods=['POST'])
+    status_url = f"/jobs/{job.id}"
+    return jsonify({"job_id": job.id, "status": job.status, "status_url": status_url}), 202, {"Location": status_url}
+
+@bp.route('/jobs/<job_id>', methods=['GET'])
+@api_key_required
+def get_job(job_id):
+    """
+    Returns the status of a background job, plus its "result" once completed
+    or its "error" if it failed.
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job id."}), 404
+    return jsonify(job)
+
+@bp.route('/chat/clear', methods=['POST'])
 @timing_decorator
 def clear_chat_history():
     """
@@ -524,113 +1262,179 @@ def clear_chat_history():
     Leaving as is for now, but acknowledge its limited effect.
     """
     try:
-        # Remove the file from the temporary directory if it exists
+        # Delete the session's upload files (the manifest also drops them from the DataFrame cache)
         df_file_path = session.pop('df_file_path', None)
+        upload_session_id = session.get('upload_session_id')
+        if upload_session_id:
+            upload_manager.release_session(upload_session_id)
         if df_file_path and os.path.exists(df_file_path):
-            os.remove(df_file_path)
-            print(f"Removed temporary file: {df_file_path}")
+            # An upload from before the manifest existed
+            upload_manager.release(df_file_path)
 
-        session.pop('analysis_cache', None)
-        return jsonify({"message": "Session data (CSV file and analysis cache) cleared successfully."}), 200
+        return jsonify({"message": "Session data (uploaded CSV file) cleared successfully."}), 200
     except Exception as e:
         print(f"Error clearing server state: {e}")
         traceback.print_exc()
         return jsonify({"error": f"Failed to clear server state: {e}"}), 500
 
-@app.route('/analysis/clear', methods=['POST'])
+@bp.route('/analysis/clear', methods=['POST'])
 @timing_decorator
 def clear_analysis_cache():
     """
-    Endpoint to clear the analysis cache.
-    This allows users to free up memory and force fresh analyses.
+    Endpoint to clear cached analyses for the rows of the current upload.
+    This forces fresh analyses the next time those rows are prioritized.
+    Only analyses this session produced are removed; the store is shared, so
+    ones other sessions produced for identical rows are kept.
     """
     try:
-        # Clear the session-specific analysis cache
-        session['analysis_cache'] = {}
-        return jsonify({"message": "Session analysis cache cleared successfully."}), 200
+        df_file_path = current_upload_path()
+        removed = 0
+        if df_file_path and os.path.exists(df_file_path):
+            num_rows = upload_store.count_rows(df_file_path, df_cache)
+            rows = upload_store.read_rows(df_file_path, 0, num_rows, df_cache)
+            removed = analysis_store.delete((analysis_key_for_row(row) for _, row in rows),
+                                            owner=session.get('upload_session_id'))
+        return jsonify({"message": f"Analysis cache cleared successfully ({removed} cached analyses removed)."}), 200
     except Exception as e:
         print(f"Error clearing analysis cache: {e}")
         traceback.print_exc()
         return jsonify({"error": f"Failed to clear analysis cache: {e}"}), 500
 
-@app.route('/send-report', methods=['POST'])
+@bp.route('/cache/stats', methods=['GET'])
+@api_key_required
+def cache_stats():
+    """
+    Returns hit/miss counters and memory usage of the shared parsed-DataFrame cache,
+    the size of the shared analysis store, the chat answer cache counters and the
+    space held by uploads.
+    """
+    return jsonify({
+        "dataframe_cache": df_cache.stats(),
+        "analysis_store": analysis_store.stats(),
+        "chat_cache": chat_cache.stats(),
+        "uploads": upload_manager.usage()
+    })
+
+@bp.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """
+    Exposes request, stage, model-call, cache, upload and background-task metrics
+    in the Prometheus text format.
+    """
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@bp.route('/send-report', methods=['POST'])
 @api_key_required # Apply authentication to the send-report route
 @timing_decorator
 def send_report():
     """
-    Endpoint to send analysis report via email as PDF.
+    Endpoint to email an analysis report.
     Expects JSON with:
     - email: recipient email address
-    - pdf: base64 encoded PDF content
+    - analysis_id: id of a stored analysis (from the prioritization result)
+    - evaluator: optional evaluator name to include in the report
+    The report is rendered on the server from the stored analysis as an HTML email
+    (with a plain-text alternative). A base64 "pdf" from older clients is still
+    accepted in place of analysis_id and sent as an attachment.
+    The report is queued and sent in the background, with retries; the response (202)
+    carries an email_id whose delivery status is at GET /send-report/<email_id>.
     """
-    data = request.get_json()
+    data = request.get_json(silent=True) or {}
     email = data.get('email')
+    analysis_id = (data.get('analysis_id') or '').strip()
     pdf_base64 = data.get('pdf')
 
-    if not email or not pdf_base64:
-        return jsonify({"error": "Email and PDF content are required"}), 400
+    if not email or not (analysis_id or pdf_base64):
+        return jsonify({"error": "Email and an analysis id are required"}), 400
 
+    subject = "AiPrio Analysis Report"
     try:
-        # The actual send_email function needs to be implemented in gmail_service.py
-        # Assuming it takes recipient, subject, body, and pdf (base64)
-        send_email(
-            recipient=email,
-            subject="AiPrio Analysis Report",
-            body="Please find attached your analysis report",
-            pdf=pdf_base64
-        )
-        return jsonify({"message": "PDF report sent successfully"}), 200
+        if analysis_id:
+            payload = analysis_store.get(analysis_id)
+            if payload is None:
+                return jsonify({"error": "Analysis not found or expired. Please run the analysis again."}), 404
+            evaluator = (data.get('evaluator') or '').strip() or None
+            with metrics.STAGE_LATENCY.time(stage='report_render'):
+                html_body, text_body = render_report(
+                    analysis_id, payload.get('title', 'N/A'), payload.get('directorate', 'N/A'),
+                    payload.get('analysis', ''), payload.get('score'), evaluator
+                )
+            message = gmail_service.build_message(recipient=email, subject=subject, body=text_body, html=html_body)
+        else:
+            message = gmail_service.build_message(
+                recipient=email,
+                subject=subject,
+                body="Please find attached your analysis report",
+                pdf=pdf_base64
+            )
+        email_id = email_queue.enqueue(email, subject, message.as_bytes())
+    except binascii.Error:
+        return jsonify({"error": "PDF content is not valid base64."}), 400
     except Exception as e:
-        logging.error("Error sending email in /send-report route", exc_info=True)
+        logging.error("Error queueing email in /send-report route", exc_info=True)
         return jsonify({"error": "An internal server error occurred while sending the report."}), 500
 
+    status_url = f"/send-report/{email_id}"
+    return jsonify({
+        "message": "Report queued; it will be emailed shortly.",
+        "email_id": email_id,
+        "status_url": status_url
+    }), 202, {"Location": status_url}
 
-# Configuration for cleanup and monitoring
-# Changed TEMP_DIR to UPLOAD_FOLDER for clarity and to reflect new purpose
-UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploaded_files')
-FILE_CLEANUP_AGE_HOURS = 24
+@bp.route('/send-report/<int:email_id>', methods=['GET'])
+@api_key_required
+def send_report_status(email_id):
+    """Returns the delivery status of a queued report: pending, sending, sent or failed."""
+    status = email_queue.get(email_id)
+    if status is None:
+        return jsonify({"error": "Unknown email id."}), 404
+    return jsonify(status)
+
+
+# Configuration for cleanup and monitoring (UPLOAD_FOLDER is defined with the upload manager)
 STORAGE_THRESHOLD_PERCENT = 90
-CLEANUP_INTERVAL_HOURS = 6 # Run cleanup every 6 hours
+# Under disk pressure, uploads are evicted (least recently used first) down to this share of the global quota
+STORAGE_PRESSURE_TARGET_FRACTION = 0.5
+CLEANUP_INTERVAL_HOURS = 0.25 # Run cleanup every 15 minutes; it only reads the manifest's expiry index
 STORAGE_CHECK_INTERVAL_HOURS = 1 # Check storage every 1 hour
+ORPHAN_SCAN_INTERVAL_HOURS = 24 # Re-check the upload folder for files missing from the manifest daily
 
 def cleanup_old_files_and_sessions(priority=False):
     """
-    Deletes files in the uploaded_files/ directory older than FILE_CLEANUP_AGE_HOURS.
-    If priority is True, it might be more aggressive (though not implemented yet).
+    Deletes uploads whose session has expired, found through the manifest's expiry index.
+    If priority is True (disk nearly full), also evicts least recently used uploads down to
+    STORAGE_PRESSURE_TARGET_FRACTION of the global upload quota.
     """
-    print(f"[{datetime.now()}] Starting cleanup of old files in {UPLOAD_FOLDER} (Priority: {priority})...")
-    if not os.path.exists(UPLOAD_FOLDER):
-        print(f"[{datetime.now()}] Upload directory {UPLOAD_FOLDER} does not exist. Skipping cleanup.")
-        return
+    with metrics.BACKGROUND_TASK_LATENCY.time(task='cleanup'):
+        _cleanup_old_files(priority)
 
-    now = time.time()
-    cutoff_time = now - (FILE_CLEANUP_AGE_HOURS * 3600) # Convert hours to seconds
-
-    deleted_count = 0
-    for filename in os.listdir(UPLOAD_FOLDER):
-        file_path = os.path.join(UPLOAD_FOLDER, filename)
-        if os.path.isfile(file_path):
-            try:
-                file_age = os.stat(file_path).st_mtime
-                if file_age < cutoff_time:
-                    os.remove(file_path)
-                    deleted_count += 1
-                    print(f"[{datetime.now()}] Deleted old file: {filename}")
-            except Exception as e:
-                print(f"[{datetime.now()}] Error deleting file {filename}: {e}")
-    print(f"[{datetime.now()}] Finished cleanup. Deleted {deleted_count} old files.")
+def _cleanup_old_files(priority):
+    print(f"[{datetime.now()}] Starting cleanup of expired uploads (Priority: {priority})...")
+    try:
+        expired = upload_manager.expire()
+        evicted = 0
+        if priority:
+            evicted = upload_manager.shrink_to(int(Config.UPLOAD_GLOBAL_QUOTA_BYTES * STORAGE_PRESSURE_TARGET_FRACTION))
+        print(f"[{datetime.now()}] Finished cleanup. Deleted {expired} expired and {evicted} evicted uploads.")
+    except Exception as e:
+        print(f"[{datetime.now()}] Error during upload cleanup: {e}")
 
 def check_server_storage():
     """
-    Checks server disk usage and triggers cleanup if a threshold is exceeded.
+    Checks disk usage of the volume holding the uploads and triggers cleanup if a threshold is exceeded.
     """
+    with metrics.BACKGROUND_TASK_LATENCY.time(task='storage_check'):
+        _check_server_storage()
+
+def _check_server_storage():
     print(f"[{datetime.now()}] Checking server storage...")
     try:
-        # Get disk usage for the root partition (or the drive where the app is running)
-        # On Windows, this might be 'C:\\' or similar. psutil handles this cross-platform.
-        disk_usage = psutil.disk_usage('/')
+        # Disk usage of the partition the uploads are written to, which may not be the root partition
+        os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+        disk_usage = psutil.disk_usage(UPLOAD_FOLDER)
         percent_used = disk_usage.percent
-        print(f"[{datetime.now()}] Disk usage: {percent_used}%")
+        usage = upload_manager.usage()
+        print(f"[{datetime.now()}] Disk usage: {percent_used}% (uploads: {usage['files']} files, {usage['bytes'] / (1024 * 1024):.1f} MB)")
 
         if percent_used > STORAGE_THRESHOLD_PERCENT:
             print(f"[{datetime.now()}] Disk usage {percent_used}% exceeds threshold {STORAGE_THRESHOLD_PERCENT}%. Triggering priority cleanup.")
@@ -640,39 +1444,66 @@ def check_server_storage():
     except Exception as e:
         print(f"[{datetime.now()}] Error checking server storage: {e}")
 
+def adopt_orphan_uploads():
+    """Brings files written before the manifest existed under its expiry and quotas."""
+    adopted = upload_manager.adopt_orphans()
+    if adopted:
+        print(f"[{datetime.now()}] Added {adopted} untracked upload files to the manifest.")
+
+# Maintenance tasks. Every process runs a scheduler, but only the lock holder executes them.
+scheduler = Scheduler(Config.SCHEDULER_LOCK_PATH)
+scheduler.add('adopt_orphan_uploads', adopt_orphan_uploads, ORPHAN_SCAN_INTERVAL_HOURS * 3600)
+scheduler.add('storage_check', check_server_storage, STORAGE_CHECK_INTERVAL_HOURS * 3600, initial_delay_seconds=5)
+scheduler.add('cleanup', cleanup_old_files_and_sessions, CLEANUP_INTERVAL_HOURS * 3600, initial_delay_seconds=10)
+
 def start_background_tasks():
     """
-    Starts the periodic background tasks for cleanup and storage monitoring.
-    """
-    # Schedule cleanup task
-    def schedule_cleanup():
-        with app.app_context():
-            cleanup_old_files_and_sessions()
-        # Reschedule itself
-        threading.Timer(CLEANUP_INTERVAL_HOURS * 3600, schedule_cleanup).start()
-
-    # Schedule storage check task
-    def schedule_storage_check():
-        with app.app_context():
-            check_server_storage()
-        # Reschedule itself
-        threading.Timer(STORAGE_CHECK_INTERVAL_HOURS * 3600, schedule_storage_check).start()
-
-    # Start the timers immediately
-    threading.Timer(10, schedule_cleanup).start() # Start cleanup after 10 seconds
-    threading.Timer(5, schedule_storage_check).start() # Start storage check after 5 seconds
+    Starts the periodic background tasks for cleanup and storage monitoring, and the
+    email sender. Safe to call in every server process: the scheduler elects one leader.
+    """
+    # Deliver any reports still queued from before a restart
+    email_queue.start()
+
+    scheduler.start()
     print(f"[{datetime.now()}] Background cleanup and storage monitoring tasks scheduled.")
 
+@bp.route('/maintenance', methods=['GET'])
+@api_key_required
+def maintenance_status():
+    """Returns the maintenance tasks with their last run, duration and next scheduled run."""
+    return jsonify(scheduler.status())
+
+@bp.route('/maintenance/<task_name>/run', methods=['POST'])
+@api_key_required
+def run_maintenance_task(task_name):
+    """Triggers a maintenance task (cleanup, storage_check, adopt_orphan_uploads) to run now."""
+    if not scheduler.trigger(task_name):
+        return jsonify({"error": f"Unknown task '{task_name}'."}), 404
+    return jsonify({"message": f"Task '{task_name}' triggered.", "status_url": "/maintenance"}), 202
+
+def create_app():
+    """
+    Builds the Flask application. Production servers load it through this factory
+    (see gunicorn.conf.py and serve.py); background tasks are started separately by
+    start_background_tasks(), once per server process, after any fork.
+    """
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config['PERMANENT_SESSION_LIFETIME'] = SESSION_LIFETIME
+    CORS(app)
+    app.register_blueprint(bp)
+    return app
+
+# Module-level app for the development server and `flask run`
+app = create_app()
+
 
 if __name__ == '__main__':
     # Create the uploaded_files directory if it doesn't exist
     os.makedirs(UPLOAD_FOLDER, exist_ok=True)
     
-    # Start background tasks in a separate thread
-    # This ensures the main Flask app thread is not blocked
-    background_thread = threading.Thread(target=start_background_tasks)
-    background_thread.daemon = True # Allow the main program to exit even if threads are running
-    background_thread.start()
+    # Start background tasks; they run on their own daemon threads, so the Flask app thread is not blocked
+    start_background_tasks()
 
     app.run(
         debug=app.config.get("FLASK_DEBUG", False),
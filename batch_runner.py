@@ -0,0 +1,156 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import thread_connection
+
+
+class BatchQueueFullError(Exception):
+    """Raised when a batch would exceed the rows this process may have pending."""
+
+
+class BatchRunner:
+    """
+    Fans per-row prioritizations out across a bounded thread pool.
+
+    The pool is shared by every batch, so `max_workers` caps the number of
+    concurrent model calls made on behalf of batches regardless of how many
+    batches are running, and `max_pending_rows` caps the rows waiting for it.
+    Rows run in the process that accepted the batch; progress and results are
+    kept in SQLite, in completion order, so any worker process can answer a
+    poll and pollers can fetch only what is new. Runs are discarded
+    `retention_seconds` after they finish.
+    """
+
+    # Runs unfinished this long were lost with their process (e.g. a restarted worker)
+    # and are discarded
+    ABANDONED_SECONDS = 24 * 3600
+
+    def __init__(self, db_path, max_workers, max_pending_rows, retention_seconds, error_message=str):
+        self.db_path = db_path
+        self.max_pending_rows = max_pending_rows
+        self.retention_seconds = retention_seconds
+        self.error_message = error_message  # error_message(exception) -> text safe to show the client
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='prioritize-batch')
+        self._pending = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS batches (
+                    id TEXT PRIMARY KEY,
+                    total INTEGER NOT NULL,
+                    completed INTEGER NOT NULL DEFAULT 0,
+                    failed INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    finished_at REAL
+                )
+            """)
+            # One row per finished batch row; seq is its position in completion order (from 1)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS batch_results (
+                    batch_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    row_index INTEGER NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    PRIMARY KEY (batch_id, seq)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_batches_created_at ON batches(created_at)")
+
+    def _connect(self):
+        return thread_connection(self._local, self.db_path)
+
+    def submit(self, rows, analyze):
+        """
+        Starts a batch over `rows`, a list of (row_index, row) pairs, calling
+        `analyze(row, row_index)` for each one. Returns the batch id immediately.
+        Raises BatchQueueFullError if the rows would exceed `max_pending_rows`.
+        """
+        with self._lock:
+            if self._pending + len(rows) > self.max_pending_rows:
+                raise BatchQueueFullError("Too many batch rows are waiting to be analysed. Please retry later.")
+            self._pending += len(rows)
+        batch_id = uuid.uuid4().hex
+        try:
+            with self._connect() as conn:
+                self._prune(conn)
+                conn.execute("INSERT INTO batches (id, total, created_at) VALUES (?, ?, ?)",
+                             (batch_id, len(rows), time.time()))
+        except Exception:
+            with self._lock:
+                self._pending -= len(rows)
+            raise
+        for row_index, row in rows:
+            self._executor.submit(self._run_one, batch_id, analyze, row, row_index)
+        return batch_id
+
+    def get(self, batch_id, after=0):
+        """
+        Returns a JSON-ready progress snapshot, or None for an unknown or expired
+        batch. Only results that finished after the first `after` ones are
+        included; `next` is the offset to poll with.
+        """
+        with self._connect() as conn:
+            run = conn.execute("SELECT total, completed, failed, created_at, finished_at FROM batches WHERE id = ?",
+                               (batch_id,)).fetchone()
+            if run is None:
+                return None
+            total, completed, failed, created_at, finished_at = run
+            results = []
+            for row_index, result, error in conn.execute(
+                    "SELECT row_index, result, error FROM batch_results WHERE batch_id = ? AND seq > ? AND seq <= ? "
+                    "ORDER BY seq", (batch_id, after, completed)):
+                if error is None:
+                    results.append({"index": row_index, "result": json.loads(result)})
+                else:
+                    results.append({"index": row_index, "error": error})
+        return {
+            "batch_id": batch_id,
+            "status": "completed" if completed >= total else "running",
+            "total": total,
+            "completed": completed,
+            "failed": failed,
+            "elapsed_seconds": round((finished_at or time.time()) - created_at, 2),
+            "results": results,
+            "next": completed,
+        }
+
+    def _run_one(self, batch_id, analyze, row, row_index):
+        try:
+            try:
+                self._record(batch_id, row_index, result=analyze(row, row_index))
+            except Exception as e:
+                logging.error(f"Batch {batch_id}: row {row_index} failed", exc_info=True)
+                self._record(batch_id, row_index, error=self.error_message(e))
+        except Exception:
+            # Only the status update can get here; keep the pool thread's count honest
+            logging.error(f"Could not record row {row_index} of batch {batch_id}", exc_info=True)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _record(self, batch_id, row_index, result=None, error=None):
+        now = time.time()
+        with self._connect() as conn:
+            # The UPDATE takes the write lock first, so the seq read next is this row's alone
+            conn.execute("UPDATE batches SET completed = completed + 1, failed = failed + ?, "
+                         "finished_at = CASE WHEN completed + 1 >= total THEN ? END WHERE id = ?",
+                         (int(error is not None), now, batch_id))
+            seq = conn.execute("SELECT completed FROM batches WHERE id = ?", (batch_id,)).fetchone()[0]
+            conn.execute("INSERT INTO batch_results (batch_id, seq, row_index, result, error) VALUES (?, ?, ?, ?, ?)",
+                         (batch_id, seq, row_index, json.dumps(result) if error is None else None, error))
+
+    def _prune(self, conn):
+        now = time.time()
+        expired = [row[0] for row in conn.execute(
+            "SELECT id FROM batches WHERE finished_at < ? OR (finished_at IS NULL AND created_at < ?)",
+            (now - self.retention_seconds, now - self.ABANDONED_SECONDS))]
+        conn.executemany("DELETE FROM batch_results WHERE batch_id = ?", ((i,) for i in expired))
+        conn.executemany("DELETE FROM batches WHERE id = ?", ((i,) for i in expired))
@@ -0,0 +1,79 @@
+"""
+Compares the two prioritization output formats (Config.MODEL_PROFILES
+["prioritize"]["output_format"]) on the stub model's canned analysis, without
+the Gemini API:
+
+- output tokens: the estimated size of what the model has to write;
+- server cost: time to read the ratings, score and produce the final Markdown
+  (regex parse for "markdown"; validate, score and render for "json");
+- format drift: how many categories the Markdown parser still reads when the
+  model deviates from the table format in common ways. Structured output is
+  constrained by the API's response schema, so it cannot drift this way.
+
+Usage (from the repository root):
+    python -m benchmarks.output_format_benchmark
+    python -m benchmarks.output_format_benchmark --iterations 20000
+"""
+import argparse
+import re
+import sys
+import timeit
+
+from benchmarks.run_benchmarks import REPO_ROOT
+
+sys.path.insert(0, REPO_ROOT)
+
+import analysis_schema  # noqa: E402
+import scoring  # noqa: E402
+import token_budget  # noqa: E402
+from benchmarks.stub_model import CANNED_ANALYSIS, CANNED_ANALYSIS_JSON  # noqa: E402
+
+# Weights only matter for the score's value, not for the cost of computing it
+ENGINE = scoring.ScoringEngine({category: 1 / len(scoring.CATEGORIES) for category in scoring.CATEGORIES})
+
+# Deviations from the requested table format seen in model output
+DRIFTS = {
+    "as requested": lambda text: text,
+    "category not bold": lambda text: text.replace("**", ""),
+    "extra column": lambda text: re.sub(r"^(\|[^|\n]*\|[^|\n]*)\|", r"\1| - |", text, flags=re.MULTILINE),
+    "space before %": lambda text: re.sub(r"(\d+)%", r"\1 %", text),
+    "numbered categories": lambda text: re.sub(r"\| \*\*", "| **1. ", text),
+}
+
+
+def process_markdown(raw_text):
+    found = scoring.parse_rating_percentages(raw_text)
+    return ENGINE.score_vector([found.get(category, 0.0) for category in scoring.CATEGORIES])
+
+
+def process_json(raw_text):
+    analysis = analysis_schema.parse_analysis(raw_text)
+    score = ENGINE.score_vector(analysis_schema.rating_vector(analysis))
+    analysis_schema.render_markdown(analysis)
+    return score
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Markdown vs structured JSON prioritization output.")
+    parser.add_argument('--iterations', type=int, default=5000, help="Timed runs per format (default: 5000)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    print("== Output size and server cost per analysis ==")
+    for name, text, process in (("markdown", CANNED_ANALYSIS, process_markdown),
+                                ("json", CANNED_ANALYSIS_JSON, process_json)):
+        seconds = timeit.timeit(lambda: process(text), number=args.iterations) / args.iterations
+        print(f"  {name:<9} {len(text):>5} chars  ~{token_budget.estimate_tokens(text):>4} output tokens  "
+              f"{seconds * 1e6:>7.1f} us to read, score and render  (score {process(text)})")
+
+    print("\n== Categories read from drifted Markdown ==")
+    for name, drift in DRIFTS.items():
+        found = scoring.parse_rating_percentages(drift(CANNED_ANALYSIS))
+        print(f"  {name:<20} {len(found)}/{len(scoring.CATEGORIES)}  score {process_markdown(drift(CANNED_ANALYSIS))}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""
+Checks the shared rate limiter (rate_limiter.py) under contention from several
+processes, without the Gemini API.
+
+Each process runs batch threads that take budget as fast as they can, plus a few
+interactive threads that call at a steady pace, all against one SQLite bucket
+file. The buckets start drained (down to the interactive reserve), so the run
+measures the steady refill rate rather than the initial minute of burst. Reports
+the requests and tokens granted per minute against the limits, and how long
+each priority waited.
+
+Usage (from the repository root):
+    python -m benchmarks.rate_limit_benchmark
+    python -m benchmarks.rate_limit_benchmark --processes 4 --rpm 300 --tpm 200000 --seconds 30
+    python -m benchmarks.rate_limit_benchmark --no-priority
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.run_benchmarks import REPO_ROOT, percentile
+
+MODEL = 'benchmark-model'
+
+
+def make_limiter(db_path, args):
+    sys.path.insert(0, REPO_ROOT)
+    from rate_limiter import RateLimiter
+    return RateLimiter(db_path, requests_per_minute=args.rpm, tokens_per_minute=args.tpm,
+                       interactive_reserve=args.reserve)
+
+
+def drain(limiter, priority):
+    """Takes everything `priority` calls may take from both buckets, so the run starts at the refill rate."""
+    from rate_limiter import RateLimitedError
+    limiter.acquire(MODEL, limiter.limits['tokens'], priority, timeout=0)
+    while True:
+        try:
+            limiter.acquire(MODEL, 0, priority, timeout=0)
+        except RateLimitedError:
+            return
+
+
+def worker(db_path, args, stop_at, results):
+    from rate_limiter import RateLimitedError
+    limiter = make_limiter(db_path, args)
+    samples = []  # (caller type, wait_seconds or None if refused, tokens, finished_at)
+    lock = threading.Lock()
+
+    def run(priority, pause):
+        while time.time() < stop_at:
+            started = time.monotonic()
+            try:
+                limiter.acquire(MODEL, args.tokens_per_call, priority, timeout=args.max_wait)
+                outcome = time.monotonic() - started
+            except RateLimitedError:
+                outcome = None
+            with lock:
+                samples.append((threading.current_thread().name, outcome, args.tokens_per_call, time.time()))
+            time.sleep(pause)
+
+    # With --no-priority every caller queues as interactive, for comparison
+    threads = [threading.Thread(target=run, args=('interactive' if args.no_priority else 'batch', 0), name='batch')
+               for _ in range(args.batch_threads)]
+    threads += [threading.Thread(target=run, args=('interactive', args.interactive_pause), name='interactive')
+                for _ in range(args.interactive_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put(samples)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Shared rate limiter under multi-process contention.")
+    parser.add_argument('--processes', type=int, default=3, help="Worker processes sharing the buckets (default: 3)")
+    parser.add_argument('--batch-threads', type=int, default=8, help="Batch callers per process (default: 8)")
+    parser.add_argument('--interactive-threads', type=int, default=2,
+                        help="Interactive callers per process (default: 2)")
+    parser.add_argument('--interactive-pause', type=float, default=2.0,
+                        help="Seconds each interactive caller pauses between calls (default: 2)")
+    parser.add_argument('--rpm', type=int, default=600, help="Requests per minute (default: 600)")
+    parser.add_argument('--tpm', type=int, default=1_000_000, help="Tokens per minute (default: 1000000)")
+    parser.add_argument('--tokens-per-call', type=int, default=3000, help="Tokens charged per call (default: 3000)")
+    parser.add_argument('--reserve', type=float, default=0.2,
+                        help="Share of each bucket batch calls leave to interactive ones (default: 0.2)")
+    parser.add_argument('--max-wait', type=float, default=30.0, help="Longest a caller waits (default: 30)")
+    parser.add_argument('--no-priority', action='store_true',
+                        help="Queue batch callers as interactive too, to compare without priorities")
+    parser.add_argument('--seconds', type=float, default=20.0, help="Duration of the run (default: 20)")
+    parser.add_argument('--output', help="Also write the results to this JSON file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory() as store_dir:
+        db_path = os.path.join(store_dir, 'rate_limits.sqlite3')
+        drain(make_limiter(db_path, args), 'interactive' if args.no_priority else 'batch')
+        started = time.time()
+        stop_at = started + args.seconds
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=worker, args=(db_path, args, stop_at, results))
+                     for _ in range(args.processes)]
+        for process in processes:
+            process.start()
+        samples = [sample for _ in processes for sample in results.get()]
+        for process in processes:
+            process.join()
+
+    # Callers still waiting at the end finish later; only grants within the run count
+    # towards the rates
+    in_run = [s for s in samples if s[3] <= stop_at]
+    granted = [s for s in in_run if s[1] is not None]
+    elapsed_min = args.seconds / 60
+    summary = {
+        "requests_per_minute": round(len(granted) / elapsed_min, 1),
+        "tokens_per_minute": round(sum(s[2] for s in granted) / elapsed_min),
+        "limits": {"requests_per_minute": args.rpm, "tokens_per_minute": args.tpm},
+    }
+    print(f"{args.processes} processes x ({args.batch_threads} batch + {args.interactive_threads} interactive) "
+          f"callers, {args.seconds:.0f} s, limits {args.rpm} req/min and {args.tpm} tokens/min, "
+          f"{args.tokens_per_call} tokens per call")
+    print(f"  granted  {summary['requests_per_minute']:>9.1f} req/min  {summary['tokens_per_minute']:>9} tokens/min")
+    for priority in ('interactive', 'batch'):
+        waits = sorted(s[1] for s in granted if s[0] == priority)
+        refused = sum(1 for s in in_run if s[0] == priority and s[1] is None)
+        summary[priority] = {
+            "granted": len(waits),
+            "refused": refused,
+            "p50_wait_ms": round(percentile(waits, 50) * 1000, 1),
+            "p95_wait_ms": round(percentile(waits, 95) * 1000, 1),
+            "mean_wait_ms": round(statistics.fmean(waits) * 1000, 1) if waits else 0.0,
+        }
+        s = summary[priority]
+        print(f"  {priority:<11} granted {s['granted']:>5}  refused {s['refused']:>4}  "
+              f"wait p50 {s['p50_wait_ms']:>8.1f} ms  p95 {s['p95_wait_ms']:>8.1f} ms")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"settings": {k: v for k, v in vars(args).items() if k != 'output'}, "results": summary},
+                      f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
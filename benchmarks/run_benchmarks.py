@@ -0,0 +1,375 @@
+"""
+Offline load test for AiPrio with a stub model in place of the Gemini API.
+
+Generates synthetic intake CSVs with the exact REQUIRED_COLUMNS, serves the app
+from a local threaded server and drives /upload, /preview_request,
+/prioritize and /chat at a configurable concurrency. Reports throughput,
+p50/p95/p99 latency and peak RSS (of the benchmark process, which hosts
+both the server and the clients) per scenario, and compares against (or
+saves) a stored baseline so regressions are visible. Runs are only compared
+with a baseline recorded with the same settings (COMPARED_SETTINGS).
+
+Usage (from the repository root):
+    python -m benchmarks.run_benchmarks
+    python -m benchmarks.run_benchmarks --rows 100,10000 --concurrency 16 --latency-ms 500
+    python -m benchmarks.run_benchmarks --save-baseline
+    python -m benchmarks.run_benchmarks --scenarios prioritize --latency-ms 300 --error-rate 0.1 --slow-rate 0.05 --slow-ms 3000
+"""
+import argparse
+import csv
+import http.cookiejar
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import psutil
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(REPO_ROOT, 'benchmarks', 'baselines.json')
+SCENARIOS = ('upload', 'preview', 'prioritize', 'chat')
+
+# Run settings that change the results; a run is only compared with a baseline recorded
+# with the same values. Fault settings missing from older baselines were 0.
+COMPARED_SETTINGS = ('concurrency', 'upload_concurrency', 'requests', 'latency_ms', 'jitter_ms',
+                     'error_rate', 'quota_rate', 'slow_rate', 'slow_ms')
+
+
+def store_env(store_dir):
+    """Environment that puts the upload folder, every SQLite store and the app's log in `store_dir`."""
+    return {
+        'LOG_FILE': os.path.join(store_dir, 'app.log'),
+        'UPLOAD_FOLDER': os.path.join(store_dir, 'uploaded_files'),
+        'UPLOAD_MANIFEST_PATH': os.path.join(store_dir, 'uploads.sqlite3'),
+        'ANALYSIS_STORE_PATH': os.path.join(store_dir, 'analysis_store.sqlite3'),
+        'EMAIL_QUEUE_PATH': os.path.join(store_dir, 'email_queue.sqlite3'),
+        'RATE_LIMIT_PATH': os.path.join(store_dir, 'rate_limits.sqlite3'),
+        'JOB_STORE_PATH': os.path.join(store_dir, 'jobs.sqlite3'),
+        'BATCH_STORE_PATH': os.path.join(store_dir, 'batches.sqlite3'),
+        'SCHEDULER_LOCK_PATH': os.path.join(store_dir, 'scheduler.lock'),
+    }
+
+
+def load_app(store_dir):
+    """
+    Imports the Flask app with benchmark-safe settings: placeholder secrets, the
+    upload folder, every store and the log in `store_dir`, no rate limit unless one is set
+    in the environment, and insecure cookies so the session works over http.
+    """
+    os.environ.setdefault('SECRET_KEY', 'benchmark-secret')
+    os.environ.setdefault('GOOGLE_API_KEY', 'benchmark-placeholder')
+    os.environ.update(store_env(store_dir))
+    os.environ.setdefault('LLM_REQUESTS_PER_MINUTE', '0')
+    os.environ.setdefault('LLM_TOKENS_PER_MINUTE', '0')
+    sys.path.insert(0, REPO_ROOT)
+    import app as app_module
+    app_module.app.config['SESSION_COOKIE_SECURE'] = False
+    return app_module
+
+
+def install_stub_model(app_module, latency_ms, jitter_ms, **faults):
+    """Replaces the model with the stub; `faults` are StubGenerativeModel's error_rate, slow_rate, ..."""
+    from benchmarks.stub_model import CANNED_ANALYSIS, CANNED_ANALYSIS_JSON, StubGenerativeModel
+    # Answer in the format the app expects (PRIORITIZE_OUTPUT_FORMAT)
+    analysis_text = CANNED_ANALYSIS_JSON if app_module.STRUCTURED_ANALYSIS else CANNED_ANALYSIS
+    stub = StubGenerativeModel(latency_ms=latency_ms, jitter_ms=jitter_ms, analysis_text=analysis_text, **faults)
+    app_module.model_router.build = lambda profile_name, model_name: stub
+    app_module.model_router.clear()
+    return stub
+
+
+def make_csv(num_rows, columns, seed=0):
+    """Returns a synthetic intake CSV (bytes) with `num_rows` rows and the given columns."""
+    rng = random.Random(seed)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    filler = "Staff review submissions by hand and re-key values between two systems"
+    for i in range(num_rows):
+        row = []
+        for column in columns:
+            if column == 'Title of Your Project':
+                row.append(f"Automation request {i + 1}")
+            elif column.startswith(('Approximately how many', 'How many', 'What is the estimated reduction')):
+                row.append(str(rng.randint(1, 60)))
+            else:
+                row.append(f"{filler} ({i})")
+        writer.writerow(row)
+    return buffer.getvalue().encode('utf-8')
+
+
+class Client:
+    """A urllib client with its own cookie jar (i.e. its own Flask session)."""
+
+    def __init__(self, base_url, api_key, cookies=None):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.cookies = http.cookiejar.CookieJar()
+        for cookie in cookies or ():
+            self.cookies.set_cookie(cookie)
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies))
+
+    def request(self, method, path, body=None, content_type=None):
+        headers = {'X-API-KEY': self.api_key}
+        if content_type:
+            headers['Content-Type'] = content_type
+        req = urllib.request.Request(self.base_url + path, data=body, method=method, headers=headers)
+        try:
+            with self.opener.open(req, timeout=300) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def upload(self, csv_bytes):
+        boundary = uuid.uuid4().hex
+        body = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="bench.csv"\r\n'
+                f'Content-Type: text/csv\r\n\r\n').encode() + csv_bytes + f'\r\n--{boundary}--\r\n'.encode()
+        return self.request('POST', '/upload', body, f'multipart/form-data; boundary={boundary}')
+
+
+class MemorySampler:
+    """Samples this process's RSS in the background and keeps the peak."""
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.peak = 0
+        self._process = psutil.Process()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self._process.memory_info().rss)
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.peak = self._process.memory_info().rss
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._process.memory_info().rss)
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * pct / 100.0
+    lo, hi = int(k), min(int(k) + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def run_scenario(name, make_request, num_requests, concurrency):
+    """Runs `make_request(i)` num_requests times on `concurrency` threads and summarizes it."""
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal errors
+        start = time.perf_counter()
+        status, _ = make_request(i)
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            if status >= 400:
+                errors += 1
+
+    with MemorySampler() as memory:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one, range(num_requests)))
+        wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "scenario": name,
+        "requests": num_requests,
+        "errors": errors,
+        "throughput_rps": round(num_requests / wall, 2) if wall else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 2) if latencies else 0.0,
+        "peak_rss_mb": round(memory.peak / (1024 * 1024), 1),
+    }
+
+
+def run_all(args):
+    with tempfile.TemporaryDirectory() as store_dir:
+        app_module = load_app(store_dir)
+        install_stub_model(app_module, args.latency_ms, args.jitter_ms, error_rate=args.error_rate,
+                           quota_rate=args.quota_rate, slow_rate=args.slow_rate, slow_ms=args.slow_ms)
+
+        from werkzeug.serving import make_server
+        server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_port}"
+
+        results = {}
+        try:
+            for num_rows in args.rows:
+                csv_bytes = make_csv(num_rows, app_module.REQUIRED_COLUMNS, seed=num_rows)
+                print(f"\n== {num_rows} rows ({len(csv_bytes) / 1e6:.1f} MB CSV) ==")
+
+                # One upload establishes the session shared by the read/analysis scenarios
+                seed_client = Client(base_url, app_module.API_KEY)
+                status, body = seed_client.upload(csv_bytes)
+                if status != 200:
+                    raise RuntimeError(f"Seed upload failed ({status}): {body[:200]!r}")
+                cookies = list(seed_client.cookies)
+                local = threading.local()
+
+                def client():
+                    if not hasattr(local, 'client'):
+                        local.client = Client(base_url, app_module.API_KEY, cookies)
+                    return local.client
+
+                requests_per_scenario = {
+                    # Uploads are heavy on large files, so fewer of them
+                    'upload': max(args.upload_concurrency, args.requests // max(1, num_rows // 1000)),
+                    'preview': args.requests,
+                    'prioritize': args.requests,
+                    'chat': args.requests,
+                }
+                actions = {
+                    'upload': lambda i: Client(base_url, app_module.API_KEY).upload(csv_bytes),
+                    'preview': lambda i: client().request('GET', f'/preview_request/{random.randrange(num_rows)}'),
+                    # Distinct rows first, so early calls miss the analysis store and exercise the stub
+                    'prioritize': lambda i: client().request('GET', f'/prioritize/{i % num_rows}'),
+                    'chat': lambda i: client().request(
+                        'POST', '/chat',
+                        json.dumps({"query": f"Why is row {i} ranked this way?"}).encode(), 'application/json'),
+                }
+
+                for scenario in args.scenarios:
+                    concurrency = args.upload_concurrency if scenario == 'upload' else args.concurrency
+                    result = run_scenario(scenario, actions[scenario], requests_per_scenario[scenario], concurrency)
+                    results[f"{scenario}@{num_rows}"] = result
+                    print(f"  {scenario:<11} {result['throughput_rps']:>9.1f} req/s  "
+                          f"p50 {result['p50_ms']:>8.1f} ms  p95 {result['p95_ms']:>8.1f} ms  "
+                          f"p99 {result['p99_ms']:>8.1f} ms  peak RSS {result['peak_rss_mb']:>7.1f} MB  "
+                          f"errors {result['errors']}")
+        finally:
+            server.shutdown()
+            # Release the uploads through the manifest, which also drops their cached DataFrames
+            app_module.upload_manager.shrink_to(0, reason='released')
+    return results
+
+
+def settings_mismatch(args, baseline_settings):
+    """Returns [(setting, baseline value, run value)] for the COMPARED_SETTINGS that differ."""
+    mismatched = []
+    for name in COMPARED_SETTINGS:
+        recorded = baseline_settings.get(name, 0)
+        if float(recorded) != float(getattr(args, name)):
+            mismatched.append((name, recorded, getattr(args, name)))
+    return mismatched
+
+
+def compare(results, baseline, tolerance):
+    """Prints per-metric changes against the baseline and returns the regressions found."""
+    regressions = []
+    print(f"\n== Comparison with baseline (tolerance {tolerance:.0%}) ==")
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            print(f"  {key:<22} no baseline")
+            continue
+        for metric, higher_is_better in (('throughput_rps', True), ('p95_ms', False), ('peak_rss_mb', False)):
+            old, new = base[metric], result[metric]
+            if not old:
+                continue
+            change = (new - old) / old
+            regressed = change < -tolerance if higher_is_better else change > tolerance
+            marker = '  REGRESSION' if regressed else ''
+            print(f"  {key:<22} {metric:<15} {old:>10} -> {new:>10} ({change:+.1%}){marker}")
+            if regressed:
+                regressions.append((key, metric, old, new))
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline AiPrio load test with a stub model.")
+    parser.add_argument('--rows', default='100,10000,100000',
+                        help="Comma-separated synthetic CSV sizes (default: 100,10000,100000)")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f"Comma-separated scenarios to run (default: {','.join(SCENARIOS)})")
+    parser.add_argument('--concurrency', type=int, default=8, help="Concurrent client threads (default: 8)")
+    parser.add_argument('--upload-concurrency', type=int, default=2,
+                        help="Concurrent uploads; kept low because large uploads are memory-heavy (default: 2)")
+    parser.add_argument('--requests', type=int, default=200, help="Requests per scenario (default: 200)")
+    # Defaults match the settings benchmarks/baselines.json was recorded with
+    parser.add_argument('--latency-ms', type=float, default=200.0, help="Stub model latency per call (default: 200)")
+    parser.add_argument('--jitter-ms', type=float, default=100.0,
+                        help="Extra uniform random stub latency (default: 100)")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="Fraction of stub calls that fail as unavailable (default: 0)")
+    parser.add_argument('--quota-rate', type=float, default=0.0,
+                        help="Fraction of stub calls that fail as quota exhausted (default: 0)")
+    parser.add_argument('--slow-rate', type=float, default=0.0,
+                        help="Fraction of stub calls that take --slow-ms longer (default: 0)")
+    parser.add_argument('--slow-ms', type=float, default=0.0, help="Extra latency of slow stub calls (default: 0)")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="Baseline file to compare against or save")
+    parser.add_argument('--save-baseline', action='store_true', help="Save these results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="Relative change counted as a regression (default: 0.2)")
+    args = parser.parse_args(argv)
+    args.rows = [int(r) for r in args.rows.split(',') if r]
+    args.scenarios = [s for s in args.scenarios.split(',') if s]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    print(f"Stub latency {args.latency_ms} ms (+{args.jitter_ms} ms jitter), concurrency {args.concurrency}, "
+          f"{args.requests} requests per scenario")
+    if args.error_rate or args.quota_rate or args.slow_rate:
+        print(f"Injected faults: {args.error_rate:.0%} unavailable, {args.quota_rate:.0%} quota, "
+              f"{args.slow_rate:.0%} slow (+{args.slow_ms} ms)")
+    results = run_all(args)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({
+                "recorded_at": time.strftime('%Y-%m-%d %H:%M:%S'),
+                "machine": {"python": platform.python_version(), "platform": platform.platform(),
+                            "cpus": os.cpu_count()},
+                "settings": {name: getattr(args, name) for name in COMPARED_SETTINGS},
+                "results": results,
+            }, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+        return 0
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        mismatched = settings_mismatch(args, baseline.get('settings', {}))
+        if mismatched:
+            print(f"\nNot compared with {args.baseline}: it was recorded with different settings")
+            for name, recorded, current in mismatched:
+                print(f"  {name:<20} baseline {recorded}  this run {current}")
+            print("Re-run with the baseline's settings, or record a new baseline with --save-baseline.")
+            return 2
+        if compare(results, baseline.get('results', {}), args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,177 @@
+"""
+Compares request throughput of the Flask development server (`python app.py`)
+with the production launchers: gunicorn (gunicorn.conf.py) and waitress (serve.py).
+
+Each server runs in its own process group serving benchmarks/stub_wsgi.py (the
+real app with the stub model), and is driven over HTTP from this process:
+/preview_request (CPU-bound: Arrow read and JSON) and /chat with distinct
+questions (I/O-bound: every call waits on the stub model). Reports time to
+first response, requests/sec, p50/p95 latency and the server's memory (PSS)
+summed over all its processes. Measured results are in docs/deployment.md.
+
+Usage (from the repository root):
+    python -m benchmarks.server_benchmark
+    python -m benchmarks.server_benchmark --servers dev,gunicorn --concurrency 64 --latency-ms 500
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import psutil
+
+from benchmarks.run_benchmarks import REPO_ROOT, Client, load_app, make_csv, run_scenario
+
+SERVERS = ('dev', 'gunicorn', 'waitress')
+
+
+def server_command(name, port, threads):
+    if name == 'dev':
+        return [sys.executable, '-m', 'benchmarks.stub_wsgi']
+    if name == 'gunicorn':
+        return ['gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}',
+                'benchmarks.stub_wsgi:application']
+    if name == 'waitress':
+        return ['waitress-serve', f'--listen=127.0.0.1:{port}', f'--threads={threads}',
+                'benchmarks.stub_wsgi:application']
+    raise ValueError(name)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def server_memory_mb(process):
+    """
+    Memory of the server and all its children (gunicorn workers), in MB. Uses PSS
+    where available, so pages shared copy-on-write after a preload are counted once.
+    """
+    total = 0
+    for proc in [process] + process.children(recursive=True):
+        try:
+            info = proc.memory_full_info()
+            total += getattr(info, 'pss', info.rss)
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            pass
+    return round(total / (1024 * 1024), 1)
+
+
+def wait_until_ready(base_url, timeout=120):
+    started = time.perf_counter()
+    client = Client(base_url, '')
+    while time.perf_counter() - started < timeout:
+        try:
+            status, _ = client.request('GET', '/about')
+            if status == 200:
+                return time.perf_counter() - started
+        except OSError:
+            pass
+        time.sleep(0.05)
+    raise RuntimeError(f"Server at {base_url} did not start within {timeout} s")
+
+
+def bench_server(name, args, csv_bytes, api_key):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    store_dir = tempfile.mkdtemp(prefix=f'aiprio-{name}-')
+    env = dict(os.environ, BENCHMARK_STORE_DIR=store_dir, BENCHMARK_PORT=str(port),
+               BENCHMARK_LATENCY_MS=str(args.latency_ms), BENCHMARK_JITTER_MS=str(args.jitter_ms),
+               SERVER_WORKERS=str(args.workers), SERVER_THREADS=str(args.threads))
+    process = subprocess.Popen(server_command(name, port, args.threads), cwd=REPO_ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    try:
+        startup = wait_until_ready(base_url)
+        seed_client = Client(base_url, api_key)
+        status, body = seed_client.upload(csv_bytes)
+        if status != 200:
+            raise RuntimeError(f"Seed upload failed ({status}): {body[:200]!r}")
+        cookies = list(seed_client.cookies)
+        local = threading.local()
+
+        def client():
+            if not hasattr(local, 'client'):
+                local.client = Client(base_url, api_key, cookies)
+            return local.client
+
+        actions = {
+            'preview': lambda i: client().request('GET', f'/preview_request/{random.randrange(args.rows)}'),
+            # Distinct questions, so every request misses the chat cache and waits on the model
+            'chat': lambda i: client().request(
+                'POST', '/chat', json.dumps({"query": f"{name} question {i}?"}).encode(), 'application/json'),
+        }
+        result = {"startup_s": round(startup, 2)}
+        for scenario in args.scenarios:
+            summary = run_scenario(scenario, actions[scenario], args.requests, args.concurrency)
+            result[scenario] = {k: summary[k] for k in ('throughput_rps', 'p50_ms', 'p95_ms', 'errors')}
+        result["server_memory_mb"] = server_memory_mb(psutil.Process(process.pid))
+        return result
+    finally:
+        os.killpg(process.pid, signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+        shutil.rmtree(store_dir, ignore_errors=True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Dev server vs production launchers, with a stub model.")
+    parser.add_argument('--servers', default=','.join(SERVERS),
+                        help=f"Comma-separated servers to run (default: {','.join(SERVERS)})")
+    parser.add_argument('--scenarios', default='preview,chat', help="preview and/or chat (default: both)")
+    parser.add_argument('--rows', type=int, default=1000, help="Rows in the uploaded CSV (default: 1000)")
+    parser.add_argument('--requests', type=int, default=400, help="Requests per scenario (default: 400)")
+    parser.add_argument('--concurrency', type=int, default=32, help="Concurrent client threads (default: 32)")
+    parser.add_argument('--latency-ms', type=float, default=300.0, help="Stub model latency per call (default: 300)")
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help="Extra uniform random stub latency (default: 0)")
+    parser.add_argument('--workers', type=int, default=1, help="SERVER_WORKERS for gunicorn (default: 1)")
+    parser.add_argument('--threads', type=int, default=32, help="SERVER_THREADS for gunicorn/waitress (default: 32)")
+    parser.add_argument('--output', help="Also write the results to this JSON file")
+    args = parser.parse_args(argv)
+    args.servers = [s for s in args.servers.split(',') if s]
+    args.scenarios = [s for s in args.scenarios.split(',') if s]
+    unknown = set(args.servers) - set(SERVERS)
+    if unknown:
+        parser.error(f"Unknown servers: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory() as store_dir:
+        # Imported here only for the column names and the API key
+        app_module = load_app(store_dir)
+        csv_bytes = make_csv(args.rows, app_module.REQUIRED_COLUMNS, seed=args.rows)
+        api_key = app_module.API_KEY
+
+    print(f"Stub latency {args.latency_ms} ms, concurrency {args.concurrency}, {args.requests} requests "
+          f"per scenario, {args.workers} worker(s) x {args.threads} threads, {os.cpu_count()} CPU(s)")
+    results = {}
+    for name in args.servers:
+        results[name] = result = bench_server(name, args, csv_bytes, api_key)
+        line = f"  {name:<9} ready {result['startup_s']:>5.2f} s"
+        for scenario in args.scenarios:
+            s = result[scenario]
+            line += (f"  {scenario} {s['throughput_rps']:>7.1f} req/s p50 {s['p50_ms']:>7.1f} ms "
+                     f"p95 {s['p95_ms']:>7.1f} ms err {s['errors']}")
+        print(line + f"  memory {result['server_memory_mb']} MB")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"settings": {k: v for k, v in vars(args).items() if k != 'output'},
+                       "cpus": os.cpu_count(), "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
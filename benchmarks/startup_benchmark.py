@@ -0,0 +1,116 @@
+"""
+Startup-time benchmark and import profile for AiPrio.
+
+Measures, each in a fresh interpreter, how long `import app` takes and how long
+until the first request (/about) is answered, and fails if the median is over
+budget or if any heavy third-party package that should be deferred to first use
+was imported by then. Also prints the slowest imports from `python -X importtime`.
+
+Usage (from the repository root):
+    python -m benchmarks.startup_benchmark
+    python -m benchmarks.startup_benchmark --runs 10 --budget-ms 800 --top 30
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.run_benchmarks import REPO_ROOT, store_env
+
+# Median time from `import app` to a served /about. Measured at about 390 ms on the
+# reference machine in docs/deployment.md; raise it only with a reason.
+STARTUP_BUDGET_MS = 600
+
+# Packages that no route needs at startup; each should be imported on first use
+DEFERRED_PACKAGES = ('pandas', 'pyarrow', 'google.generativeai', 'googleapiclient', 'google_auth_oauthlib')
+
+PROBE = f"""
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.app.test_client().get('/about')
+served = time.perf_counter()
+print(json.dumps({{
+    "import_ms": (imported - started) * 1000,
+    "first_request_ms": (served - started) * 1000,
+    "loaded": [name for name in {DEFERRED_PACKAGES!r} if name in sys.modules],
+}}))
+"""
+
+
+def benchmark_env(store_dir):
+    return dict(os.environ,
+                SECRET_KEY=os.environ.get('SECRET_KEY', 'benchmark-secret'),
+                GOOGLE_API_KEY=os.environ.get('GOOGLE_API_KEY', 'benchmark-placeholder'),
+                **store_env(store_dir),
+                PYTHONWARNINGS='ignore')
+
+
+def measure_startup(runs, env):
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', PROBE], cwd=REPO_ROOT, env=env,
+                                capture_output=True, text=True, check=True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    return samples
+
+
+def import_profile(env, top):
+    """Returns the `top` slowest imports as (cumulative_ms, self_ms, module), slowest first."""
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=REPO_ROOT, env=env,
+                            capture_output=True, text=True, check=True).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        rows.append((int(cumulative_us) / 1000, int(self_us) / 1000, module.rstrip()))
+    rows.sort(reverse=True)
+    return rows[:top]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="AiPrio startup-time benchmark and import profile.")
+    parser.add_argument('--runs', type=int, default=5, help="Fresh interpreters to time (default: 5)")
+    parser.add_argument('--budget-ms', type=float, default=STARTUP_BUDGET_MS,
+                        help=f"Fail if the median time to first response exceeds this (default: {STARTUP_BUDGET_MS})")
+    parser.add_argument('--top', type=int, default=20, help="Slowest imports to list (default: 20)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory() as store_dir:
+        env = benchmark_env(store_dir)
+        samples = measure_startup(args.runs, env)
+        profile = import_profile(env, args.top)
+
+    print("== Slowest imports (python -X importtime -c 'import app') ==")
+    print(f"  {'cumulative':>10}  {'self':>8}  module")
+    for cumulative_ms, self_ms, module in profile:
+        print(f"  {cumulative_ms:>8.1f} ms  {self_ms:>5.1f} ms  {module}")
+
+    import_ms = statistics.median(s['import_ms'] for s in samples)
+    first_request_ms = statistics.median(s['first_request_ms'] for s in samples)
+    loaded = samples[-1]['loaded']
+    print(f"\n== Startup over {args.runs} runs (median) ==")
+    print(f"  import app          {import_ms:>8.1f} ms")
+    print(f"  first /about served {first_request_ms:>8.1f} ms  (budget {args.budget_ms:.0f} ms)")
+    print(f"  deferred packages loaded at startup: {', '.join(loaded) or 'none'}")
+
+    failed = False
+    if first_request_ms > args.budget_ms:
+        print(f"\nOVER BUDGET by {first_request_ms - args.budget_ms:.0f} ms")
+        failed = True
+    if loaded:
+        print(f"\nImported at startup but should be deferred: {', '.join(loaded)}")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,154 @@
+import json
+import random
+import time
+
+# Canned analysis in the format the prioritization prompt asks for, so the
+# scoring and Overall Priority injection run exactly as they do in production
+CANNED_ANALYSIS = """| Category | Rating | Rating % | Justification |
+|---|---|---|---|
+| **Strategic Alignment** | <span class="rating-high">High</span> | 85% | The request supports operational excellence and product safety through digital automation of a regulatory workflow. |
+| **Potential Impact** | <span class="rating-high">High</span> | 80% | Faster processing and fewer manual errors are expected, improving compliance turnaround. |
+| **Complexity & Implementation Difficulty** | <span class="rating-medium">Medium</span> | 60% | Integration with two existing systems is required and the data is partly structured. |
+| **Urgency & Necessity** | <span class="rating-medium">Medium</span> | 65% | Backlogs grow each quarter, but there is no hard regulatory deadline. |
+| **Risk & Challenges** | <span class="rating-low">Low</span> | 40% | Risks are limited to data quality and change management. |
+| **Hours Spent each month** | <span class="rating-very-high">Very High</span> | 95% | More than 41 hours are spent on the procedure every month. |
+| **Number of Employees** | <span class="rating-medium">Medium</span> | 70% | Between six and ten employees work on the procedure. |
+| **Number of Systems** | <span class="rating-medium">Medium</span> | 60% | Two electronic systems are used during the procedure. |
+| **Stakeholders Impacted** | <span class="rating-low">Low</span> | 35% | Two to three departments benefit from the automation. |
+
+## Conclusion
+The request is a strong candidate for automation given the monthly workload and the number of employees involved. A pilot on one directorate is recommended, followed by data validation and stakeholder consultation before scaling.
+
+## Enhancement Suggestions
+- Add OCR for scanned submissions so the bot can process legacy documents.
+- Publish a KPI dashboard that tracks processing time before and after the rollout.
+"""
+
+# The same analysis as a structured-output (JSON mode) response, matching
+# analysis_schema.RESPONSE_SCHEMA
+CANNED_ANALYSIS_JSON = json.dumps({
+    "ratings": [
+        {"category": "Strategic Alignment", "rating": "High", "percent": 85,
+         "justification": "The request supports operational excellence and product safety through digital automation of a regulatory workflow."},
+        {"category": "Potential Impact", "rating": "High", "percent": 80,
+         "justification": "Faster processing and fewer manual errors are expected, improving compliance turnaround."},
+        {"category": "Complexity & Implementation Difficulty", "rating": "Medium", "percent": 60,
+         "justification": "Integration with two existing systems is required and the data is partly structured."},
+        {"category": "Urgency & Necessity", "rating": "Medium", "percent": 65,
+         "justification": "Backlogs grow each quarter, but there is no hard regulatory deadline."},
+        {"category": "Risk & Challenges", "rating": "Low", "percent": 40,
+         "justification": "Risks are limited to data quality and change management."},
+        {"category": "Hours Spent each month", "rating": "Very High", "percent": 95,
+         "justification": "More than 41 hours are spent on the procedure every month."},
+        {"category": "Number of Employees", "rating": "Medium", "percent": 70,
+         "justification": "Between six and ten employees work on the procedure."},
+        {"category": "Number of Systems", "rating": "Medium", "percent": 60,
+         "justification": "Two electronic systems are used during the procedure."},
+        {"category": "Stakeholders Impacted", "rating": "Low", "percent": 35,
+         "justification": "Two to three departments benefit from the automation."},
+    ],
+    "conclusion": ("The request is a strong candidate for automation given the monthly workload and the number of employees involved. "
+                   "A pilot on one directorate is recommended, followed by data validation and stakeholder consultation before scaling."),
+    "suggestions": [
+        "Add OCR for scanned submissions so the bot can process legacy documents.",
+        "Publish a KPI dashboard that tracks processing time before and after the rollout.",
+    ],
+})
+
+CANNED_CHAT_ANSWER = ("The overall priority is driven mostly by the hours spent each month and the number of "
+                      "employees, which together carry 75% of the weight.")
+
+
+# Stand-ins for the google.api_core exceptions the SDK raises. The app classifies
+# upstream errors by class name through the MRO, so these are handled exactly like
+# the real ones without importing the SDK.
+class ServerError(Exception):
+    pass
+
+
+class ServiceUnavailable(ServerError):
+    pass
+
+
+class TooManyRequests(Exception):
+    pass
+
+
+class ResourceExhausted(TooManyRequests):
+    pass
+
+
+class GatewayTimeout(Exception):
+    pass
+
+
+class DeadlineExceeded(GatewayTimeout):
+    pass
+
+
+class StubResponse:
+    """Mimics the parts of GenerateContentResponse the app reads."""
+
+    def __init__(self, text, chunk_chars=None):
+        self._text = text
+        self._chunk_chars = chunk_chars
+        self.prompt_feedback = None
+
+    @property
+    def text(self):
+        return self._text
+
+    def __iter__(self):
+        # Streaming responses yield chunk objects that each expose .text
+        for i in range(0, len(self._text), self._chunk_chars or len(self._text) or 1):
+            yield StubResponse(self._text[i:i + self._chunk_chars])
+
+
+class StubGenerativeModel:
+    """
+    Local stand-in for google.generativeai.GenerativeModel with tunable latency.
+    Prompts that contain the prioritization Request Details get the canned
+    analysis; anything else gets the canned chat answer.
+
+    Faults can be injected to exercise retries, hedging and the circuit breaker:
+    `error_rate` of calls raise ServiceUnavailable, `quota_rate` raise
+    ResourceExhausted, and `slow_rate` take an extra `slow_ms` (a latency tail).
+    A call that would outlast request_options["timeout"] raises DeadlineExceeded
+    at the timeout, as the SDK does.
+    """
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, stream_chunk_chars=120,
+                 analysis_text=CANNED_ANALYSIS, chat_text=CANNED_CHAT_ANSWER,
+                 error_rate=0.0, quota_rate=0.0, slow_rate=0.0, slow_ms=0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.stream_chunk_chars = stream_chunk_chars
+        self.analysis_text = analysis_text
+        self.chat_text = chat_text
+        self.error_rate = error_rate
+        self.quota_rate = quota_rate
+        self.slow_rate = slow_rate
+        self.slow_ms = slow_ms
+
+    def _sleep(self, timeout):
+        delay = self.latency_ms + random.uniform(0, self.jitter_ms)
+        if random.random() < self.slow_rate:
+            delay += self.slow_ms
+        if timeout is not None and delay / 1000.0 > timeout:
+            time.sleep(timeout)
+            raise DeadlineExceeded(f"Stub model did not answer within {timeout:.1f} s")
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+
+    def _maybe_fail(self):
+        roll = random.random()
+        if roll < self.error_rate:
+            raise ServiceUnavailable("Stub model is unavailable (injected fault)")
+        if roll < self.error_rate + self.quota_rate:
+            raise ResourceExhausted("Stub model quota exhausted (injected fault)")
+
+    def generate_content(self, contents, stream=False, request_options=None, **kwargs):
+        self._sleep((request_options or {}).get('timeout'))
+        self._maybe_fail()
+        text = self.analysis_text if '**Request Details:**' in str(contents) else self.chat_text
+        return StubResponse(text, chunk_chars=self.stream_chunk_chars if stream else None)
@@ -0,0 +1,25 @@
+"""
+WSGI entry point used by benchmarks/server_benchmark.py: the real app with the
+stub model installed, so each server can be measured without the Gemini API.
+Settings come from BENCHMARK_* environment variables set by that script.
+
+    gunicorn -c gunicorn.conf.py benchmarks.stub_wsgi:application
+    waitress-serve --threads 32 benchmarks.stub_wsgi:application
+    python -m benchmarks.stub_wsgi  # Flask development server, as `python app.py`
+"""
+import os
+
+from benchmarks.run_benchmarks import install_stub_model, load_app
+
+app_module = load_app(os.environ['BENCHMARK_STORE_DIR'])
+install_stub_model(app_module,
+                   latency_ms=float(os.getenv('BENCHMARK_LATENCY_MS', 0)),
+                   jitter_ms=float(os.getenv('BENCHMARK_JITTER_MS', 0)),
+                   error_rate=float(os.getenv('BENCHMARK_ERROR_RATE', 0)),
+                   quota_rate=float(os.getenv('BENCHMARK_QUOTA_RATE', 0)),
+                   slow_rate=float(os.getenv('BENCHMARK_SLOW_RATE', 0)),
+                   slow_ms=float(os.getenv('BENCHMARK_SLOW_MS', 0)))
+application = app_module.app
+
+if __name__ == '__main__':
+    application.run(host='127.0.0.1', port=int(os.getenv('BENCHMARK_PORT', 5000)), threaded=True)
@@ -0,0 +1,83 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = re.compile(r"[\s?!.]+$")
+
+
+def normalize_query(query):
+    """
+    Reduces a chat query to the form used for cache lookups: case-folded, with
+    runs of whitespace collapsed and trailing "?", "!" and "." removed, so
+    "Why is the score low?" and "why is the score low" share an answer.
+    """
+    return _TRAILING_PUNCTUATION.sub("", _WHITESPACE.sub(" ", query.casefold()).strip())
+
+
+def make_chat_key(analysis_text, query, model_name):
+    """
+    Cache key for a chat answer: a SHA-256 over the model name, a fingerprint
+    of the analysis the question is about and the normalized query.
+    """
+    fingerprint = hashlib.sha256(analysis_text.encode('utf-8')).hexdigest()
+    material = "\x1f".join((model_name, fingerprint, normalize_query(query)))
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+class ChatAnswerCache:
+    """
+    In-memory cache of chatbot answers, bounded by entry count (least recently
+    used first) and by age. Per process, like the parsed-DataFrame cache.
+    """
+
+    def __init__(self, max_entries, ttl_seconds):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (stored_at, answer)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Returns the cached answer for `key`, or None if absent or expired."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] >= now - self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, answer):
+        with self._lock:
+            self._entries[key] = (time.time(), answer)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return a snapshot of the hit/miss counters and current size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
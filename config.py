@@ -1,3 +1,4 @@
+import json
 import os
 from dotenv import load_dotenv
 
@@ -16,6 +17,16 @@ class Config:
     SESSION_COOKIE_HTTPONLY = True
     SESSION_COOKIE_SAMESITE = 'Lax' # Recommended for CSRF protection
 
+    # Production server (gunicorn.conf.py, serve.py). Requests mostly wait on the model, so
+    # concurrency comes from threads; every shared state (uploads, stores, job and batch
+    # status, rate limits) lives in files and SQLite, so SERVER_WORKERS may be raised.
+    SERVER_WORKERS = int(os.getenv('SERVER_WORKERS', 1))
+    SERVER_THREADS = int(os.getenv('SERVER_THREADS', 32))
+    SERVER_TIMEOUT_SECONDS = int(os.getenv('SERVER_TIMEOUT_SECONDS', 120))
+
+    # Error log written by the app (relative paths are from the working directory)
+    LOG_FILE = os.getenv('LOG_FILE', 'app.log')
+
     SECRET_KEY = os.getenv('SECRET_KEY')
     if not SECRET_KEY:
         raise ValueError("No SECRET_KEY set for Flask application. Set it in .env or environment variables.")
@@ -32,3 +43,167 @@ class Config:
     # According to the documentation for gemini-1.5-flash, 
     # set the maximum output tokens to the highest available limit.
     MAX_OUTPUT_TOKENS = 8000  # Adjust if your model supports a different limit
+
+    # Token budgets for the prioritization prompt. Free-text answers are whitespace-normalized
+    # and truncated to their field's budget (estimated at ~4 characters per token); fields
+    # not listed use the default.
+    PROMPT_FIELD_DEFAULT_TOKEN_BUDGET = int(os.getenv('PROMPT_FIELD_DEFAULT_TOKEN_BUDGET', 300))
+    PROMPT_FIELD_TOKEN_BUDGETS = {
+        'Briefly explain the current procedure or process you are proposing for RPA or AI': 600,
+        'What is the main problem or bottleneck you are experiencing with this current process?': 500,
+        'In brief, explain your RPA or AI idea to address the problem:': 500,
+        'How will you measure the success or effectiveness of this automation? List key performance indicators (KPIs):': 300,
+    }
+
+    # max_output_tokens per call: a base allowance plus a share of the estimated input
+    # tokens, capped at the ceiling (never above MAX_OUTPUT_TOKENS)
+    OUTPUT_TOKEN_LIMITS = {
+        "prioritize": {"base": 2048, "per_input_token": 0.5, "ceiling": MAX_OUTPUT_TOKENS},
+        "chat": {"base": 512, "per_input_token": 0.25, "ceiling": 2048},
+    }
+
+    # Model settings per call site. Each profile has a primary model and a fallback that
+    # takes over when the primary times out (timeout_seconds per attempt), runs out of
+    # quota, is unavailable or has its circuit open. deadline_seconds bounds the whole
+    # call, retries and fallback included. max_output_tokens caps the profile's
+    # OUTPUT_TOKEN_LIMITS. system_prompt names the prompts/ template sent as the system
+    # instruction (PROMPT_VERSION applies). With output_format "json" the prioritization
+    # model answers in JSON constrained to analysis_schema.RESPONSE_SCHEMA (using the
+    # <system_prompt>_json template), which the server validates, scores and renders to
+    # the Markdown table itself; "markdown" has the model write the table.
+    # Chat answers are short, so chat uses a faster model with a smaller output budget;
+    # prioritization keeps the full model and its near-deterministic sampling.
+    MODEL_PROFILES = {
+        "prioritize": {
+            "model": GENAI_MODEL_NAME,
+            "fallback_model": os.getenv('PRIORITIZE_FALLBACK_MODEL', 'gemini-1.5-flash'),
+            "temperature": 0.9,
+            "top_p": 0.01,
+            "top_k": 2,
+            "max_output_tokens": MAX_OUTPUT_TOKENS,
+            "timeout_seconds": int(os.getenv('PRIORITIZE_TIMEOUT_SECONDS', 90)),
+            "deadline_seconds": int(os.getenv('PRIORITIZE_DEADLINE_SECONDS', 150)),
+            "system_prompt": "prioritization",
+            "output_format": os.getenv('PRIORITIZE_OUTPUT_FORMAT', 'markdown'),
+        },
+        "chat": {
+            "model": os.getenv('CHAT_MODEL_NAME', 'gemini-2.0-flash-lite'),
+            "fallback_model": os.getenv('CHAT_FALLBACK_MODEL', GENAI_MODEL_NAME),
+            "temperature": 0.4,
+            "top_p": 0.9,
+            "top_k": 40,
+            "max_output_tokens": 1024,
+            "timeout_seconds": int(os.getenv('CHAT_TIMEOUT_SECONDS', 20)),
+            "deadline_seconds": int(os.getenv('CHAT_DEADLINE_SECONDS', 40)),
+            "system_prompt": None,
+        },
+    }
+
+    # Resilience of model calls (resilience.py). Transient upstream errors (5xx) are retried
+    # up to LLM_RETRY_ATTEMPTS times with jittered exponential backoff. An attempt still
+    # running after the LLM_HEDGE_PERCENTILE latency of recent calls gets a duplicate
+    # request (at most LLM_HEDGE_MAX_RATIO of calls) and the first answer wins. After
+    # LLM_BREAKER_FAILURE_THRESHOLD consecutive upstream failures a model's circuit opens:
+    # its calls fail fast (or go to the fallback) for LLM_BREAKER_RESET_SECONDS, then one
+    # trial call decides whether it closes. Attempts run on LLM_CALL_WORKERS threads.
+    LLM_RETRY_ATTEMPTS = int(os.getenv('LLM_RETRY_ATTEMPTS', 3))
+    LLM_RETRY_BASE_SECONDS = float(os.getenv('LLM_RETRY_BASE_SECONDS', 0.5))
+    LLM_RETRY_MAX_SECONDS = float(os.getenv('LLM_RETRY_MAX_SECONDS', 4))
+    LLM_HEDGE_PERCENTILE = float(os.getenv('LLM_HEDGE_PERCENTILE', 95))
+    LLM_HEDGE_MIN_SAMPLES = int(os.getenv('LLM_HEDGE_MIN_SAMPLES', 20))
+    LLM_HEDGE_MAX_RATIO = float(os.getenv('LLM_HEDGE_MAX_RATIO', 0.1))
+    LLM_BREAKER_FAILURE_THRESHOLD = int(os.getenv('LLM_BREAKER_FAILURE_THRESHOLD', 5))
+    LLM_BREAKER_RESET_SECONDS = int(os.getenv('LLM_BREAKER_RESET_SECONDS', 30))
+    LLM_CALL_WORKERS = int(os.getenv('LLM_CALL_WORKERS', 64))
+
+    # Shared rate limit per model, matching the API key's quota. Every worker process draws
+    # on the same request and token buckets (RATE_LIMIT_PATH). A call is charged one request
+    # and its estimated tokens (prompt plus max_output_tokens), corrected once the actual
+    # usage is known. Interactive calls go ahead of batch ones, and batch calls leave
+    # LLM_RATE_LIMIT_INTERACTIVE_RESERVE of each bucket free. Set a limit to 0 to disable it.
+    LLM_REQUESTS_PER_MINUTE = int(os.getenv('LLM_REQUESTS_PER_MINUTE', 1000))
+    LLM_TOKENS_PER_MINUTE = int(os.getenv('LLM_TOKENS_PER_MINUTE', 1_000_000))
+    LLM_RATE_LIMIT_INTERACTIVE_RESERVE = float(os.getenv('LLM_RATE_LIMIT_INTERACTIVE_RESERVE', 0.2))
+    RATE_LIMIT_PATH = os.getenv('RATE_LIMIT_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'rate_limits.sqlite3'))
+
+    # Folder for uploaded files, outside the web root
+    UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploaded_files'))
+
+    # Upload lifecycle: a manifest of upload files with their owner session and expiry.
+    # An upload expires when its session does (idle for PERMANENT_SESSION_LIFETIME) and is
+    # deleted as soon as its session clears it or uploads a replacement. Byte quotas per
+    # session and in total are enforced at upload time, evicting least recently used files.
+    UPLOAD_MANIFEST_PATH = os.getenv('UPLOAD_MANIFEST_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'uploads.sqlite3'))
+    UPLOAD_SESSION_QUOTA_BYTES = int(os.getenv('UPLOAD_SESSION_QUOTA_BYTES', 200 * 1024 * 1024))
+    UPLOAD_GLOBAL_QUOTA_BYTES = int(os.getenv('UPLOAD_GLOBAL_QUOTA_BYTES', 5 * 1024 * 1024 * 1024))
+
+    # Lock file for the maintenance scheduler. Every server process starts the scheduler, and
+    # only the one holding this lock runs the tasks; its run history sits next to the lock.
+    SCHEDULER_LOCK_PATH = os.getenv('SCHEDULER_LOCK_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'scheduler.lock'))
+
+    # Upper bound on the memory held by parsed upload DataFrames shared between requests
+    DF_CACHE_MAX_BYTES = int(os.getenv('DF_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+
+    # Batch prioritization (/prioritize_all): worker threads shared by all batches, which
+    # bounds the number of concurrent model calls, the largest row range per batch, the
+    # rows a process may have waiting (more are refused with 429), and how long finished
+    # batches stay available for polling. Batch progress is kept in SQLite at
+    # BATCH_STORE_PATH, so a poll can land on any worker process.
+    BATCH_MAX_WORKERS = int(os.getenv('BATCH_MAX_WORKERS', 4))
+    BATCH_MAX_ROWS = int(os.getenv('BATCH_MAX_ROWS', 500))
+    BATCH_MAX_PENDING_ROWS = int(os.getenv('BATCH_MAX_PENDING_ROWS', 2000))
+    BATCH_RETENTION_SECONDS = int(os.getenv('BATCH_RETENTION_SECONDS', 3600))
+    BATCH_STORE_PATH = os.getenv('BATCH_STORE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'batches.sqlite3'))
+
+    # Version of the prioritization rubric in prompts/prioritization_v<N>.txt, sent to the
+    # model as its system instruction. Add a new file and bump this to change the rubric;
+    # the version is part of every analysis cache key.
+    PROMPT_VERSION = "2"
+
+    # Server-side store of finished analyses, shared by all users. Entries are keyed by a
+    # hash of the row's prompt fields, the prioritize profile's model and PROMPT_VERSION.
+    ANALYSIS_STORE_PATH = os.getenv('ANALYSIS_STORE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'analysis_store.sqlite3'))
+    ANALYSIS_STORE_TTL_HOURS = int(os.getenv('ANALYSIS_STORE_TTL_HOURS', 7 * 24))
+    ANALYSIS_STORE_MAX_BYTES = int(os.getenv('ANALYSIS_STORE_MAX_BYTES', 200 * 1024 * 1024))
+    # Analyses written by the fallback model are stored under the same key, but only for
+    # this long, so the primary model replaces them once it is back
+    ANALYSIS_STORE_FALLBACK_TTL_MINUTES = int(os.getenv('ANALYSIS_STORE_FALLBACK_TTL_MINUTES', 60))
+
+    # In-memory cache of chatbot answers, keyed by the analysis and the normalized question
+    CHAT_CACHE_MAX_ENTRIES = int(os.getenv('CHAT_CACHE_MAX_ENTRIES', 2000))
+    CHAT_CACHE_TTL_SECONDS = int(os.getenv('CHAT_CACHE_TTL_SECONDS', 6 * 3600))
+
+    # Background job API (/jobs): worker threads per process, maximum queued jobs, and
+    # how long finished jobs stay available for polling. Job status is kept in SQLite at
+    # JOB_STORE_PATH, so a poll can land on any worker process.
+    JOB_WORKERS = int(os.getenv('JOB_WORKERS', 8))
+    JOB_QUEUE_MAX = int(os.getenv('JOB_QUEUE_MAX', 1000))
+    JOB_RETENTION_SECONDS = int(os.getenv('JOB_RETENTION_SECONDS', 3600))
+    JOB_STORE_PATH = os.getenv('JOB_STORE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'jobs.sqlite3'))
+
+    # Outbound email for /send-report. Reports are queued in a SQLite outbox and sent by a
+    # background thread with retry/backoff. EMAIL_BACKEND is 'gmail' (Gmail API with
+    # credentials/token.pickle, created once with `python gmail_service.py`), 'smtp' (e.g.
+    # a local debugging SMTP server) or 'console'.
+    EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'gmail')
+    EMAIL_QUEUE_PATH = os.getenv('EMAIL_QUEUE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'email_queue.sqlite3'))
+    EMAIL_MAX_ATTEMPTS = int(os.getenv('EMAIL_MAX_ATTEMPTS', 6))
+    EMAIL_RETRY_BASE_SECONDS = float(os.getenv('EMAIL_RETRY_BASE_SECONDS', 30))
+    EMAIL_RETRY_MAX_SECONDS = float(os.getenv('EMAIL_RETRY_MAX_SECONDS', 3600))
+    EMAIL_SENDER = os.getenv('EMAIL_SENDER', 'aiprio@localhost')
+    SMTP_HOST = os.getenv('SMTP_HOST', 'localhost')
+    SMTP_PORT = int(os.getenv('SMTP_PORT', 1025))
+
+    # Approved category weights for the Overall Priority score (docs/prioritization_plan.md).
+    # Fractions that must sum to 1.0; override with a JSON object in PRIORITY_WEIGHTS.
+    PRIORITY_WEIGHTS = json.loads(os.getenv('PRIORITY_WEIGHTS', 'null')) or {
+        "Strategic Alignment": 0.10,
+        "Potential Impact": 0.05,
+        "Complexity & Implementation Difficulty": 0.0,
+        "Urgency & Necessity": 0.025,
+        "Risk & Challenges": 0.025,
+        "Hours Spent each month": 0.35,
+        "Number of Employees": 0.40,
+        "Number of Systems": 0.025,
+        "Stakeholders Impacted": 0.025
+    }
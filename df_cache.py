@@ -0,0 +1,88 @@
+import os
+import threading
+from collections import OrderedDict
+
+import metrics
+
+
+class DataFrameCache:
+    """
+    Process-wide cache of parsed upload DataFrames, keyed by file path.
+
+    Each entry remembers the file's mtime and size at parse time, so a file that
+    was rewritten or replaced on disk is re-parsed instead of served stale.
+    The cache is bounded by the total in-memory size of the cached frames and
+    evicts the least recently used entries first.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # path -> (mtime, size, nbytes, DataFrame)
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, path):
+        """
+        Return the parsed DataFrame for `path`, parsing the CSV only on a miss.
+        Raises FileNotFoundError if the file no longer exists.
+        """
+        stat = os.stat(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == stat.st_mtime and entry[1] == stat.st_size:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry[3]
+            self.misses += 1
+
+        # Parse outside the lock so one large file does not block other readers.
+        # pandas is imported on the first parse rather than at app startup.
+        import pandas as pd
+        with metrics.STAGE_LATENCY.time(stage='csv_parse'):
+            df = pd.read_csv(path)
+        nbytes = int(df.memory_usage(deep=True).sum())
+
+        with self._lock:
+            self._discard(path)
+            # Frames larger than the whole budget are served but never retained
+            if nbytes <= self.max_bytes:
+                self._entries[path] = (stat.st_mtime, stat.st_size, nbytes, df)
+                self._total_bytes += nbytes
+                while self._total_bytes > self.max_bytes:
+                    oldest = next(iter(self._entries))
+                    self._discard(oldest)
+                    self.evictions += 1
+        return df
+
+    def invalidate(self, path):
+        """Drop the cached frame for `path`, if any (e.g. after the file is deleted)."""
+        with self._lock:
+            self._discard(path)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def stats(self):
+        """Return a snapshot of the hit/miss counters and current memory usage."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+    def _discard(self, path):
+        # Caller must hold self._lock
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self._total_bytes -= entry[2]
@@ -0,0 +1,248 @@
+import logging
+import os
+import smtplib
+import sqlite3
+import threading
+import time
+
+import metrics
+from utils import backoff_delay, thread_connection
+
+
+class GmailBackend:
+    """Sends through the Gmail API using the cached client in gmail_service."""
+
+    def send(self, recipient, raw_message):
+        # Imported on first send so the web process does not load the Google API stack up front
+        import gmail_service
+        return gmail_service.send_raw_message(raw_message)
+
+
+class SMTPBackend:
+    """
+    Sends over plain SMTP. Pointed at a local debugging server (for example
+    `python -m aiosmtpd -n -l localhost:1025`) it stands in for Gmail in testing.
+    """
+
+    def __init__(self, host, port, sender):
+        self.host = host
+        self.port = port
+        self.sender = sender
+
+    def send(self, recipient, raw_message):
+        with smtplib.SMTP(self.host, self.port, timeout=30) as smtp:
+            smtp.sendmail(self.sender, [recipient], raw_message)
+        return None
+
+
+class ConsoleBackend:
+    """Logs messages instead of sending them; for development without credentials."""
+
+    def send(self, recipient, raw_message):
+        print(f"[email] To: {recipient} ({len(raw_message)} bytes), not sent (console backend)")
+        return None
+
+
+def make_backend(name, smtp_host=None, smtp_port=None, sender=None):
+    """Returns the delivery backend named by Config.EMAIL_BACKEND."""
+    if name == 'gmail':
+        return GmailBackend()
+    if name == 'smtp':
+        return SMTPBackend(smtp_host, smtp_port, sender)
+    if name == 'console':
+        return ConsoleBackend()
+    raise ValueError(f"Unknown email backend '{name}'. Use 'gmail', 'smtp' or 'console'.")
+
+
+class EmailQueue:
+    """
+    Persistent (SQLite) outbox drained by a background sender thread.
+
+    Requests only enqueue a fully built message and return. Failed sends are
+    retried with exponential backoff and jitter, up to `max_attempts`, and
+    queued mail survives restarts. Several worker processes can share one
+    outbox; each message is claimed atomically by exactly one sender.
+
+    Delivery is at least once: a sender that dies between a successful send
+    and recording it leaves the message claimed, and it is sent again once
+    the claim goes stale.
+    """
+
+    # Messages left in 'sending' this long (the sender died mid-send) are retried
+    STALE_CLAIM_SECONDS = 600
+    # Wait between attempts to record a delivered message while the outbox is unavailable
+    RECORD_RETRY_SECONDS = 5
+    RETENTION_SECONDS = 7 * 24 * 3600
+
+    def __init__(self, db_path, backend, max_attempts, retry_base_seconds, retry_max_seconds):
+        self.db_path = db_path
+        self.backend = backend
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._started = False
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    recipient TEXT NOT NULL,
+                    subject TEXT NOT NULL,
+                    message BLOB NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    claimed_at REAL,
+                    last_error TEXT,
+                    provider_id TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(status, next_attempt_at)")
+
+    def _connect(self):
+        return thread_connection(self._local, self.db_path)
+
+    def enqueue(self, recipient, subject, raw_message):
+        """Queues a built message (bytes) for delivery and returns its outbox id."""
+        self.start()
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("DELETE FROM outbox WHERE status IN ('sent', 'failed') AND updated_at < ?",
+                         (now - self.RETENTION_SECONDS,))
+            cursor = conn.execute(
+                "INSERT INTO outbox (recipient, subject, message, status, next_attempt_at, created_at, updated_at) "
+                "VALUES (?, ?, ?, 'pending', ?, ?, ?)",
+                (recipient, subject, raw_message, now, now, now)
+            )
+        self._wakeup.set()
+        return cursor.lastrowid
+
+    def get(self, email_id):
+        """Returns the delivery status of one queued message, or None if unknown."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT id, recipient, status, attempts, last_error, created_at, updated_at FROM outbox WHERE id = ?",
+                (email_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "email_id": row[0],
+            "recipient": row[1],
+            "status": row[2],
+            "attempts": row[3],
+            "last_error": row[4],
+            "created_at": row[5],
+            "updated_at": row[6],
+        }
+
+    def depth(self):
+        """Number of messages waiting to be sent (including ones awaiting a retry)."""
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM outbox WHERE status IN ('pending', 'sending')").fetchone()[0]
+
+    def start(self):
+        """
+        Starts the sender thread if it is not running. Called at server start, so
+        mail queued before a restart goes out, and on every enqueue. Not started
+        at import, so forked server processes each get their own live thread.
+        """
+        with self._lock:
+            if self._started:
+                return
+            threading.Thread(target=self._work, name='email-sender', daemon=True).start()
+            self._started = True
+
+    def _claim(self):
+        """Atomically marks the next due message as 'sending' and returns it, or None."""
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("""
+                SELECT id, recipient, message, attempts, status, claimed_at FROM outbox
+                WHERE (status = 'pending' AND next_attempt_at <= ?)
+                   OR (status = 'sending' AND claimed_at < ?)
+                ORDER BY next_attempt_at LIMIT 1
+            """, (now, now - self.STALE_CLAIM_SECONDS)).fetchone()
+            if row is None:
+                return None
+            # Only succeeds if no other sender claimed the message since we read it
+            # (UPDATE ... RETURNING would need SQLite 3.35)
+            cursor = conn.execute(
+                "UPDATE outbox SET status = 'sending', claimed_at = ?, updated_at = ? "
+                "WHERE id = ? AND status = ? AND claimed_at IS ?",
+                (now, now, row[0], row[4], row[5])
+            )
+        return row[:4] if cursor.rowcount == 1 else None
+
+    def _seconds_until_due(self):
+        with self._connect() as conn:
+            row = conn.execute("SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pending'").fetchone()
+        if row[0] is None:
+            return None
+        return max(0.0, row[0] - time.time())
+
+    def _work(self):
+        while True:
+            try:
+                self._send_next()
+            except Exception:
+                # The outbox is unavailable (or a bug); keep the sender alive and try again later
+                logging.error("Email sender failed, retrying in 30 seconds", exc_info=True)
+                self._wakeup.wait(30)
+                self._wakeup.clear()
+
+    def _send_next(self):
+        claimed = self._claim()
+        if claimed is None:
+            # Sleep until the next retry is due, or until a new message is queued.
+            # The timeout also picks up mail queued by other processes.
+            timeout = self._seconds_until_due()
+            self._wakeup.wait(min(timeout, 60) if timeout is not None else 60)
+            self._wakeup.clear()
+            return
+
+        email_id, recipient, raw_message, attempts = claimed
+        attempts += 1
+        try:
+            provider_id = self.backend.send(recipient, raw_message)
+        except Exception as e:
+            self._record_failure(email_id, attempts, e)
+        else:
+            self._record_sent(email_id, attempts, provider_id)
+
+    def _record_sent(self, email_id, attempts, provider_id):
+        # The message is out, so keep trying to record it: giving up would leave the
+        # claim to go stale and the message to be sent again
+        while True:
+            try:
+                with self._connect() as conn:
+                    conn.execute(
+                        "UPDATE outbox SET status = 'sent', attempts = ?, provider_id = ?, last_error = NULL, updated_at = ? WHERE id = ?",
+                        (attempts, provider_id, time.time(), email_id)
+                    )
+                break
+            except sqlite3.Error:
+                logging.error(f"Could not record email {email_id} as sent, retrying", exc_info=True)
+                time.sleep(self.RECORD_RETRY_SECONDS)
+        metrics.EMAILS.inc(outcome='sent')
+
+    def _record_failure(self, email_id, attempts, error):
+        now = time.time()
+        if attempts >= self.max_attempts:
+            logging.error(f"Email {email_id} failed permanently after {attempts} attempts: {error}")
+            status, next_attempt_at, outcome = 'failed', now, 'failed'
+        else:
+            logging.warning(f"Email {email_id} attempt {attempts} failed, will retry: {error}")
+            delay = backoff_delay(attempts, self.retry_base_seconds, self.retry_max_seconds)
+            status, next_attempt_at, outcome = 'pending', now + delay, 'retry'
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?, updated_at = ? WHERE id = ?",
+                (status, attempts, next_attempt_at, str(error)[:500], now, email_id)
+            )
+        metrics.EMAILS.inc(outcome=outcome)
@@ -1,90 +1,185 @@
-import os
 import pickle
+import threading
 from pathlib import Path
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.application import MIMEApplication
 import base64
 from typing import Optional
-from datetime import datetime
+from datetime import datetime, timedelta
 
 # Constants
 SCOPES = ['https://www.googleapis.com/auth/gmail.send']
 TOKEN_FILE = 'credentials/token.pickle'
 CREDENTIALS_FILE = 'credentials/client_secret.json'
 
-def get_gmail_service():
-    """Authenticate and return Gmail service instance."""
+# Refresh the access token this long before it expires, so no send has to wait on a refresh
+# that races the expiry
+REFRESH_MARGIN = timedelta(minutes=5)
+
+# Process-wide credentials and Gmail client, built once and reused by every send.
+# The client's HTTP transport is not thread-safe, so all use goes through _lock.
+# The Google API libraries are imported on first send, so building messages (and
+# importing this module) does not load them.
+_creds = None
+_service = None
+_lock = threading.RLock()
+
+def _save_credentials(creds):
+    with open(TOKEN_FILE, 'wb') as token:
+        pickle.dump(creds, token)
+
+class GmailNotAuthorizedError(Exception):
+    """Raised when there is no usable saved token; run `python gmail_service.py` to create one."""
+
+def _load_credentials():
+    """
+    Loads the saved token, refreshing it if it has expired. Never starts the
+    interactive OAuth flow, which needs a browser and a free port and would hang
+    the background sender; that is authorize(), run once from the command line.
+    """
+    from google.auth.transport.requests import Request
+
     creds = None
-    
+
     # Load existing token if available
     if Path(TOKEN_FILE).exists():
         with open(TOKEN_FILE, 'rb') as token:
             creds = pickle.load(token)
 
-    # If no valid credentials, authenticate
     if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
+        if not (creds and creds.expired and creds.refresh_token):
+            raise GmailNotAuthorizedError(
+                f"No usable Gmail token at {TOKEN_FILE}. Run `python gmail_service.py` to authorize sending.")
+        creds.refresh(Request())
+        _save_credentials(creds)
+
+    return creds
+
+def authorize():
+    """Runs the interactive OAuth flow in a browser and saves the token used for sending."""
+    from google_auth_oauthlib.flow import InstalledAppFlow
+
+    flow = InstalledAppFlow.from_client_secrets_file(
+        CREDENTIALS_FILE, SCOPES,
+        redirect_uri='http://localhost:5000')
+    creds = flow.run_local_server(
+        port=5000,
+        authorization_prompt_message='Please visit this URL to authorize the application: {url}',
+        success_message='The authentication flow has completed. You may close this window.',
+        open_browser=True)
+    _save_credentials(creds)
+    reset_gmail_service()
+    return creds
+
+def _refresh_if_expiring(creds):
+    """
+    Refreshes the access token if it has expired or will within REFRESH_MARGIN.
+    A token without a known expiry is only refreshed if there is none yet; otherwise
+    it is used until the API rejects it, and the client's transport refreshes it on
+    that 401.
+    """
+    if creds.expiry is None:
+        if creds.token:
+            return
+    # google-auth keeps expiry as a naive UTC datetime
+    elif creds.expiry - datetime.utcnow() > REFRESH_MARGIN:
+        return
+    if creds.refresh_token:
+        from google.auth.transport.requests import Request
+        creds.refresh(Request())
+        _save_credentials(creds)
+
+def get_gmail_service():
+    """
+    Return the process-wide Gmail service instance, authenticating on first use.
+    The token is refreshed ahead of expiry; the client is reused, since it holds
+    the same credentials object and picks up the refreshed token.
+    """
+    global _creds, _service
+    with _lock:
+        if _service is None:
+            from googleapiclient.discovery import build
+            _creds = _load_credentials()
+            _service = build('gmail', 'v1', credentials=_creds, cache_discovery=False)
         else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                CREDENTIALS_FILE, SCOPES,
-                redirect_uri='http://localhost:5000')
-            creds = flow.run_local_server(
-                port=5000,
-                authorization_prompt_message='Please visit this URL to authorize the application: {url}',
-                success_message='The authentication flow has completed. You may close this window.',
-                open_browser=True)
-        
-        # Save the credentials for next run
-        with open(TOKEN_FILE, 'wb') as token:
-            pickle.dump(creds, token)
-
-    return build('gmail', 'v1', credentials=creds)
+            _refresh_if_expiring(_creds)
+        return _service
+
+def reset_gmail_service():
+    """Drops the cached client and credentials, e.g. after the token file was replaced."""
+    global _creds, _service
+    with _lock:
+        _creds = None
+        _service = None
+
+def build_message(recipient: str, subject: str, body: str, pdf: Optional[str] = None,
+                  html: Optional[str] = None) -> MIMEMultipart:
+    """Build the MIME message for an email.
+
+    Args:
+        body: Plain-text body
+        pdf: Optional base64 encoded PDF attachment
+        html: Optional HTML version of the body; mail clients show it in place of the text
+    """
+    # Create message container
+    message = MIMEMultipart()
+    message['to'] = recipient
+    message['subject'] = subject
+
+    # Add body text, with the HTML rendering as an alternative when given
+    if html:
+        alternative = MIMEMultipart('alternative')
+        alternative.attach(MIMEText(body, 'plain', 'utf-8'))
+        alternative.attach(MIMEText(html, 'html', 'utf-8'))
+        message.attach(alternative)
+    else:
+        message.attach(MIMEText(body))
+
+    # Add PDF attachment if provided
+    if pdf:
+        pdf_data = base64.b64decode(pdf)
+        part = MIMEApplication(pdf_data, Name='analysis_report.pdf')
+        part['Content-Disposition'] = f'attachment; filename="Analysis_Report_{datetime.now().strftime("%Y%m%d_%H%M")}.pdf"'
+        message.attach(part)
+
+    return message
+
+def send_raw_message(raw_message: bytes) -> Optional[str]:
+    """Send an already built RFC 822 message through the Gmail API.
+
+    Returns:
+        The Gmail message ID. Raises on failure so callers can retry.
+    """
+    raw = base64.urlsafe_b64encode(raw_message).decode()
+    with _lock:
+        service = get_gmail_service()
+        result = service.users().messages().send(
+            userId='me',
+            body={'raw': raw}
+        ).execute()
+    return result.get('id')
 
 def send_email(recipient: str, subject: str, body: str, pdf: Optional[str] = None) -> Optional[str]:
     """Send an email using Gmail API with optional PDF attachment.
-    
+
     Args:
         recipient: Email address of recipient
         subject: Email subject
         body: Email body content
         pdf: Optional base64 encoded PDF content
-        
+
     Returns:
         Message ID if successful, None otherwise
     """
     try:
-        service = get_gmail_service()
-        
-        # Create message container
-        message = MIMEMultipart()
-        message['to'] = recipient
-        message['subject'] = subject
-        
-        # Add body text
-        message.attach(MIMEText(body))
-        
-        # Add PDF attachment if provided
-        if pdf:
-            pdf_data = base64.b64decode(pdf)
-            part = MIMEApplication(pdf_data, Name='analysis_report.pdf')
-            part['Content-Disposition'] = f'attachment; filename="Analysis_Report_{datetime.now().strftime("%Y%m%d_%H%M")}.pdf"'
-            message.attach(part)
-        
-        # Encode and send
-        raw = base64.urlsafe_b64encode(message.as_bytes()).decode()
-        result = service.users().messages().send(
-            userId='me',
-            body={'raw': raw}
-        ).execute()
-        
-        return result.get('id')
-        
+        message = build_message(recipient, subject, body, pdf)
+        return send_raw_message(message.as_bytes())
+
     except Exception as e:
         print(f"Error sending email: {str(e)}")
         return None
+
+if __name__ == '__main__':
+    authorize()
+    print(f"Saved the Gmail token to {TOKEN_FILE}.")
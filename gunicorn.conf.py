@@ -0,0 +1,46 @@
+"""
+gunicorn settings for production. Run from the project directory:
+
+    gunicorn -c gunicorn.conf.py
+
+The app and its heavy dependencies are imported once in the master process
+(preload_app), so workers share those pages copy-on-write and a restarted worker
+is serving again immediately. Background tasks start in each worker after the
+fork, because threads do not survive fork(); the scheduler then elects one
+process to run maintenance. Use serve.py (waitress) where gunicorn is unavailable.
+"""
+import importlib
+import os
+
+from config import Config
+
+wsgi_app = 'app:create_app()'
+bind = os.getenv('BIND', f"{Config.FLASK_HOST}:{Config.FLASK_PORT}")
+
+# Threaded workers: a request spends almost all of its time waiting on the model API
+worker_class = 'gthread'
+workers = Config.SERVER_WORKERS
+threads = Config.SERVER_THREADS
+
+# gthread workers heartbeat from their main loop, so a long streamed analysis does not
+# trip this; only a worker that stops responding altogether is restarted
+timeout = Config.SERVER_TIMEOUT_SECONDS
+graceful_timeout = 30
+keepalive = 5
+
+preload_app = True
+
+# Imported in the master even though the app defers them. With preload_app the app is
+# loaded in Arbiter.setup, before on_starting runs, but both happen before any worker
+# is forked, so workers share these modules copy-on-write.
+PRELOAD_MODULES = ('pandas', 'pyarrow', 'google.generativeai', 'googleapiclient.discovery')
+
+
+def on_starting(server):
+    for name in PRELOAD_MODULES:
+        importlib.import_module(name)
+
+
+def post_fork(server, worker):
+    import app
+    app.start_background_tasks()
@@ -0,0 +1,151 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+
+from utils import thread_connection
+
+
+class QueueFullError(Exception):
+    """Raised when a job cannot be enqueued because the queue is at capacity."""
+
+
+class Job:
+    """A unit of background work waiting in, or taken from, this process's queue."""
+
+    def __init__(self, job_type, func):
+        self.id = uuid.uuid4().hex
+        self.type = job_type
+        self.func = func
+        self.status = 'queued'
+        self.created_at = time.time()
+
+
+class JobQueue:
+    """
+    In-process job queue drained by a fixed pool of daemon worker threads, with
+    job status kept in SQLite so any worker process can answer a poll.
+
+    Web requests only enqueue work and return a job id, so they never wait on
+    model latency. Jobs run in the process that accepted them. Finished jobs
+    are kept for `retention_seconds` so clients can poll for the result, then
+    discarded.
+    """
+
+    # Jobs still queued or running this long were lost with their process (e.g. a
+    # restarted worker) and are discarded
+    ABANDONED_SECONDS = 24 * 3600
+
+    def __init__(self, db_path, num_workers, max_queued, retention_seconds):
+        self.db_path = db_path
+        self.num_workers = num_workers
+        self.retention_seconds = retention_seconds
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._started = False
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    type TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_created_at ON jobs(created_at)")
+
+    def _connect(self):
+        return thread_connection(self._local, self.db_path)
+
+    def submit(self, job_type, func):
+        """
+        Enqueues `func` (a zero-argument callable whose return value is the job
+        result, JSON-serializable) and returns the new Job. Raises QueueFullError
+        when at capacity.
+        """
+        self._ensure_workers()
+        job = Job(job_type, func)
+        with self._connect() as conn:
+            self._prune(conn)
+            conn.execute("INSERT INTO jobs (id, type, status, created_at) VALUES (?, ?, ?, ?)",
+                         (job.id, job.type, job.status, job.created_at))
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM jobs WHERE id = ?", (job.id,))
+            raise QueueFullError("The job queue is full. Please retry shortly.")
+        return job
+
+    def get(self, job_id):
+        """Returns the job's status dict (with "result" or "error" once finished), or None."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT id, type, status, result, error, created_at, started_at, finished_at FROM jobs WHERE id = ?",
+                (job_id,)).fetchone()
+        if row is None:
+            return None
+        data = {
+            "job_id": row[0],
+            "type": row[1],
+            "status": row[2],
+            "created_at": row[5],
+            "started_at": row[6],
+            "finished_at": row[7],
+        }
+        if row[2] == 'completed':
+            data["result"] = json.loads(row[3])
+        elif row[2] == 'failed':
+            data["error"] = row[4]
+        return data
+
+    def _ensure_workers(self):
+        # Workers start on first use rather than at import, so forked server
+        # processes each get their own live threads
+        with self._lock:
+            if self._started:
+                return
+            for i in range(self.num_workers):
+                threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True).start()
+            self._started = True
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._run(job)
+            except Exception:
+                # Only the status updates can get here; keep the worker alive
+                logging.error(f"Could not record the status of background job {job.id}", exc_info=True)
+            finally:
+                job.func = None  # Release captured row data once the job has run
+                self._queue.task_done()
+
+    def _run(self, job):
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?", (time.time(), job.id))
+        result, error = None, None
+        try:
+            result = json.dumps(job.func())
+            status = 'completed'
+        except Exception:
+            logging.error(f"Background job {job.id} ({job.type}) failed", exc_info=True)
+            error = "An internal server error occurred while processing the job."
+            status = 'failed'
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+                         (status, result, error, time.time(), job.id))
+
+    def _prune(self, conn):
+        now = time.time()
+        conn.execute("DELETE FROM jobs WHERE finished_at < ? OR (finished_at IS NULL AND created_at < ?)",
+                     (now - self.retention_seconds, now - self.ABANDONED_SECONDS))
@@ -0,0 +1,273 @@
+"""
+Minimal in-process metrics with Prometheus text exposition.
+
+Updates are a dict lookup and an addition under a lock, cheap enough to leave
+on in production. Values are per process: under a multi-worker server each
+worker exposes its own series, which Prometheus aggregates at query time.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets (seconds) spanning fast cache hits to slow model calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            for labelvalues, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        """Increments the gauge for the duration of the `with` block."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (non-cumulative) counts, then sum and count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the wall-clock duration of the `with` block, in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            for labelvalues, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(self.labelnames, labelvalues, [('le', _format_value(float(bound)))])
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, labelvalues)
+                lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class _CallbackMetric:
+    """A single unlabelled value read from a callback at scrape time."""
+
+    def __init__(self, name, documentation, metric_type, func):
+        self.name = name
+        self.documentation = documentation
+        self.type = metric_type
+        self.func = func
+
+    def render(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}",
+                f"{self.name} {_format_value(self.func())}"]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name, documentation, metric_type, func):
+        """Registers a value computed at scrape time, e.g. counters kept by another component."""
+        return self.register(_CallbackMetric(name, documentation, metric_type, func))
+
+    def render(self):
+        """Returns all metrics in the Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# --- Application metrics ---
+
+REQUEST_LATENCY = REGISTRY.histogram(
+    'aiprio_http_request_duration_seconds',
+    'Time from request start until the response is returned (headers, for streaming routes), by route.',
+    ('route', 'method', 'status'))
+FUNCTION_LATENCY = REGISTRY.histogram(
+    'aiprio_function_duration_seconds',
+    'Execution time of functions wrapped with timing_decorator.',
+    ('function',))
+STAGE_LATENCY = REGISTRY.histogram(
+    'aiprio_stage_duration_seconds',
+    'Time spent in internal stages: csv_parse, upload_ingest, row_read, prompt_build, generate_content, score_parse, report_render.',
+    ('stage',))
+LLM_IN_FLIGHT = REGISTRY.gauge(
+    'aiprio_llm_calls_in_flight',
+    'Model generate_content calls currently in progress.',
+    ('kind',))
+LLM_CALLS = REGISTRY.counter(
+    'aiprio_llm_calls_total',
+    'Model generate_content calls by kind and outcome.',
+    ('kind', 'outcome'))
+MODEL_FAILOVERS = REGISTRY.counter(
+    'aiprio_llm_failovers_total',
+    "Model calls retried on the profile's fallback model, by reason (timeout, quota, unavailable, circuit_open, rate_limited).",
+    ('profile', 'reason'))
+LLM_RETRIES = REGISTRY.counter(
+    'aiprio_llm_retries_total',
+    'Model call attempts retried on the same model after a transient upstream error.',
+    ('reason',))
+LLM_HEDGES = REGISTRY.counter(
+    'aiprio_llm_hedged_requests_total',
+    'Duplicate model requests sent because the first was slower than the recent p95.')
+LLM_CIRCUIT_REJECTIONS = REGISTRY.counter(
+    'aiprio_llm_circuit_rejections_total',
+    "Model calls rejected without a request because the model's circuit breaker was open.",
+    ('model',))
+LLM_QUEUE_WAIT = REGISTRY.histogram(
+    'aiprio_llm_queue_wait_seconds',
+    'Time model calls waited for request and token budget under the shared rate limit, by priority.',
+    ('priority',))
+LLM_RATE_LIMITED = REGISTRY.counter(
+    'aiprio_llm_rate_limited_total',
+    'Model calls refused locally because the rate limit would not allow them before their deadline, by priority.',
+    ('priority',))
+LLM_TOKENS = REGISTRY.histogram(
+    'aiprio_llm_tokens',
+    'Tokens per model call by kind and direction (input or output), from usage_metadata when available, else estimated.',
+    ('kind', 'direction'),
+    buckets=(64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768))
+LLM_TRUNCATED = REGISTRY.counter(
+    'aiprio_llm_truncated_total',
+    'Model responses cut off at max_output_tokens (finish reason MAX_TOKENS), by kind.',
+    ('kind',))
+PROMPT_FIELDS_TRUNCATED = REGISTRY.counter(
+    'aiprio_prompt_fields_truncated_total',
+    'Prioritization prompt fields cut to their token budget.')
+ANALYSIS_CACHE_REQUESTS = REGISTRY.counter(
+    'aiprio_analysis_cache_requests_total',
+    'Analysis store lookups by result (hit or miss).',
+    ('result',))
+CHAT_CACHE_REQUESTS = REGISTRY.counter(
+    'aiprio_chat_cache_requests_total',
+    'Chat answer cache lookups by result (hit or miss).',
+    ('result',))
+ANALYSIS_FORMAT_ERRORS = REGISTRY.counter(
+    'aiprio_analysis_format_errors_total',
+    'Prioritization responses whose ratings could not all be read, by output format (markdown or json).',
+    ('format',))
+ANALYSIS_COALESCED = REGISTRY.counter(
+    'aiprio_analysis_coalesced_total',
+    'Prioritization requests that waited on an identical in-flight model call instead of making their own.')
+UPLOAD_SIZE_BYTES = REGISTRY.histogram(
+    'aiprio_upload_size_bytes',
+    'Size of uploaded CSV files in bytes.',
+    buckets=(10_000, 100_000, 1_000_000, 5_000_000, 20_000_000, 100_000_000))
+UPLOAD_ROWS = REGISTRY.histogram(
+    'aiprio_upload_rows',
+    'Number of data rows in uploaded CSV files.',
+    buckets=(10, 100, 1_000, 5_000, 20_000, 100_000))
+UPLOADS_DELETED = REGISTRY.counter(
+    'aiprio_uploads_deleted_total',
+    'Upload files deleted, by reason (expired, released, session_quota, global_quota, storage_pressure).',
+    ('reason',))
+EMAILS = REGISTRY.counter(
+    'aiprio_emails_total',
+    'Outbound email delivery attempts by outcome (sent, retry or failed).',
+    ('outcome',))
+BACKGROUND_TASK_LATENCY = REGISTRY.histogram(
+    'aiprio_background_task_duration_seconds',
+    'Duration of background maintenance tasks.',
+    ('task',),
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0, 120.0, 600.0))
@@ -0,0 +1,106 @@
+import functools
+import threading
+
+import metrics
+from rate_limiter import RateLimitedError
+from resilience import CircuitOpenError, Deadline, upstream_failure_reason
+
+
+def failover_reason(error):
+    """
+    Returns why `error` should be retried on a fallback model ('timeout', 'quota',
+    'unavailable', 'circuit_open' or 'rate_limited'), or None if it should not.
+    """
+    if isinstance(error, CircuitOpenError):
+        return 'circuit_open'
+    if isinstance(error, RateLimitedError):
+        return 'rate_limited'
+    return upstream_failure_reason(error)
+
+
+class ModelRouter:
+    """
+    Model instances per profile (Config.MODEL_PROFILES), built once per
+    (profile, model name) and reused, with failover from a profile's primary
+    model to its fallback model.
+
+    Each model is called through `caller` (a resilience.ResilientCaller), which
+    applies the attempt timeout, retries, hedging and the model's circuit breaker,
+    and every request first takes its budget from `limiter` (a
+    rate_limiter.RateLimiter). A call that fails on the primary because it timed
+    out, ran out of quota, was unavailable, has its circuit open or is over the
+    rate limit is retried on the fallback, within the profile's overall deadline.
+    Other errors (e.g. an invalid request) are raised as is.
+    """
+
+    def __init__(self, profiles, build, caller, limiter):
+        self.profiles = profiles
+        self.build = build  # build(profile_name, model_name) -> model
+        self.caller = caller
+        self.limiter = limiter
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def model(self, profile_name, model_name=None):
+        """Returns the cached model for `profile_name` (its primary model unless `model_name` is given)."""
+        model_name = model_name or self.profiles[profile_name]['model']
+        key = (profile_name, model_name)
+        with self._lock:
+            model = self._models.get(key)
+            if model is None:
+                print(f"Initializing AI model instance for profile '{profile_name}' ({model_name})")
+                model = self._models[key] = self.build(profile_name, model_name)
+        return model
+
+    def model_names(self, profile_name):
+        """Model names to try for a call, in order: the primary, then the fallback."""
+        profile = self.profiles[profile_name]
+        names = [profile['model']]
+        if profile.get('fallback_model') and profile['fallback_model'] != profile['model']:
+            names.append(profile['fallback_model'])
+        return names
+
+    def call(self, profile_name, func, hedge=True, tokens=0, priority='interactive', spent_tokens=None):
+        """
+        Runs `func(model, timeout_seconds)` on the profile's models in order until one
+        succeeds, within the profile's deadline_seconds. Returns (result, model_name).
+        Set `hedge` to False for calls that must not be duplicated (e.g. streams).
+
+        Each request is charged `tokens` (estimated) at `priority` against the rate
+        limit. The caller settles the charge of the returned result; requests that
+        were never sent are refunded, and the others (failed, timed out or beaten by
+        a hedge) are settled with `spent_tokens(result)`, where result is None for a
+        failed request.
+        """
+        profile = self.profiles[profile_name]
+        deadline = Deadline(profile['deadline_seconds'])
+        names = self.model_names(profile_name)
+
+        def release(model_name, sent, result):
+            if not sent:
+                self.limiter.refund(model_name, tokens)
+            elif spent_tokens is not None:
+                self.limiter.settle(model_name, tokens, spent_tokens(result))
+
+        for i, model_name in enumerate(names):
+            model = self.model(profile_name, model_name)
+            try:
+                result = self.caller.call(model_name, (profile_name, model_name),
+                                          lambda timeout, model=model: func(model, timeout),
+                                          profile['timeout_seconds'], deadline, hedge=hedge,
+                                          admit=lambda wait, model_name=model_name: self.limiter.acquire(
+                                              model_name, tokens, priority, timeout=wait),
+                                          release=functools.partial(release, model_name))
+                return result, model_name
+            except Exception as e:
+                reason = failover_reason(e)
+                if reason is None or i == len(names) - 1 or deadline.remaining() <= 0:
+                    raise
+                print(f"Model {model_name} failed for profile '{profile_name}' ({reason}); "
+                      f"falling back to {names[i + 1]}")
+                metrics.MODEL_FAILOVERS.inc(profile=profile_name, reason=reason)
+
+    def clear(self):
+        """Drops the cached model instances."""
+        with self._lock:
+            self._models.clear()
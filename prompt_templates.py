@@ -0,0 +1,16 @@
+import functools
+import os
+
+PROMPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prompts')
+
+
+@functools.lru_cache(maxsize=None)
+def load_prompt(name, version):
+    """
+    Returns the text of prompts/<name>_v<version>.txt, read from disk once per process.
+    Templates are never edited in place: a changed template gets a new version,
+    so the version alone identifies the prompt in cache keys.
+    """
+    path = os.path.join(PROMPTS_DIR, f"{name}_v{version}.txt")
+    with open(path, encoding='utf-8') as f:
+        return f.read()
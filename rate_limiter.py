@@ -0,0 +1,181 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+
+import metrics
+from utils import thread_connection
+
+# Lower runs first. Interactive calls come from /prioritize, /chat and /jobs; batch
+# calls from /prioritize_all.
+PRIORITIES = {'interactive': 0, 'batch': 1}
+
+
+class RateLimitedError(Exception):
+    """Raised when a model's request or token budget would not allow a call in time."""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"Rate limit for model {name} reached; retry in {retry_after:.0f} s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """
+    Token buckets for requests and tokens per minute, per model, shared by every
+    worker process through SQLite so they draw on one quota, as the API does.
+
+    A call takes one request and its estimated tokens (prompt plus the most the
+    model may write) up front; `settle` corrects the token bucket once the actual
+    usage is known. Buckets hold at most one minute of budget and refill
+    continuously.
+
+    Waiting callers queue by priority in each process, and only the head of a
+    model's queue draws from its buckets, so an interactive call goes ahead of any
+    batch call waiting in the same process. Across processes, batch calls leave
+    `interactive_reserve` of each bucket to interactive ones.
+    """
+
+    # How often the head of the queue re-reads the shared buckets while waiting, since
+    # other processes may refund tokens in the meantime
+    POLL_SECONDS = 0.25
+
+    def __init__(self, db_path, requests_per_minute, tokens_per_minute, interactive_reserve):
+        self.db_path = db_path
+        self.limits = {'requests': requests_per_minute, 'tokens': tokens_per_minute}
+        self.interactive_reserve = interactive_reserve
+        self._local = threading.local()
+        self._queues = {}  # model name -> heap of (priority, seq)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS buckets (
+                    name TEXT NOT NULL,
+                    resource TEXT NOT NULL,
+                    level REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (name, resource)
+                )
+            """)
+
+    @property
+    def enabled(self):
+        return any(limit > 0 for limit in self.limits.values())
+
+    def _connect(self):
+        return thread_connection(self._local, self.db_path, isolation_level=None)
+
+    def _level(self, conn, name, resource, per_minute, now):
+        row = conn.execute("SELECT level, updated_at FROM buckets WHERE name = ? AND resource = ?",
+                           (name, resource)).fetchone()
+        if row is None:
+            return per_minute
+        return min(per_minute, row[0] + (now - row[1]) * per_minute / 60.0)
+
+    def _try_take(self, name, tokens, priority):
+        """
+        Takes one request and `tokens` from the model's buckets if both hold enough.
+        Returns 0 on success, or the seconds until they would.
+        """
+        amounts = {'requests': 1, 'tokens': tokens}
+        now = time.time()
+        conn = self._connect()
+        # BEGIN IMMEDIATE takes the write lock up front, so no other process reads the
+        # same level between our read and our update
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            levels, wait = {}, 0.0
+            for resource, per_minute in self.limits.items():
+                if per_minute <= 0:
+                    continue
+                level = self._level(conn, name, resource, per_minute, now)
+                reserve = self.interactive_reserve * per_minute if priority == 'batch' else 0.0
+                # A call bigger than the bucket may still run once the bucket is full
+                amount = min(amounts[resource], per_minute - reserve)
+                levels[resource] = level - amount
+                if level - reserve < amount:
+                    wait = max(wait, (amount + reserve - level) * 60.0 / per_minute)
+            if wait == 0:
+                conn.executemany("INSERT OR REPLACE INTO buckets (name, resource, level, updated_at) VALUES (?, ?, ?, ?)",
+                                 [(name, resource, level, now) for resource, level in levels.items()])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    def acquire(self, name, tokens, priority='interactive', timeout=0.0):
+        """
+        Waits up to `timeout` seconds, behind higher-priority callers, until model
+        `name` has a request and `tokens` left, and takes them. Raises RateLimitedError
+        when that would take longer.
+        """
+        if not self.enabled:
+            return
+        entry = (PRIORITIES[priority], next(self._seq))
+        started = time.monotonic()
+        give_up_at = started + timeout
+        with self._cond:
+            heapq.heappush(self._queues.setdefault(name, []), entry)
+        try:
+            while True:
+                with self._cond:
+                    while self._queues[name][0] != entry:
+                        remaining = give_up_at - time.monotonic()
+                        if remaining <= 0:
+                            metrics.LLM_RATE_LIMITED.inc(priority=priority)
+                            raise RateLimitedError(name, self.POLL_SECONDS)
+                        self._cond.wait(remaining)
+                wait = self._try_take(name, tokens, priority)
+                if wait == 0:
+                    metrics.LLM_QUEUE_WAIT.observe(time.monotonic() - started, priority=priority)
+                    return
+                if time.monotonic() + wait > give_up_at:
+                    metrics.LLM_RATE_LIMITED.inc(priority=priority)
+                    raise RateLimitedError(name, wait)
+                # Released so a higher-priority caller arriving meanwhile can take the head
+                time.sleep(min(wait, self.POLL_SECONDS))
+        finally:
+            with self._cond:
+                queue = self._queues[name]
+                queue.remove(entry)
+                heapq.heapify(queue)
+                self._cond.notify_all()
+
+    def settle(self, name, estimated_tokens, actual_tokens):
+        """Returns tokens taken for a call but not used, or charges the excess."""
+        if estimated_tokens != actual_tokens:
+            self._give_back(name, {'tokens': estimated_tokens - actual_tokens})
+
+    def refund(self, name, tokens):
+        """Returns the request and `tokens` taken for a call that was never sent."""
+        self._give_back(name, {'requests': 1, 'tokens': tokens})
+
+    def _give_back(self, name, amounts):
+        # Negative amounts charge the bucket instead
+        amounts = {resource: amount for resource, amount in amounts.items() if self.limits[resource] > 0}
+        if not amounts:
+            return
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = []
+            for resource, amount in amounts.items():
+                per_minute = self.limits[resource]
+                level = self._level(conn, name, resource, per_minute, now)
+                rows.append((name, resource, min(per_minute, level + amount), now))
+            conn.executemany("INSERT OR REPLACE INTO buckets (name, resource, level, updated_at) VALUES (?, ?, ?, ?)",
+                             rows)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def waiting(self):
+        """Callers in this process currently waiting for budget."""
+        with self._cond:
+            return sum(len(queue) for queue in self._queues.values())
@@ -0,0 +1,79 @@
+import functools
+import html
+import re
+
+import markdown
+
+# Bump when the report layout changes so cached renders are not reused
+REPORT_TEMPLATE_VERSION = "2"
+
+# Heat map colours from static/style.css, inlined because many mail clients drop <style> blocks
+RATING_STYLES = {
+    "rating-very-high": "background-color:#ff8080;",
+    "rating-high": "background-color:#ffcc80;",
+    "rating-medium": "background-color:#ffffb3;",
+    "rating-low": "background-color:#b3ffb3;",
+    "rating-very-low": "background-color:#cce6ff;",
+}
+# The only markup allowed through from an analysis: its heat map spans, matched after escaping
+_RATING_SPAN = re.compile(
+    r'&lt;span class="(' + "|".join(RATING_STYLES) + r')"&gt;(.*?)&lt;/span&gt;'
+)
+_BADGE_STYLE = "color:#1B263B;padding:2px 6px;border-radius:4px;"
+
+_TABLE_STYLES = (
+    ("<table>", '<table style="border-collapse:collapse;width:100%;font-size:14px;">'),
+    ("<th>", '<th style="border:1px solid #ccd;padding:6px;background:#1B263B;color:#fff;text-align:left;">'),
+    ("<td>", '<td style="border:1px solid #ccd;padding:6px;vertical-align:top;">'),
+)
+
+
+def markdown_to_email_html(markdown_text):
+    """
+    Converts an analysis (markdown with heat map spans) to HTML with inline styles.
+    The analysis is model output, so any HTML in it is escaped; only the known
+    rating spans are turned back into markup.
+    """
+    body = markdown.markdown(html.escape(markdown_text, quote=False), extensions=["tables"])
+    body = _RATING_SPAN.sub(
+        lambda m: f'<span class="{m.group(1)}" style="{RATING_STYLES[m.group(1)]}{_BADGE_STYLE}">{m.group(2)}</span>',
+        body
+    )
+    for tag, styled in _TABLE_STYLES:
+        body = body.replace(tag, styled)
+    return body
+
+
+@functools.lru_cache(maxsize=256)
+def render_report(analysis_id, title, directorate, analysis_text, score, evaluator=None):
+    """
+    Renders the emailed report for one stored analysis. Returns (html_body, text_body).
+    Cached per analysis (its id, text and score) and evaluator, so re-sending the same
+    report costs no rendering.
+    """
+    heading = f"Analysis: {html.escape(str(title))}"
+    details = [f"Directorate: {html.escape(str(directorate))}"]
+    if score is not None:
+        details.append(f"Overall Priority score: {score}%")
+    if evaluator:
+        details.append(f"Evaluator: {html.escape(evaluator)}")
+
+    html_body = f"""<!DOCTYPE html>
+<html>
+<body style="font-family:Arial,Helvetica,sans-serif;color:#1B263B;max-width:900px;">
+<h2>{heading}</h2>
+{"".join(f"<p style='margin:4px 0;'><strong>{line}</strong></p>" for line in details)}
+{markdown_to_email_html(analysis_text)}
+<p style="margin-top:24px;font-size:12px;color:#667;">Generated by AiPrio (report v{REPORT_TEMPLATE_VERSION}, analysis {analysis_id[:12]}).</p>
+</body>
+</html>"""
+
+    # Plain-text alternative: the markdown with the heat map markup stripped
+    plain_analysis = re.sub(r"</?span[^>]*>", "", analysis_text)
+    text_lines = [f"Analysis: {title}", f"Directorate: {directorate}"]
+    if score is not None:
+        text_lines.append(f"Overall Priority score: {score}%")
+    if evaluator:
+        text_lines.append(f"Evaluator: {evaluator}")
+    text_body = "\n".join(text_lines) + "\n\n" + plain_analysis
+    return html_body, text_body
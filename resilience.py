@@ -0,0 +1,305 @@
+import collections
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import metrics
+from utils import backoff_delay
+
+# Upstream failures by google.api_core exception class name, most specific first. Classes
+# are matched by name through the MRO, so the SDK is not imported for this.
+UPSTREAM_FAILURES = (
+    ('GatewayTimeout', 'timeout'),        # includes DeadlineExceeded
+    ('TooManyRequests', 'quota'),         # includes ResourceExhausted
+    ('ServerError', 'unavailable'),       # other 5xx: ServiceUnavailable, InternalServerError, ...
+)
+
+# Reasons worth retrying on the same model. Timeouts and quota errors go to the fallback
+# model instead, since an immediate retry would most likely fail the same way.
+RETRYABLE_REASONS = ('unavailable',)
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling the model while its circuit breaker is open."""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"Model {name} is unavailable (circuit open); retry in {retry_after:.0f} s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class DeadlineExceededError(TimeoutError):
+    """Raised when a model call has not answered within its deadline."""
+
+
+def upstream_failure_reason(error):
+    """
+    Returns 'timeout', 'quota' or 'unavailable' when `error` means the model service
+    is slow or unhealthy, or None when it concerns the request itself.
+    """
+    if isinstance(error, TimeoutError):
+        return 'timeout'
+    names = {cls.__name__ for cls in type(error).__mro__}
+    for name, reason in UPSTREAM_FAILURES:
+        if name in names:
+            return reason
+    return None
+
+
+class Deadline:
+    """A point in time by which a whole call, retries and fallbacks included, must finish."""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+
+class CircuitBreaker:
+    """
+    Closed: calls pass. After `failure_threshold` consecutive upstream failures it
+    opens and rejects calls for `reset_seconds`; then it lets one trial call
+    through (half-open), which closes it on success or re-opens it on failure.
+    """
+
+    def __init__(self, name, failure_threshold, reset_seconds):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = 'closed'
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def is_open(self):
+        """True while calls would be rejected. Does not claim the half-open trial call."""
+        with self._lock:
+            if self.state == 'open':
+                return time.monotonic() - self._opened_at < self.reset_seconds
+            return self.state == 'half_open' and self._trial_in_flight
+
+    def before_call(self):
+        """Raises CircuitOpenError if the call may not proceed."""
+        with self._lock:
+            if self.state == 'open':
+                waited = time.monotonic() - self._opened_at
+                if waited < self.reset_seconds:
+                    metrics.LLM_CIRCUIT_REJECTIONS.inc(model=self.name)
+                    raise CircuitOpenError(self.name, self.reset_seconds - waited)
+                self.state = 'half_open'
+            if self.state == 'half_open':
+                if self._trial_in_flight:
+                    metrics.LLM_CIRCUIT_REJECTIONS.inc(model=self.name)
+                    raise CircuitOpenError(self.name, self.reset_seconds)
+                self._trial_in_flight = True
+
+    def cancel_call(self):
+        """Gives back the half-open trial claimed by before_call, for a call that was not sent."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != 'closed':
+                print(f"Circuit for model {self.name} closed")
+            self.state = 'closed'
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self.state == 'half_open' or self._failures >= self.failure_threshold:
+                if self.state != 'open':
+                    print(f"Circuit for model {self.name} opened after {self._failures} consecutive failures")
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+
+
+class LatencyTracker:
+    """Latencies of recent successful calls, and which calls were hedged, over a sliding window."""
+
+    def __init__(self, window=200):
+        self._latencies = collections.deque(maxlen=window)
+        self._hedged = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds, hedged):
+        with self._lock:
+            self._latencies.append(seconds)
+            self._hedged.append(hedged)
+
+    def percentile(self, pct, min_samples):
+        """The pct-th percentile latency, or None with fewer than `min_samples` samples."""
+        with self._lock:
+            if len(self._latencies) < min_samples:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+    def hedge_ratio(self):
+        with self._lock:
+            return sum(self._hedged) / len(self._hedged) if self._hedged else 0.0
+
+
+class ResilientCaller:
+    """
+    Runs model calls with a deadline, retry with jittered backoff on transient
+    upstream errors, hedging and a circuit breaker per model.
+
+    Each attempt runs on a worker thread so the caller can stop waiting when the
+    deadline passes. An attempt still running after the `hedge_percentile`
+    latency of recent calls gets a duplicate request, and the first answer wins;
+    hedging is limited to `hedge_max_ratio` of calls so a general slowdown does
+    not double the load. An abandoned attempt ends with its own SDK timeout.
+    """
+
+    def __init__(self, max_workers, retry_attempts, retry_base_seconds, retry_max_seconds,
+                 hedge_percentile, hedge_min_samples, hedge_max_ratio,
+                 breaker_failure_threshold, breaker_reset_seconds):
+        self.retry_attempts = retry_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_max_ratio = hedge_max_ratio
+        self.breaker_failure_threshold = breaker_failure_threshold
+        self.breaker_reset_seconds = breaker_reset_seconds
+        # Threads start on first submit, not at import, so forked server processes get their own
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='llm-call')
+        self._breakers = {}
+        self._trackers = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, name):
+        with self._lock:
+            if name not in self._breakers:
+                self._breakers[name] = CircuitBreaker(name, self.breaker_failure_threshold,
+                                                      self.breaker_reset_seconds)
+            return self._breakers[name]
+
+    def tracker(self, key):
+        with self._lock:
+            if key not in self._trackers:
+                self._trackers[key] = LatencyTracker()
+            return self._trackers[key]
+
+    def open_circuits(self):
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return sum(1 for b in breakers if b.is_open())
+
+    def call(self, breaker_name, tracker_key, func, attempt_timeout, deadline, hedge=True, admit=None,
+             release=None):
+        """
+        Calls `func(timeout_seconds)`, where the timeout is what remains of this
+        attempt, and returns its result. Raises CircuitOpenError while the breaker
+        for `breaker_name` is open, DeadlineExceededError when the attempt or the
+        `deadline` runs out, and the last error once retries are exhausted.
+
+        `admit(wait_seconds)`, if given, is called before every request the breaker
+        lets through, hedges included, and raises if the request may not be sent
+        within that wait (e.g. rate_limiter.RateLimitedError). `release(sent, result)`
+        is then called once for each admitted request whose result is not returned:
+        with sent=False if it was never sent, and otherwise when it finishes, with
+        its result, or None if it failed.
+        """
+        breaker = self.breaker(breaker_name)
+        attempt = 0
+        while True:
+            budget = min(attempt_timeout, deadline.remaining())
+            if budget <= 0:
+                raise DeadlineExceededError(f"Model call did not finish within {deadline.seconds:.0f} s")
+            # Checked first, so calls to a model whose circuit is open take no rate-limit budget
+            breaker.before_call()
+            if admit is not None:
+                try:
+                    admit(budget)
+                except Exception:
+                    breaker.cancel_call()
+                    raise
+                budget = min(attempt_timeout, deadline.remaining())
+                if budget <= 0:
+                    breaker.cancel_call()
+                    if release is not None:
+                        release(False, None)
+                    raise DeadlineExceededError(f"Model call did not finish within {deadline.seconds:.0f} s")
+            try:
+                result = self._attempt(tracker_key, func, budget, hedge, admit, release)
+            except Exception as e:
+                reason = upstream_failure_reason(e)
+                if reason is None:
+                    # The service answered; the request itself was refused
+                    breaker.record_success()
+                    raise
+                breaker.record_failure()
+                attempt += 1
+                delay = backoff_delay(attempt, self.retry_base_seconds, self.retry_max_seconds)
+                if reason not in RETRYABLE_REASONS or attempt >= self.retry_attempts or delay >= deadline.remaining():
+                    raise
+                metrics.LLM_RETRIES.inc(reason=reason)
+                time.sleep(delay)
+                continue
+            breaker.record_success()
+            return result
+
+    def _attempt(self, tracker_key, func, budget, hedge, admit, release):
+        tracker = self.tracker(tracker_key)
+        futures = [self._executor.submit(func, budget)]
+        winner = None
+        try:
+            winner = self._wait(tracker, futures, func, budget, hedge, admit)
+            return winner.result()
+        finally:
+            if release is not None:
+                # Requests that failed, timed out or lost to a hedge are settled when they finish
+                for future in futures:
+                    if future is not winner:
+                        future.add_done_callback(
+                            lambda f: release(True, None if f.exception() is not None else f.result()))
+
+    def _wait(self, tracker, futures, func, budget, hedge, admit):
+        """
+        Waits for the first successful request of an attempt, sending a hedge when
+        the first is slow. Returns its future; hedges are appended to `futures`.
+        """
+        started = time.monotonic()
+        expires_at = started + budget
+        hedge_at = None
+        if hedge and tracker.hedge_ratio() < self.hedge_max_ratio:
+            threshold = tracker.percentile(self.hedge_percentile, self.hedge_min_samples)
+            if threshold is not None:
+                hedge_at = started + threshold
+
+        pending = set(futures)
+        hedged = False
+        first_error = None
+        while pending:
+            wake_at = min(hedge_at, expires_at) if hedge_at is not None and not hedged else expires_at
+            done, pending = wait(pending, timeout=max(0.0, wake_at - time.monotonic()), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    tracker.record(time.monotonic() - started, hedged)
+                    return future
+                first_error = first_error or future.exception()
+            if done:
+                continue
+            now = time.monotonic()
+            if now >= expires_at:
+                raise DeadlineExceededError(f"Model did not respond within {budget:.1f} s")
+            if not hedged:
+                hedged = True
+                try:
+                    if admit is not None:
+                        admit(0)
+                except Exception:
+                    # No budget for a duplicate right now; keep waiting on the first request
+                    continue
+                metrics.LLM_HEDGES.inc()
+                futures.append(self._executor.submit(func, max(0.0, expires_at - now)))
+                pending.add(futures[-1])
+        raise first_error
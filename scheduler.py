@@ -0,0 +1,198 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    """
+    Non-blocking exclusive lock on a file, held until release() or process exit.
+    The OS drops the lock when its holder dies, so a crashed leader cannot
+    block the others.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def try_acquire(self):
+        if self._fd is not None:
+            return True
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+
+class ScheduledTask:
+    def __init__(self, name, func, interval_seconds, initial_delay_seconds, jitter_fraction):
+        self.name = name
+        self.func = func
+        self.interval_seconds = interval_seconds
+        self.jitter_fraction = jitter_fraction
+        self.next_run = time.time() + initial_delay_seconds
+        self.last_started_at = None
+        self.last_duration_seconds = None
+        self.last_error = None
+        self.runs = 0
+        self.failures = 0
+
+    def schedule_next(self, now):
+        # Jitter spreads runs so restarts of several servers do not line up their maintenance
+        jitter = self.interval_seconds * self.jitter_fraction * random.uniform(-1, 1)
+        self.next_run = now + self.interval_seconds + jitter
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "interval_seconds": self.interval_seconds,
+            "next_run": self.next_run,
+            "last_started_at": self.last_started_at,
+            "last_duration_seconds": self.last_duration_seconds,
+            "last_error": self.last_error,
+            "runs": self.runs,
+            "failures": self.failures,
+        }
+
+
+class Scheduler:
+    """
+    Runs periodic maintenance tasks on one thread, in exactly one process.
+
+    Every process that starts the scheduler competes for a file lock; the holder
+    is the leader and runs the tasks, the others retry every `leader_retry_seconds`
+    and take over if the leader exits. Tasks can be triggered on demand from any
+    process: the trigger is left as a marker file that the leader picks up.
+    Run history is written to a state file so every process can report it.
+    """
+
+    def __init__(self, lock_path, leader_retry_seconds=30, trigger_poll_seconds=2):
+        self.lock_path = lock_path
+        self.state_path = lock_path + '.state.json'
+        self.trigger_dir = lock_path + '.triggers'
+        self.leader_retry_seconds = leader_retry_seconds
+        self.trigger_poll_seconds = trigger_poll_seconds
+        self._lock = FileLock(lock_path)
+        self._tasks = {}
+        self._wakeup = threading.Event()
+        self._started = False
+        self._guard = threading.Lock()
+
+    def add(self, name, func, interval_seconds, initial_delay_seconds=0, jitter_fraction=0.1):
+        self._tasks[name] = ScheduledTask(name, func, interval_seconds, initial_delay_seconds, jitter_fraction)
+
+    @property
+    def is_leader(self):
+        return self._lock._fd is not None
+
+    def start(self):
+        """Starts the scheduler thread (once per process)."""
+        with self._guard:
+            if self._started:
+                return
+            threading.Thread(target=self._run, name='scheduler', daemon=True).start()
+            self._started = True
+
+    def trigger(self, name):
+        """
+        Requests an immediate run of task `name`. Returns False for an unknown task.
+        The run happens on the leader, whichever process receives the request.
+        """
+        if name not in self._tasks:
+            return False
+        os.makedirs(self.trigger_dir, exist_ok=True)
+        with open(os.path.join(self.trigger_dir, name), 'w') as marker:
+            marker.write(str(time.time()))
+        self._wakeup.set()
+        return True
+
+    def status(self):
+        """Returns the leader's latest run records, read from the shared state file."""
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            state = {"leader_pid": None, "tasks": []}
+        state["this_process_is_leader"] = self.is_leader
+        return state
+
+    def _run(self):
+        while not self._lock.try_acquire():
+            self._wakeup.wait(self.leader_retry_seconds)
+            self._wakeup.clear()
+        print(f"Scheduler: process {os.getpid()} is the maintenance leader")
+        self._write_state()
+
+        while True:
+            now = time.time()
+            for task in self._tasks.values():
+                if self._take_trigger(task.name) or task.next_run <= now:
+                    self._execute(task)
+            next_due = min((task.next_run for task in self._tasks.values()), default=now + 60)
+            self._wakeup.wait(max(0.0, min(next_due - time.time(), self.trigger_poll_seconds)))
+            self._wakeup.clear()
+
+    def _take_trigger(self, name):
+        try:
+            os.remove(os.path.join(self.trigger_dir, name))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _execute(self, task):
+        started = time.time()
+        task.last_started_at = started
+        try:
+            task.func()
+            task.last_error = None
+        except Exception as e:
+            task.failures += 1
+            task.last_error = str(e)
+            logging.error(f"Scheduled task {task.name} failed", exc_info=True)
+        finally:
+            task.runs += 1
+            task.last_duration_seconds = round(time.time() - started, 4)
+            task.schedule_next(time.time())
+            self._write_state()
+
+    def _write_state(self):
+        state = {"leader_pid": os.getpid(), "updated_at": time.time(),
+                 "tasks": [task.to_dict() for task in self._tasks.values()]}
+        tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.state_path)
+        except OSError:
+            logging.error("Could not write scheduler state", exc_info=True)
@@ -0,0 +1,106 @@
+import math
+import re
+
+import numpy as np
+
+# Categories scored in the prioritization table, in the order used for rating vectors
+CATEGORIES = (
+    "Strategic Alignment",
+    "Potential Impact",
+    "Complexity & Implementation Difficulty",
+    "Urgency & Necessity",
+    "Risk & Challenges",
+    "Hours Spent each month",
+    "Number of Employees",
+    "Number of Systems",
+    "Stakeholders Impacted",
+)
+_CATEGORY_INDEX = {category: i for i, category in enumerate(CATEGORIES)}
+
+# Matches a markdown table row with a bolded category name and extracts the percentage
+# from the third column. Compiled once at import rather than on every call.
+RATING_ROW_PATTERN = re.compile(
+    r"\|\s*\*\*(?P<category>[\w\s&]+?)\*\*\s*\|"  # 1. Category: Captures text between `| **` and `** |`
+    r".*?\|"                                     # 2. Rating: Non-greedy match for the second column
+    r"\s*(?P<percentage>\d+)%\s*\|",              # 3. Rating %: Captures the digits before a '%' in the third column
+    re.MULTILINE
+)
+
+
+def parse_ratings(markdown_text):
+    """
+    Extracts the `Rating %` of each known category from an analysis table.
+    Returns a vector (list of floats, in CATEGORIES order); categories that
+    were not found are 0, so they contribute nothing to the score.
+    """
+    vector = [0.0] * len(CATEGORIES)
+    for match in RATING_ROW_PATTERN.finditer(markdown_text):
+        i = _CATEGORY_INDEX.get(match.group("category").strip())
+        if i is not None:
+            vector[i] = float(match.group("percentage"))
+    return vector
+
+
+def parse_rating_percentages(markdown_text):
+    """
+    Like parse_ratings, but returns {category: Rating %} for only the categories
+    present in the table, in CATEGORIES order. Used where a missing row must not
+    read as a 0% rating, e.g. when summarizing an analysis for the chatbot.
+    """
+    found = {}
+    for match in RATING_ROW_PATTERN.finditer(markdown_text):
+        category = match.group("category").strip()
+        if category in _CATEGORY_INDEX:
+            found[category] = float(match.group("percentage"))
+    return {category: found[category] for category in CATEGORIES if category in found}
+
+
+def validate_weights(weights):
+    """
+    Checks a {category: weight} mapping and returns it as a weight vector.
+    Weights are fractions (0.35 for 35%) and must sum to 1. Categories that are
+    left out get weight 0. Raises ValueError describing the first problem found.
+    """
+    if not isinstance(weights, dict) or not weights:
+        raise ValueError("Weights must be a non-empty object mapping category names to weights.")
+
+    unknown = [category for category in weights if category not in _CATEGORY_INDEX]
+    if unknown:
+        raise ValueError(f"Unknown categories: {', '.join(unknown)}. Valid categories: {', '.join(CATEGORIES)}")
+
+    vector = np.zeros(len(CATEGORIES))
+    for category, weight in weights.items():
+        if isinstance(weight, bool) or not isinstance(weight, (int, float)) or not math.isfinite(weight) or weight < 0:
+            raise ValueError(f"Weight for '{category}' must be a non-negative number.")
+        vector[_CATEGORY_INDEX[category]] = weight
+
+    if not math.isclose(vector.sum(), 1.0, abs_tol=1e-6):
+        raise ValueError(f"Weights must sum to 1.0 (got {vector.sum():.4f}).")
+    return vector
+
+
+class ScoringEngine:
+    """
+    Computes weighted overall priority scores from analysis rating vectors.
+    Weights are validated once, when the engine is built.
+    """
+
+    def __init__(self, weights):
+        self.weights = dict(weights)
+        self._weight_vector = validate_weights(weights)
+
+    def score_vector(self, vector):
+        """Returns the overall score (a percentage, 2 decimals) for one rating vector."""
+        return round(float(np.dot(vector, self._weight_vector)), 2)
+
+    def score(self, markdown_text):
+        """Parses an analysis and returns its overall score."""
+        return self.score_vector(parse_ratings(markdown_text))
+
+    def score_matrix(self, matrix):
+        """
+        Scores many analyses in one vectorized pass. `matrix` has one rating
+        vector per row; returns a numpy array of scores.
+        """
+        matrix = np.asarray(matrix, dtype=float).reshape(-1, len(CATEGORIES))
+        return np.round(matrix @ self._weight_vector, 2)
@@ -0,0 +1,22 @@
+"""
+Production launcher for platforms without gunicorn (e.g. Windows):
+
+    python serve.py
+
+Serves the app with waitress: one process with Config.SERVER_THREADS threads.
+"""
+import waitress
+
+from config import Config
+
+if __name__ == '__main__':
+    import app as app_module
+
+    app_module.start_background_tasks()
+    waitress.serve(
+        app_module.create_app(),
+        host=Config.FLASK_HOST,
+        port=Config.FLASK_PORT,
+        threads=Config.SERVER_THREADS,
+        channel_timeout=Config.SERVER_TIMEOUT_SECONDS
+    )
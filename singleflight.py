@@ -0,0 +1,84 @@
+import threading
+
+
+class _Call:
+    """One in-flight computation and the callers waiting on it."""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+    def wait(self):
+        """Blocks until the leader finishes, then returns its result or re-raises its error."""
+        self._done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls with the same key into one execution.
+
+    The first caller for a key becomes the leader and does the work; callers
+    that arrive while it is running wait for it and receive the same result
+    (or exception). Nothing is remembered once the leader finishes, so this
+    only deduplicates overlapping calls. Persistent reuse is the caller's job.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def begin(self, key):
+        """
+        Joins the flight for `key`. Returns (call, is_leader). The leader must
+        later call finish(); everyone else calls call.wait().
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                return call, False
+            call = self._calls[key] = _Call()
+            return call, True
+
+    def finish(self, key, call, result=None, error=None):
+        """Publishes the leader's result (or error) to the waiters and closes the flight."""
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        call.result = result
+        call.error = error
+        call._done.set()
+
+    def do(self, key, func):
+        """
+        Runs func() once per concurrent group of callers with the same key.
+        Returns (result, shared), where shared is True for callers that waited
+        on another caller's execution.
+        """
+        call, leader = self.begin(key)
+        if not leader:
+            return call.wait(), True
+        result, error = None, None
+        try:
+            result = func()
+            return result, False
+        except Exception as e:
+            error = e
+            raise
+        except BaseException:
+            # Waiters get an ordinary error rather than the leader's interrupt
+            error = RuntimeError(f"The call for {key!r} was interrupted.")
+            raise
+        finally:
+            # Always closes the flight, even when the leader is interrupted (KeyboardInterrupt,
+            # SystemExit, a killed greenlet), so later callers for the key never wait forever
+            self.finish(key, call, result=result, error=error)
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
@@ -541,7 +541,77 @@ async function previewSelectedRequest() {
     }
 }
 
-/** Retrieves and displays AI-generated analysis for the selected row. @async */
+/**
+ * Reads a Server-Sent Events response body and calls `onEvent` for each event as it arrives.
+ * Each event's data is expected to be JSON.
+ * @param {Response} response - A fetch response with a text/event-stream body.
+ * @param {(eventName: string, payload: any) => void} onEvent - Callback for each parsed event.
+ * @async
+ */
+async function readEventStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const rawEvent = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            let eventName = 'message';
+            const dataLines = [];
+            rawEvent.split('\n').forEach(line => {
+                if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim());
+            });
+            if (dataLines.length > 0) onEvent(eventName, JSON.parse(dataLines.join('\n')));
+        }
+    }
+}
+
+/**
+ * Converts analysis Markdown to HTML with marked.js, falling back to preformatted text.
+ * @param {string} markdownText - The Markdown to render.
+ * @returns {string} The HTML markup.
+ */
+function renderMarkdown(markdownText) {
+    if (typeof marked !== 'undefined' && typeof marked.parse === 'function') {
+        try {
+            return marked.parse(markdownText);
+        } catch (markedError) {
+            console.error('Error parsing Markdown:', markedError);
+            return `<p style="color: red;">Error rendering Markdown: ${markedError.message}</p><pre>${markdownText}</pre>`;
+        }
+    }
+    console.warn('marked.js library is not available. Displaying raw Markdown.');
+    return `<pre>${markdownText}</pre>`;
+}
+
+/**
+ * Renders a completed analysis result with its report actions.
+ * @param {{index: number, title: string, directorate: string, analysis: string}} data - The analysis result.
+ */
+function renderAnalysisResult(data) {
+    let resultHTML = `<h3>Analysis for Row ${data.index}: ${data.title}</h3>`;
+    resultHTML += `<h4>Directorate: ${data.directorate}</h4>`;
+    resultHTML += renderMarkdown(data.analysis);
+    resultHTML += `<div class="report-actions" style="margin-top:20px;">
+                     <button onclick="downloadReport()">Download Report as PDF</button>
+                     <button onclick="copyReport()">Copy Report</button>
+                     <button onclick="emailReport()">Email Report</button>
+                   </div>`;
+    if (DOMElements.results) DOMElements.results.innerHTML = resultHTML;
+    applyHeatMapStyling();
+}
+
+/**
+ * Retrieves the AI-generated analysis for the selected row.
+ * The analysis is streamed and rendered incrementally as the model writes it;
+ * the final event carries the complete analysis including the weighted score.
+ * @async
+ */
 async function getSingleAnalysis() {
     if (!DOMElements.requestDropdown || !DOMElements.requestDropdown.value) { 
         showToast('No request selected.', 'error');
@@ -551,38 +621,54 @@ async function getSingleAnalysis() {
     showSpinner('Retrieving analysis, please wait...');
     try {
         if (typeof API_KEY === 'undefined') throw new Error("API_KEY is not available for analysis.");
-        const response = await fetch(`/prioritize/${rowIndex}`, {
+        const response = await fetch(`/prioritize/${rowIndex}/stream`, {
             method: 'GET',
             headers: { 'X-API-KEY': API_KEY },
         });
-        const data = await response.json();
-        if (!response.ok) throw new Error(data.error || `HTTP error! status: ${response.status}`);
-        if (data.error) throw new Error(data.error);
+        if (!response.ok) {
+            const errorData = await response.json().catch(() => ({}));
+            throw new Error(errorData.error || `HTTP error! status: ${response.status}`);
+        }
 
-        localStorage.setItem('latestAnalysis', data.analysis);
-        let htmlAnalysis = '';
-        if (typeof marked !== 'undefined' && typeof marked.parse === 'function') {
-            try {
-                htmlAnalysis = marked.parse(data.analysis);
-            } catch (markedError) {
-                console.error('Error parsing Markdown:', markedError);
-                htmlAnalysis = `<p style="color: red;">Error rendering Markdown: ${markedError.message}</p><pre>${data.analysis}</pre>`;
+        let streamedText = '';
+        let renderPending = false;
+        let result = null;
+        let streamError = null;
+        await readEventStream(response, (eventName, payload) => {
+            if (eventName === 'chunk') {
+                if (!streamedText) {
+                    hideSpinner();
+                    setStep(3);
+                }
+                streamedText += payload.text;
+                // Re-render at most once per frame while chunks arrive
+                if (!renderPending) {
+                    renderPending = true;
+                    requestAnimationFrame(() => {
+                        renderPending = false;
+                        if (!result && DOMElements.results) {
+                            DOMElements.results.innerHTML = `<h3>Analysing Row ${rowIndex}...</h3>` + renderMarkdown(streamedText);
+                        }
+                    });
+                }
+            } else if (eventName === 'done') {
+                result = payload;
+            } else if (eventName === 'error') {
+                streamError = payload.error;
             }
+        });
+        if (streamError) throw new Error(streamError);
+        if (!result) throw new Error('The analysis stream ended unexpectedly.');
+
+        // The chatbot refers to the analysis by id; the server keeps the full text
+        localStorage.removeItem('latestAnalysis');
+        if (result.analysis_id) {
+            localStorage.setItem('latestAnalysisId', result.analysis_id);
         } else {
-            console.warn('marked.js library is not available. Displaying raw Markdown.');
-            htmlAnalysis = `<pre>${data.analysis}</pre>`;
+            localStorage.removeItem('latestAnalysisId');
         }
         setStep(3);
-        let resultHTML = `<h3>Analysis for Row ${data.index}: ${data.title}</h3>`;
-        resultHTML += `<h4>Directorate: ${data.directorate}</h4>`;
-        resultHTML += htmlAnalysis;
-        resultHTML += `<div class="report-actions" style="margin-top:20px;">
-                         <button onclick="downloadReport()">Download Report as PDF</button>
-                         <button onclick="copyReport()">Copy Report</button>
-                         <button onclick="emailReport()">Email Report</button>
-                       </div>`;
-        if (DOMElements.results) DOMElements.results.innerHTML = resultHTML;
-        applyHeatMapStyling();
+        renderAnalysisResult(result);
         if (DOMElements.evaluatorField) DOMElements.evaluatorField.style.display = DISPLAY_BLOCK;
         if (DOMElements.resultsWrapper) DOMElements.resultsWrapper.scrollIntoView({ behavior: 'smooth' });
         showToast('Analysis retrieved successfully', 'success');
@@ -698,28 +784,24 @@ function copyReport() {
         });
 }
 
-/** Emails the analysis report as a PDF attachment. @async */
+/** Emails the analysis report; the server renders it from the stored analysis. @async */
 async function emailReport() {
     const email = prompt('Enter email address to send the report to:');
     if (!email || !/^\S+@\S+\.\S+$/.test(email)) {
         showToast('Please enter a valid email address.', 'error'); return;
     }
-    if (!DOMElements.resultsWrapper) {
+    const analysisId = localStorage.getItem('latestAnalysisId');
+    if (!analysisId) {
         showToast('Report content not found.', 'error'); return;
     }
-    if (typeof html2pdf === 'undefined') {
-        showToast('PDF library not loaded.', 'error'); console.error('html2pdf.js not loaded.'); return;
-    }
-    showSpinner('Generating PDF for email...');
+    const evaluator = DOMElements.reportEvaluatorNameInput ? DOMElements.reportEvaluatorNameInput.value.trim() : '';
+    showSpinner('Sending email...');
     try {
         if (typeof API_KEY === 'undefined') throw new Error("API_KEY is not available for sending email.");
-        const pdfDataUri = await html2pdf().from(DOMElements.resultsWrapper).output('datauristring');
-        const pdfBase64 = pdfDataUri.split(',')[1];
-        showSpinner('Sending email...');
         const response = await fetch('/send-report', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json', 'X-API-KEY': API_KEY },
-            body: JSON.stringify({ email: email, pdf: pdfBase64 }),
+            body: JSON.stringify({ email: email, analysis_id: analysisId, evaluator: evaluator }),
         });
         const responseData = await response.json();
         if (!response.ok) throw new Error(responseData.error || 'Failed to send email');
@@ -865,18 +947,49 @@ function initEventListeners() {
             if (!userQuery) return;
             appendMessage('user', userQuery);
             DOMElements.chatbotInput.value = '';
-            const latestAnalysis = localStorage.getItem('latestAnalysis') || '';
+            const latestAnalysisId = localStorage.getItem('latestAnalysisId') || '';
             showTypingIndicator();
             try {
                 if (typeof API_KEY === 'undefined') throw new Error("API_KEY is not available for chat.");
-                const response = await fetch('/chat', {
+                const response = await fetch('/chat/stream', {
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json', 'X-API-KEY': API_KEY },
-                    body: JSON.stringify({ query: userQuery, analysis: latestAnalysis }),
+                    body: JSON.stringify({ query: userQuery, analysis_id: latestAnalysisId }),
                 });
-                const data = await response.json();
-                if (!response.ok) throw new Error(data.response || data.error || `HTTP error! status: ${response.status}`);
-                appendMessage('bot', data.response || 'Sorry, I could not understand.');
+                if (!response.ok) {
+                    const errorData = await response.json().catch(() => ({}));
+                    throw new Error(errorData.response || errorData.error || `HTTP error! status: ${response.status}`);
+                }
+
+                // Stream the answer into a live bot message, then save the final text to history
+                let botTextEl = null;
+                let answer = '';
+                let streamError = null;
+                await readEventStream(response, (eventName, payload) => {
+                    if (eventName === 'chunk') {
+                        if (!botTextEl) {
+                            removeTypingIndicator();
+                            appendMessage('bot', '', undefined, false);
+                            botTextEl = DOMElements.chatbotMessages.lastElementChild.firstElementChild;
+                        }
+                        answer += payload.text;
+                        botTextEl.textContent = answer;
+                        DOMElements.chatbotMessages.scrollTop = DOMElements.chatbotMessages.scrollHeight;
+                    } else if (eventName === 'done') {
+                        answer = payload.response;
+                    } else if (eventName === 'error') {
+                        streamError = payload.error;
+                    }
+                });
+                if (streamError) throw new Error(streamError);
+
+                const finalAnswer = answer || 'Sorry, I could not understand.';
+                if (botTextEl) {
+                    botTextEl.textContent = finalAnswer;
+                    saveChatHistory('bot', finalAnswer, botTextEl.nextElementSibling.textContent);
+                } else {
+                    appendMessage('bot', finalAnswer);
+                }
             } catch (error) {
                 console.error('Chatbot send error:', error);
                 appendMessage('bot', `Error: ${error.message}`);
@@ -0,0 +1,57 @@
+import math
+import re
+
+# Rough average for English text with Gemini's tokenizer. An estimate is enough to
+# size budgets; the actual counts come back in each response's usage_metadata.
+CHARS_PER_TOKEN = 4
+
+_INLINE_WHITESPACE = re.compile("[ \t\f\v\u00a0]+")
+_BLANK_LINES = re.compile(r"\n\s*\n+")
+TRUNCATION_MARKER = " [...truncated]"
+
+
+def estimate_tokens(text):
+    """Estimates the token count of `text` without calling the API."""
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def normalize_whitespace(text):
+    """
+    Collapses runs of spaces and tabs, normalizes line endings and squeezes
+    blank lines, which pasted documents are full of.
+    """
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    text = _INLINE_WHITESPACE.sub(" ", text)
+    text = _BLANK_LINES.sub("\n", text)
+    return "\n".join(line.strip() for line in text.split("\n")).strip()
+
+
+def truncate_to_tokens(text, max_tokens):
+    """
+    Cuts `text` to roughly `max_tokens`, at a word boundary where possible,
+    and marks the cut. Returns (text, truncated).
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text, False
+    limit = max(0, max_tokens * CHARS_PER_TOKEN - len(TRUNCATION_MARKER))
+    cut = text[:limit]
+    # Prefer to end on whole words unless that would throw away most of the text
+    space = cut.rfind(" ")
+    if space > limit * 0.8:
+        cut = cut[:space]
+    return cut.rstrip() + TRUNCATION_MARKER, True
+
+
+def fit_field(value, max_tokens):
+    """Normalizes a free-text field and truncates it to its token budget. Returns (text, truncated)."""
+    return truncate_to_tokens(normalize_whitespace(str(value)), max_tokens)
+
+
+def output_token_limit(input_tokens, base, per_input_token, ceiling):
+    """
+    Sizes max_output_tokens for one call: a base allowance for the fixed parts of
+    the answer plus a share of the input size, capped at `ceiling`.
+    """
+    return int(min(ceiling, base + per_input_token * input_tokens))
@@ -0,0 +1,225 @@
+import logging
+import os
+import threading
+import time
+
+import metrics
+from utils import thread_connection
+
+
+class UploadQuotaError(Exception):
+    """Raised when a single upload is larger than the per-session quota."""
+
+    def __init__(self, size, quota):
+        super().__init__(f"Upload of {size} bytes exceeds the per-session quota of {quota} bytes")
+        self.size = size
+        self.quota = quota
+
+
+class UploadManager:
+    """
+    Manifest (SQLite) of upload files: owner session, size, last access and expiry.
+
+    Expiry walks an index ordered by expiry time instead of scanning the upload
+    directory. Per-session and global byte quotas are enforced when a file is
+    registered, evicting the least recently used uploads first. The manifest is
+    shared by all worker processes.
+    """
+
+    # Reads refresh an upload's expiry at most this often, to keep reads write-free
+    TOUCH_INTERVAL_SECONDS = 60
+    # Files younger than this may still be being written or about to be registered, so
+    # adopt_orphans leaves them alone
+    ORPHAN_GRACE_SECONDS = 600
+
+    def __init__(self, db_path, upload_folder, idle_ttl_seconds, session_quota_bytes, global_quota_bytes,
+                 on_delete=None):
+        self.db_path = db_path
+        self.upload_folder = upload_folder
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.session_quota_bytes = session_quota_bytes
+        self.global_quota_bytes = global_quota_bytes
+        self.on_delete = on_delete
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS uploads (
+                    path TEXT PRIMARY KEY,
+                    session_id TEXT,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_uploads_expires_at ON uploads(expires_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_uploads_last_access ON uploads(last_access)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_uploads_session ON uploads(session_id)")
+
+    def _connect(self):
+        return thread_connection(self._local, self.db_path, isolation_level=None)
+
+    def _expiry(self, last_access):
+        # The grace covers reads whose touch was skipped (see TOUCH_INTERVAL_SECONDS)
+        return last_access + self.idle_ttl_seconds + self.TOUCH_INTERVAL_SECONDS
+
+    def register(self, path, session_id):
+        """
+        Records a newly written upload owned by `session_id`, then enforces the
+        quotas by deleting that session's, then everyone's, least recently used
+        other uploads. Returns the evicted paths. Raises UploadQuotaError (and
+        deletes the file) if the upload alone exceeds the per-session quota.
+        """
+        size = os.path.getsize(path)
+        if size > self.session_quota_bytes:
+            self._delete_files([path], 'session_quota')
+            raise UploadQuotaError(size, self.session_quota_bytes)
+
+        now = time.time()
+        evicted = []
+        conn = self._connect()
+        # IMMEDIATE takes the write lock up front so concurrent registrations see each other's totals
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO uploads (path, session_id, size, created_at, last_access, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (path, session_id, size, now, now, self._expiry(now))
+            )
+            session_total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM uploads WHERE session_id = ?",
+                                         (session_id,)).fetchone()[0]
+            if session_total > self.session_quota_bytes:
+                evicted += [(p, 'session_quota') for p in self._select_lru(
+                    conn, session_total - self.session_quota_bytes, path, "session_id = ?", (session_id,))]
+            global_total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM uploads").fetchone()[0]
+            global_total -= sum(self._size(conn, p) for p, _ in evicted)
+            if global_total > self.global_quota_bytes:
+                already = {p for p, _ in evicted}
+                evicted += [(p, 'global_quota') for p in self._select_lru(
+                    conn, global_total - self.global_quota_bytes, path, "1 = 1", (), exclude=already)]
+            conn.executemany("DELETE FROM uploads WHERE path = ?", ((p,) for p, _ in evicted))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        for reason in ('session_quota', 'global_quota'):
+            self._delete_files([p for p, r in evicted if r == reason], reason)
+        return [p for p, _ in evicted]
+
+    @staticmethod
+    def _size(conn, path):
+        row = conn.execute("SELECT size FROM uploads WHERE path = ?", (path,)).fetchone()
+        return row[0] if row else 0
+
+    @staticmethod
+    def _select_lru(conn, bytes_needed, keep_path, where, params, exclude=()):
+        """Picks least recently used uploads matching `where` until `bytes_needed` are freed."""
+        chosen = []
+        query = f"SELECT path, size FROM uploads WHERE {where} AND path != ? ORDER BY last_access"
+        for other_path, size in conn.execute(query, (*params, keep_path)):
+            if other_path in exclude:
+                continue
+            chosen.append(other_path)
+            bytes_needed -= size
+            if bytes_needed <= 0:
+                break
+        return chosen
+
+    def touch(self, path):
+        """
+        Marks an upload as used, extending its expiry. Returns False if the
+        upload is not (or no longer) in the manifest.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT last_access FROM uploads WHERE path = ?", (path,)).fetchone()
+            if row is None:
+                return False
+            if now - row[0] >= self.TOUCH_INTERVAL_SECONDS:
+                conn.execute("UPDATE uploads SET last_access = ?, expires_at = ? WHERE path = ?",
+                             (now, self._expiry(now), path))
+        return True
+
+    def release(self, path, reason='released'):
+        """Deletes one upload and its manifest entry."""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM uploads WHERE path = ?", (path,))
+        self._delete_files([path], reason)
+
+    def release_session(self, session_id, keep=None):
+        """Deletes every upload owned by `session_id` (except `keep`). Returns the count."""
+        with self._connect() as conn:
+            paths = [row[0] for row in conn.execute(
+                "SELECT path FROM uploads WHERE session_id = ? AND path != ?", (session_id, keep or ''))]
+            conn.executemany("DELETE FROM uploads WHERE path = ?", ((p,) for p in paths))
+        self._delete_files(paths, 'released')
+        return len(paths)
+
+    def expire(self, now=None):
+        """Deletes uploads whose expiry has passed, oldest first, via the expiry index."""
+        now = now if now is not None else time.time()
+        with self._connect() as conn:
+            paths = [row[0] for row in conn.execute(
+                "SELECT path FROM uploads WHERE expires_at < ? ORDER BY expires_at", (now,))]
+            conn.executemany("DELETE FROM uploads WHERE path = ?", ((p,) for p in paths))
+        self._delete_files(paths, 'expired')
+        return len(paths)
+
+    def shrink_to(self, target_bytes, reason='storage_pressure'):
+        """Evicts least recently used uploads until the total is at most `target_bytes`."""
+        with self._connect() as conn:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM uploads").fetchone()[0]
+            if total <= target_bytes:
+                return 0
+            paths = self._select_lru(conn, total - target_bytes, '', "1 = 1", ())
+            conn.executemany("DELETE FROM uploads WHERE path = ?", ((p,) for p in paths))
+        self._delete_files(paths, reason)
+        return len(paths)
+
+    def adopt_orphans(self):
+        """
+        Adds files in the upload folder that the manifest does not know (e.g. written
+        before it existed, or by a process that crashed before registering) with an
+        expiry based on their mtime. One directory scan; meant for startup. Temporary
+        files of uploads in progress, and files younger than ORPHAN_GRACE_SECONDS, are
+        skipped.
+        """
+        if not os.path.isdir(self.upload_folder):
+            return 0
+        adopt_before = time.time() - self.ORPHAN_GRACE_SECONDS
+        with self._connect() as conn:
+            known = {row[0] for row in conn.execute("SELECT path FROM uploads")}
+            orphans = []
+            for entry in os.scandir(self.upload_folder):
+                if entry.is_file() and entry.path not in known and not entry.name.endswith('.tmp'):
+                    stat = entry.stat()
+                    if stat.st_mtime > adopt_before:
+                        continue
+                    orphans.append((entry.path, None, stat.st_size, stat.st_mtime, stat.st_mtime,
+                                    self._expiry(stat.st_mtime)))
+            conn.executemany(
+                "INSERT OR IGNORE INTO uploads (path, session_id, size, created_at, last_access, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)", orphans)
+        return len(orphans)
+
+    def usage(self):
+        with self._connect() as conn:
+            count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM uploads").fetchone()
+        return {"files": count, "bytes": total, "global_quota_bytes": self.global_quota_bytes,
+                "session_quota_bytes": self.session_quota_bytes}
+
+    def _delete_files(self, paths, reason):
+        for path in paths:
+            try:
+                os.remove(path)
+                print(f"Deleted upload ({reason}): {os.path.basename(path)}")
+            except FileNotFoundError:
+                pass
+            except OSError:
+                logging.error(f"Could not delete upload {path}", exc_info=True)
+                continue
+            if self.on_delete is not None:
+                self.on_delete(path)
+            metrics.UPLOADS_DELETED.inc(reason=reason)
@@ -0,0 +1,162 @@
+import os
+import uuid
+
+# Uploads are stored as uncompressed Arrow IPC (Feather v2) files so they can be
+# memory-mapped and sliced without parsing. Older uploads may still be CSV.
+# pandas and pyarrow are imported inside the functions that use them, so importing
+# this module (and starting the app) does not load them.
+ARROW_SUFFIX = '.arrow'
+CSV_SUFFIX = '.csv'
+
+# Rows per record batch. Smaller batches mean less data is touched per row lookup.
+RECORD_BATCH_ROWS = 1024
+
+# Rows parsed per chunk while ingesting an uploaded CSV. Bounds peak memory per upload.
+INGEST_CHUNK_ROWS = 5000
+
+
+class EmptyUploadError(ValueError):
+    """Raised when an uploaded CSV has no header or content."""
+
+
+class MissingColumnsError(ValueError):
+    """Raised when an uploaded CSV's header lacks required columns."""
+
+    def __init__(self, missing_columns):
+        super().__init__(f"Missing required columns: {', '.join(missing_columns)}")
+        self.missing_columns = missing_columns
+
+
+def ingest_csv(stream, required_columns, upload_folder, title_column, chunk_rows=INGEST_CHUNK_ROWS):
+    """
+    Parses an uploaded CSV stream in chunks and writes it to `upload_folder` as
+    an Arrow IPC file, so memory use stays bounded regardless of file size.
+
+    The header is validated against `required_columns` on the first chunk, so
+    bad files are rejected before the rest is parsed (MissingColumnsError).
+    All columns are stored as strings to keep one schema across chunks.
+
+    Returns (path, titles) where titles holds one display title per row,
+    falling back to "Row N - No Title" for rows without a value in `title_column`.
+    Raises EmptyUploadError for an empty file.
+    """
+    import pandas as pd
+    import pyarrow as pa
+
+    os.makedirs(upload_folder, exist_ok=True)
+    path = os.path.join(upload_folder, f"uploaded_data_{uuid.uuid4()}{ARROW_SUFFIX}")
+    # Write to a temporary name first so readers never see a half-written file
+    tmp_path = path + '.tmp'
+
+    try:
+        reader = pd.read_csv(stream, chunksize=chunk_rows, dtype=str)
+    except pd.errors.EmptyDataError:
+        raise EmptyUploadError("The uploaded CSV is empty") from None
+    sink = writer = schema = None
+    titles = []
+    try:
+        for chunk in reader:
+            # Clean headers by stripping extra spaces
+            chunk.columns = chunk.columns.str.strip()
+            if writer is None:
+                missing_cols = [col for col in required_columns if col not in chunk.columns]
+                if missing_cols:
+                    raise MissingColumnsError(missing_cols)
+                schema = pa.schema([(col, pa.string()) for col in chunk.columns])
+                sink = pa.OSFile(tmp_path, 'wb')
+                writer = pa.ipc.new_file(sink, schema)
+
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False),
+                               max_chunksize=RECORD_BATCH_ROWS)
+
+            # The chunk index continues across chunks, so it is the global row index
+            fallback = 'Row ' + pd.Series(chunk.index + 1, index=chunk.index).astype(str) + ' - No Title'
+            titles.extend(chunk[title_column].fillna(fallback).tolist())
+
+        writer.close()
+        sink.close()
+        os.replace(tmp_path, path)
+    except BaseException:
+        if sink is not None:
+            sink.close()
+            os.remove(tmp_path)
+        raise
+    finally:
+        reader.close()
+    return path, titles
+
+
+def is_csv(path):
+    return path.lower().endswith(CSV_SUFFIX)
+
+
+def count_rows(path, df_cache):
+    """
+    Returns the number of rows in an upload. Arrow files answer from batch
+    metadata; legacy CSV files go through the shared DataFrame cache.
+    """
+    if is_csv(path):
+        return len(df_cache.get(path))
+
+    import pyarrow as pa
+    with pa.memory_map(path, 'r') as source:
+        reader = pa.ipc.open_file(source)
+        return sum(reader.get_batch(i).num_rows for i in range(reader.num_record_batches))
+
+
+def read_row(path, row_index, df_cache):
+    """
+    Returns a single upload row as a dict, with missing values as None.
+    Raises IndexError if `row_index` is out of range and FileNotFoundError if
+    the upload no longer exists.
+    """
+    if row_index < 0:
+        raise IndexError(row_index)
+
+    if is_csv(path):
+        df = df_cache.get(path)
+        if row_index >= len(df):
+            raise IndexError(row_index)
+        row_series = df.iloc[row_index]
+        return row_series.where(row_series.notna(), None).to_dict()
+
+    # Memory-mapped batches are zero-copy views; only the requested row is materialized
+    import pyarrow as pa
+    with pa.memory_map(path, 'r') as source:
+        reader = pa.ipc.open_file(source)
+        offset = row_index
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            if offset < batch.num_rows:
+                return batch.slice(offset, 1).to_pylist()[0]
+            offset -= batch.num_rows
+    raise IndexError(row_index)
+
+
+def read_rows(path, start, stop, df_cache):
+    """
+    Returns rows `start` (inclusive) to `stop` (exclusive) of an upload as a list
+    of (row_index, row dict) pairs. The range is clipped to the rows available.
+    """
+    if is_csv(path):
+        df = df_cache.get(path)
+        window = df.iloc[start:stop]
+        window = window.astype(object).where(window.notna(), None)
+        return list(zip(range(start, start + len(window)), window.to_dict(orient='records')))
+
+    import pyarrow as pa
+    rows = []
+    with pa.memory_map(path, 'r') as source:
+        reader = pa.ipc.open_file(source)
+        batch_start = 0
+        for i in range(reader.num_record_batches):
+            if batch_start >= stop:
+                break
+            batch = reader.get_batch(i)
+            batch_stop = batch_start + batch.num_rows
+            lo, hi = max(start, batch_start), min(stop, batch_stop)
+            if lo < hi:
+                records = batch.slice(lo - batch_start, hi - lo).to_pylist()
+                rows.extend(zip(range(lo, hi), records))
+            batch_start = batch_stop
+    return rows
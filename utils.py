@@ -0,0 +1,30 @@
+import os
+import random
+import sqlite3
+
+
+def thread_connection(local, db_path, **connect_kwargs):
+    """
+    Returns this thread's SQLite connection to `db_path`, kept in `local` (a
+    threading.local owned by the store), opening it in WAL mode on first use.
+    sqlite3 connections must not be shared across threads, nor with a forked
+    child (the master's connection is inherited by preloaded workers), so a
+    connection made before a fork is replaced.
+    """
+    conn = getattr(local, 'conn', None)
+    if conn is None or local.pid != os.getpid():
+        conn = sqlite3.connect(db_path, timeout=10, **connect_kwargs)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        local.conn = conn
+        local.pid = os.getpid()
+    return conn
+
+
+def backoff_delay(attempt, base_seconds, max_seconds):
+    """
+    Seconds to wait before retry number `attempt` (from 1): exponential backoff
+    capped at `max_seconds`, with "equal jitter" (half fixed, half random).
+    """
+    delay = min(max_seconds, base_seconds * 2 ** (attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2)